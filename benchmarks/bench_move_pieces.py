@@ -0,0 +1,96 @@
+"""
+Measures how long updating the spatial hash takes when a selection of 100, 1k
+and 10k pieces is dropped, and when one merged piece of 100, 1k and 10k
+members is dropped, compared with taking every member out of the hash and
+putting it back like the model used to. Snapping is turned off, so that only
+the index update is measured.
+
+Also measures a late-game snap, where a single piece is dropped next to the
+merged piece of 10k members and snaps onto it, compared with taking every
+member of the merged piece out of the hash and putting it back, which is what
+each snap used to cost.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_move_pieces
+"""
+import random
+import time
+import timeit
+
+import src.settings as settings
+from src.model import Model
+
+
+NX, NY = 125, 100
+REPEAT = 5
+
+
+def main():
+    settings.image = settings.Image(width=NX * 100, height=NY * 100)
+    settings.gameplay = settings.Gameplay(
+        nx=NX, ny=NY, piece_rotation=False, cut_cache_size=0)
+    model = Model()
+    model.reset(seed=0)
+
+    def reindex(pids, dx, dy):
+        for pid in pids:
+            piece = model.pieces[pid]
+            model._unindex_piece(piece)
+            piece.x += dx
+            piece.y += dy
+            model._index_piece(piece)
+
+    def translate(pids, dx, dy):
+        model.move_pieces(pids, dx, dy, snap_to_neighbours=False)
+
+    def run(description, pids):
+        for name, move in [('reinsert', reindex), ('translate', translate)]:
+            seconds = min(timeit.repeat(
+                lambda: move(pids, 37, -12), number=1, repeat=REPEAT))
+            print(f"{description:>22}, {name:>9}: {seconds * 1000:8.2f} ms")
+
+    for num_selected in [100, 1_000, 10_000]:
+        pids = random.Random(0).sample(list(model.pieces), num_selected)
+        run(f"{num_selected} pieces", pids)
+
+    # Pieces are merged in order, so that each merged piece is one cluster
+    merged = 0
+    for num_members in [100, 1_000, 10_000]:
+        label = model.clusters.find(0)
+        for pid in range(merged + 1, num_members):
+            model.clusters.union(label, pid)
+            model.pieces.pop(pid)
+        merged = num_members - 1
+        model._build_spatial_hash()
+        run(f"1 piece, {num_members} members", [label])
+
+    def reindex_merged():
+        piece = model.pieces[model.clusters.find(0)]
+        model._unindex_piece(piece)
+        model._index_piece(piece)
+
+    def snap():
+        # The snapped piece keeps its pid, so the label of the merged piece
+        # changes with every snap
+        label = model.clusters.find(0)
+        pid = min(
+            pid for pid in model.clusters.neighbours(label)
+            if model.clusters.cluster_size(pid) == 1
+        )
+        big = model.pieces[label]
+        model.set_piece_position(model.pieces[pid], big.x + 3, big.y + 2)
+        start = time.perf_counter()
+        model.move_pieces([pid], -1, -1)
+        return time.perf_counter() - start
+
+    description = f"snap, {model.pieces[label].num_members} members"
+    for name, seconds in [
+        ('reinsert', min(timeit.repeat(
+            reindex_merged, number=1, repeat=REPEAT))),
+        ('snap', min(snap() for _ in range(REPEAT))),
+    ]:
+        print(f"{description:>22}, {name:>9}: {seconds * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Compares moving and querying 50k pieces through the PieceStore arrays with
+doing the same thing one Piece at a time.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_piece_store
+"""
+import timeit
+
+import numpy as np
+
+from src.bezier import Point, Rectangle
+from src.model import Piece, PieceStore
+
+
+NUM_PIECES = 50_000
+REPEAT = 5
+
+
+def make_pieces(store):
+    rng = np.random.default_rng(0)
+    store.set_positions(
+        np.arange(NUM_PIECES),
+        rng.uniform(0, 10000, NUM_PIECES),
+        rng.uniform(0, 10000, NUM_PIECES)
+    )
+    return {
+        pid: Piece(
+            pid=pid,
+            polygons=[],
+            bounding_box=Rectangle(),
+            origin=Point(),
+            x=store.x[pid],
+            y=store.y[pid],
+            store=store
+        )
+        for pid in range(NUM_PIECES)
+    }
+
+
+def main():
+    store = PieceStore(NUM_PIECES)
+    pieces = make_pieces(store)
+    pids = np.arange(NUM_PIECES)
+
+    def move_loop():
+        for piece in pieces.values():
+            piece.x += 1
+            piece.y -= 1
+
+    def move_store():
+        store.move(pids, 1, -1)
+
+    def query_loop():
+        return [
+            piece.pid for piece in pieces.values()
+            if 2500 <= piece.x <= 7500 and 2500 <= piece.y <= 7500
+        ]
+
+    def query_store():
+        return store.pids_in_rect(pids, 2500, 2500, 7500, 7500)
+
+    assert query_loop() == query_store().tolist()
+
+    for name, function in [
+        ('move, per piece', move_loop),
+        ('move, store', move_store),
+        ('query, per piece', query_loop),
+        ('query, store', query_store),
+    ]:
+        seconds = min(timeit.repeat(function, number=1, repeat=REPEAT))
+        print(f"{name:>20}: {seconds * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Compares the columnar save format of src.savefile with the bz2 compressed
+pickle of Model.to_dict that quicksave used before, for a 10k piece game
+with some pieces merged. Reading a file is timed separately from restoring
+the model from it, since restoring regenerates the cut from the seed in the
+same way for both formats.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_save_format
+"""
+import os
+import tempfile
+import time
+
+from compress_pickle import dump, load
+
+import src.settings as settings
+from src import savefile
+from src.model import Model
+
+
+NX = 100
+NY = 100
+NUM_MERGES = 2000
+REPEAT = 3
+
+
+def make_model():
+    settings.image = settings.Image(width=NX * 50, height=NY * 50)
+    settings.gameplay = settings.Gameplay(
+        nx=NX, ny=NY, piece_rotation=True, cut_cache_size=0)
+    model = Model()
+    model.reset(seed=0)
+    model.merge_random_pieces(NUM_MERGES)
+    return model
+
+
+def best_of(function):
+    seconds = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds), result
+
+
+def save_pickle(model, path):
+    dump(
+        obj=model.to_dict(),
+        path=path,
+        compression='bz2',
+        set_default_extension=False
+    )
+
+
+def read_pickle(path):
+    return load(path, compression='bz2', set_default_extension=False)
+
+
+def save_columns(model, path):
+    savefile.save(path, *model.to_arrays())
+
+
+def read_columns(path):
+    meta, arrays = savefile.load(path)
+    # Touch every array, so that the memory mapped pages are actually read
+    for array in arrays.values():
+        array.sum()
+    return meta, arrays
+
+
+def restore_columns(data):
+    return Model.from_arrays(*data)
+
+
+def main():
+    model = make_model()
+    with tempfile.TemporaryDirectory() as folder:
+        for name, save, read, restore in [
+            ('bz2 pickle', save_pickle, read_pickle, Model.from_dict),
+            ('columnar', save_columns, read_columns, restore_columns),
+        ]:
+            path = os.path.join(folder, f'{name}.sav')
+            save_seconds, _ = best_of(lambda: save(model, path))
+            read_seconds, data = best_of(lambda: read(path))
+            restore_seconds, _ = best_of(lambda: restore(data))
+            print(
+                f"{name:>10}: {os.path.getsize(path) / 1024:8.1f} KiB, "
+                f"save {save_seconds * 1000:8.1f} ms, "
+                f"read {read_seconds * 1000:8.1f} ms, "
+                f"restore {restore_seconds:6.2f} s"
+            )
+
+
+if __name__ == '__main__':
+    main()
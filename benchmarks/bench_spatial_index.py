@@ -0,0 +1,71 @@
+"""
+Compares the SpatialHash with pyqtree, which the model used before, for 10k
+and 100k pieces. Each step of the drag traffic finds the piece under a random
+point, like a click, and moves a random piece a short distance.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_spatial_index
+"""
+import random
+import time
+
+from pyqtree import Index as QuadTree
+
+from src.spatial import SpatialHash
+
+
+PIECE_SIZE = 100
+NUM_STEPS = 20_000
+
+
+def make_boxes(num_pieces, rng):
+    side = int(num_pieces ** 0.5) * PIECE_SIZE * 2
+    return [
+        (x, y, x + PIECE_SIZE, y + PIECE_SIZE)
+        for x, y in (
+            (rng.uniform(0, side), rng.uniform(0, side))
+            for _ in range(num_pieces)
+        )
+    ], side
+
+
+def drag_traffic(index, boxes, side, rng, items):
+    start = time.perf_counter()
+    for _ in range(NUM_STEPS):
+        x, y = rng.uniform(0, side), rng.uniform(0, side)
+        index.intersect((x, y, x, y))
+
+        pid = rng.randrange(len(boxes))
+        left, bottom, right, top = boxes[pid]
+        dx, dy = rng.uniform(-20, 20), rng.uniform(-20, 20)
+        index.remove(items[pid], boxes[pid])
+        boxes[pid] = (left + dx, bottom + dy, right + dx, top + dy)
+        index.insert(items[pid], boxes[pid])
+
+    return time.perf_counter() - start
+
+
+def main():
+    for num_pieces in [10_000, 100_000]:
+        boxes, side = make_boxes(num_pieces, random.Random(0))
+        # pyqtree finds items to remove by comparing them, so plain ints
+        # are used as items for both.
+        items = list(range(num_pieces))
+
+        for name, index in [
+            ('pyqtree', QuadTree(bbox=(-side, -side, 2 * side, 2 * side))),
+            ('spatial hash', SpatialHash(PIECE_SIZE, PIECE_SIZE)),
+        ]:
+            for item, box in zip(items, boxes):
+                index.insert(item, box)
+
+            seconds = drag_traffic(
+                index, list(boxes), side, random.Random(1), items)
+            print(
+                f"{num_pieces:>7} pieces, {name:>12}: "
+                f"{seconds / NUM_STEPS * 1e6:8.1f} µs per step"
+            )
+
+
+if __name__ == '__main__':
+    main()
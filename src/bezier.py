@@ -5,6 +5,8 @@ from dataclasses import dataclass
 from typing import List
 from abc import ABC, abstractmethod
 
+import numpy as np
+
 
 @dataclass
 class Point:
@@ -91,6 +93,14 @@ class Bezier:
             self.at(t/n) for t in range(n)
         ]
 
+    def control_points(self):
+        return np.array([
+            self.p1.tuple(),
+            self.p2.tuple(),
+            self.p3.tuple(),
+            self.p4.tuple()
+        ])
+
     def at(self, t: float) -> Point:
         return (
             self.p1 * (1 - t) ** 3 +
@@ -214,6 +224,15 @@ class CurvedEdge(Edge):
             self.b4.evaluate(n)
         ]))
 
+    def control_points(self):
+        # (4, 4, 2) array, one row of control points per Bezier curve
+        return np.stack([
+            self.b1.control_points(),
+            self.b2.control_points(),
+            self.b3.control_points(),
+            self.b4.control_points()
+        ])
+
     def reverse(self):
         return CurvedEdge(
             self.b4.reverse(),
@@ -264,7 +283,11 @@ class CurvedEdge(Edge):
         )
 
     @classmethod
-    def random(cls):
+    def random(cls, rng=random):
+        """
+        :param rng: Source of randomness, e.g. a seeded random.Random
+        instance. Defaults to the global random module.
+        """
         default_points = [
             (50, 20),
             (100, 25),
@@ -277,57 +300,110 @@ class CurvedEdge(Edge):
         ]
         random_points = [
             Point(
-                x + random.randint(-5, 5),
-                y + random.randint(-5, 5))
+                x + rng.randint(-5, 5),
+                y + rng.randint(-5, 5))
             for (x, y) in default_points]
 
         # 50% chance to flip the edge around the x-axis, effectively making the
         # "ear" point the other direction.
-        if random.random() < 0.5:
+        if rng.random() < 0.5:
             random_points = [Point(p.x, -p.y) for p in random_points]
 
         return cls.from_minimal(random_points)
 
 
-def make_random_edges(num_edges):
-    edges = {i: CurvedEdge.random() for i in range(num_edges)}
+def make_random_edges(num_edges, rng=random):
+    edges = {i: CurvedEdge.random(rng) for i in range(num_edges)}
     edges[-1] = FlatEdge(Point(0, 0), Point(200, 0))
     return edges
 
 
+def edge_control_points(edges, num_edges):
+    """
+    Collects the control points of the curved edges 0, ..., num_edges - 1
+    into a single array, so that they can be transformed and evaluated all at
+    once instead of one Bezier at a time.
+    :return: (num_edges, 4, 4, 2) array
+    """
+    control_points = np.empty((num_edges, 4, 4, 2))
+    for i in range(num_edges):
+        control_points[i] = edges[i].control_points()
+    return control_points
+
+
+def sample_beziers(control_points, counts):
+    """
+    Evaluates each cubic Bezier curve i at t = 0, 1/counts[i], ...,
+    (counts[i] - 1)/counts[i], i.e. like Bezier.evaluate but with a different
+    number of samples for every curve.
+    :param control_points: (num_curves, 4, 2) array of control points
+    :param counts: (num_curves,) int array of samples per curve
+    :return: (sum(counts), 2) array of points, curve by curve
+    """
+    curve = np.repeat(np.arange(len(counts)), counts)
+    first = np.cumsum(counts) - counts
+    t = (np.arange(len(curve)) - first[curve]) / counts[curve]
+    s = 1 - t
+    basis = np.stack([s ** 3, 3 * s ** 2 * t, 3 * s * t ** 2, t ** 3], axis=1)
+    return np.einsum('ij,ijk->ik', basis, control_points[curve])
+
+
+def flatness_segments(control_points, tolerance, max_segments=32):
+    """
+    The number of straight segments needed for each cubic Bezier curve to
+    stay within tolerance of the true curve, by Wang's formula. Flat parts of
+    an edge get few segments and tight curves around the "ear" get many.
+    :param control_points: (num_curves, 4, 2) array of control points
+    :param tolerance: Maximum distance between curve and polygon, in the same
+    unit as the control points.
+    :return: (num_curves,) int array
+    """
+    second_differences = (
+        control_points[:, :-2] -
+        2 * control_points[:, 1:-1] +
+        control_points[:, 2:]
+    )
+    m = np.linalg.norm(second_differences, axis=-1).max(axis=-1)
+    return np.clip(
+        np.ceil(np.sqrt(0.75 * m / tolerance)),
+        1,
+        max_segments
+    ).astype(np.int64)
+
+
+def to_array(points):
+    """
+    Converts a list of Points to a (n, 2) array. Arrays are passed through
+    unchanged.
+    """
+    if isinstance(points, np.ndarray):
+        return points
+    return np.array([p.tuple() for p in points], dtype=float).reshape(-1, 2)
+
+
+def to_points(array):
+    # The inverse of to_array, for code that still wants Point objects
+    return [Point(x, y) for x, y in np.asarray(array).tolist()]
+
+
 # This is the winding algorithm, adapted from
-# http://geomalgorithms.com/a03-_inclusion.html
+# http://geomalgorithms.com/a03-_inclusion.html, evaluated for all edges of
+# the polygon at once.
 def point_in_polygon(p, polygon):
-    def is_left(p0: Point, p1: Point, p2: Point) -> float:
-        return (p1.x - p0.x) * (p2.y - p0.y) - (p2.x - p0.x) * (p1.y - p0.y)
+    polygon = to_array(polygon)
+    x0, y0 = polygon[:, 0], polygon[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    is_left = (x1 - x0) * (p.y - y0) - (p.x - x0) * (y1 - y0)
 
-    n = len(polygon) - 1
-    winding_number = 0
-    for i in range(n):
-        if polygon[i].y <= p.y:
-            if polygon[i + 1].y > p.y:
-                if is_left(polygon[i], polygon[i + 1], p) > 0:
-                    winding_number += 1
-        elif polygon[i + 1].y <= p.y:
-            if is_left(polygon[i], polygon[i + 1], p) < 0:
-                winding_number -= 1
-
-    return winding_number != 0
+    upward = (y0 <= p.y) & (y1 > p.y) & (is_left > 0)
+    downward = (y0 > p.y) & (y1 <= p.y) & (is_left < 0)
+    return np.count_nonzero(upward) != np.count_nonzero(downward)
 
 
 def bounding_box(polygon):
-    left = bottom = math.inf
-    right = top = -math.inf
-    for p in polygon:
-        if p.x < left:
-            left = p.x
-        elif p.x > right:
-            right = p.x
-        if p.y < bottom:
-            bottom = p.y
-        elif p.y > top:
-            top = p.y
-
+    polygon = to_array(polygon)
+    left, bottom = polygon.min(axis=0).tolist()
+    right, top = polygon.max(axis=0).tolist()
     return Rectangle(
         left=left,
         right=right,
@@ -345,12 +421,11 @@ def center_point(points):
 
 
 def rotate_points(points, pivot, angle):
+    """
+    :param points: (n, 2) array, or list of Points
+    :return: (n, 2) array of the points rotated around the pivot
+    """
     c = math.cos(angle)
     s = math.sin(angle)
-    rotated_points = []
-    for p in points:
-        p -= pivot
-        p = Point(p.x*c - p.y*s, p.x*s + p.y*c)
-        rotated_points.append(p + pivot)
-
-    return rotated_points
+    pivot = np.array(pivot.tuple())
+    return (to_array(points) - pivot) @ np.array([[c, s], [-s, c]]) + pivot
@@ -0,0 +1,93 @@
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+
+class CutCache:
+    """
+    On-disk cache of everything that is expensive to compute when a puzzle
+    is started, but is fully determined by the image size, the grid, the seed
+    and how the Beziers are sampled: the contour buffers, the triangle
+    indices and the normal map.
+
+    Each entry is a directory of .npy files, which are memory mapped when
+    loaded. An entry is marked as used by touching its directory, and when
+    the cache grows beyond max_bytes, the least recently used entries are
+    deleted.
+    """
+    def __init__(self, path='cache', max_bytes=500 * 2 ** 20):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(image_width, image_height, nx, ny, seed, sampling):
+        """
+        :param sampling: Number of samples per Bezier, or the flatness
+        tolerance when sampling adaptively.
+        """
+        return f"{image_width}x{image_height}_{nx}x{ny}_{seed}_{sampling}"
+
+    def load(self, key, *names):
+        """
+        :return: Dict of read-only memory mapped arrays, or None unless all
+        the requested arrays are in the cache.
+        """
+        if not self.is_enabled:
+            return None
+
+        entry = os.path.join(self.path, key)
+        paths = {name: os.path.join(entry, f'{name}.npy') for name in names}
+        if not all(map(os.path.exists, paths.values())):
+            return None
+
+        os.utime(entry)
+        return {
+            name: np.load(path, mmap_mode='r')
+            for name, path in paths.items()
+        }
+
+    def store(self, key, **arrays):
+        if not self.is_enabled:
+            return
+
+        entry = os.path.join(self.path, key)
+        os.makedirs(entry, exist_ok=True)
+        for name, array in arrays.items():
+            # Write to a temporary file first, so that an interrupted write
+            # never leaves a truncated array behind.
+            tmp = os.path.join(entry, f'{uuid.uuid4().hex}.tmp.npy')
+            np.save(tmp, np.ascontiguousarray(array))
+            os.replace(tmp, os.path.join(entry, f'{name}.npy'))
+
+        os.utime(entry)
+        self.evict()
+
+    def evict(self):
+        entries = sorted(
+            (
+                os.path.join(self.path, name)
+                for name in os.listdir(self.path)
+            ),
+            key=os.path.getmtime
+        )
+        sizes = [_directory_size(entry) for entry in entries]
+        total = sum(sizes)
+        # Never evict the most recently used entry, even if it alone is
+        # bigger than the cache.
+        for entry, size in zip(entries[:-1], sizes):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    @property
+    def is_enabled(self):
+        return self.max_bytes > 0
+
+
+def _directory_size(path):
+    return sum(
+        entry.stat().st_size for entry in os.scandir(path) if entry.is_file()
+    )
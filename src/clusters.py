@@ -0,0 +1,129 @@
+class ClusterSet:
+    """
+    Disjoint sets of pieces, i.e. which pieces have been merged into which
+    cluster. Union by size and path compression make find and union run in
+    O(α(n)) amortized time, so that merging two large clusters costs about
+    the same as merging two single pieces.
+
+    Each cluster is identified by a label, which is the pid of one of its
+    members and the key of the cluster in Model.pieces. Internally, the root
+    of the tree may be a different member than the label.
+
+    The members of a cluster form a circular linked list, so that two lists
+    are concatenated in O(1) on union. The neighbours of each cluster are
+    kept as counts of the piece edges that it shares with every other
+    cluster, and are merged into the larger of the two clusters on union.
+    """
+    def __init__(self, num_pieces):
+        self.parent = list(range(num_pieces))
+        self.size = [1] * num_pieces
+        self.next = list(range(num_pieces))
+        self.label = list(range(num_pieces))
+        self.adjacency = [{} for _ in range(num_pieces)]
+        self.num_clusters = num_pieces
+
+    def connect(self, pid1, pid2):
+        """
+        Records that the pieces pid1 and pid2 share an edge. Should be called
+        once for each pair of neighbouring pieces.
+        """
+        root1 = self._root(pid1)
+        root2 = self._root(pid2)
+        if root1 == root2:
+            return
+        adjacency1 = self.adjacency[root1]
+        adjacency2 = self.adjacency[root2]
+        adjacency1[root2] = adjacency1.get(root2, 0) + 1
+        adjacency2[root1] = adjacency2.get(root1, 0) + 1
+
+    def find(self, pid):
+        """
+        :return: The label of the cluster that pid belongs to
+        """
+        return self.label[self._root(pid)]
+
+    def union(self, keep, other):
+        """
+        Merges the clusters of the pieces keep and other. The merged cluster
+        is labelled like the cluster of keep.
+        :return: The label of the merged cluster
+        """
+        root1 = self._root(keep)
+        root2 = self._root(other)
+        label = self.label[root1]
+        if root1 == root2:
+            return label
+
+        if self.size[root1] < self.size[root2]:
+            big, small = root2, root1
+        else:
+            big, small = root1, root2
+
+        self.parent[small] = big
+        self.size[big] += self.size[small]
+        self.next[big], self.next[small] = self.next[small], self.next[big]
+        self.label[big] = label
+        self._merge_adjacency(big, small)
+        self.num_clusters -= 1
+        return label
+
+    def members(self, pid):
+        """
+        :return: List of all pieces in the same cluster as pid
+        """
+        root = self._root(pid)
+        members = [root]
+        member = self.next[root]
+        while member != root:
+            members.append(member)
+            member = self.next[member]
+        return members
+
+    def cluster_size(self, pid):
+        return self.size[self._root(pid)]
+
+    def neighbours(self, pid):
+        """
+        :return: Set of labels of the clusters next to the cluster of pid
+        """
+        return {
+            self.label[root] for root in self.adjacency[self._root(pid)]
+        }
+
+    def neighbour_counts(self, pid):
+        """
+        :return: Dict from the label of each neighbouring cluster to the
+        number of piece edges it shares with the cluster of pid
+        """
+        return {
+            self.label[root]: count
+            for root, count in self.adjacency[self._root(pid)].items()
+        }
+
+    def _root(self, pid):
+        root = pid
+        parent = self.parent
+        while parent[root] != root:
+            root = parent[root]
+
+        while parent[pid] != root:
+            parent[pid], pid = root, parent[pid]
+
+        return root
+
+    def _merge_adjacency(self, big, small):
+        # Only the neighbours of the smaller cluster need to be rewired
+        big_adjacency = self.adjacency[big]
+        small_adjacency = self.adjacency[small]
+        self.adjacency[small] = None
+
+        big_adjacency.pop(small, None)
+        small_adjacency.pop(big, None)
+        for root, count in small_adjacency.items():
+            adjacency = self.adjacency[root]
+            del adjacency[small]
+            adjacency[big] = adjacency.get(big, 0) + count
+            big_adjacency[root] = big_adjacency.get(root, 0) + count
+
+    def __len__(self):
+        return self.num_clusters
@@ -0,0 +1,113 @@
+import numpy as np
+
+
+KINDS = ('drag', 'pan', 'moves', 'z_levels', 'visibility')
+
+
+class EventQueue:
+    """
+    Gathers the updates that pyglet and the model can deliver many times per
+    frame, so that they can be applied once per frame instead:
+
+    - hand drags are summed, and so are pans of the camera,
+    - piece moves are concatenated, and only the last move of each piece is
+      kept,
+    - z level changes are concatenated,
+    - only the last visibility of each tray is kept.
+
+    For each kind, num_events counts the raw events and num_updates the
+    updates that they were folded into.
+    """
+    def __init__(self):
+        self.num_events = dict.fromkeys(KINDS, 0)
+        self.num_updates = dict.fromkeys(KINDS, 0)
+        self._clear()
+
+    def _clear(self):
+        self._drag = None
+        self._pan = None
+        self._moves = []
+        self._z_levels = []
+        self._visibility = {}
+
+    def drag(self, dx, dy):
+        self.num_events['drag'] += 1
+        self._drag = _add(self._drag, dx, dy)
+
+    def pan(self, dx, dy):
+        self.num_events['pan'] += 1
+        self._pan = _add(self._pan, dx, dy)
+
+    def move(self, pids, x, y, z, rotation):
+        """
+        :param pids, x, y, z, rotation: Arrays, as in on_pieces_moved
+        """
+        self.num_events['moves'] += 1
+        self._moves.append((pids, x, y, z, rotation))
+
+    def change_z_levels(self, msg):
+        self.num_events['z_levels'] += 1
+        self._z_levels += msg
+
+    def change_visibility(self, tray, is_shown):
+        self.num_events['visibility'] += 1
+        self._visibility[tray] = is_shown
+
+    @property
+    def is_empty(self):
+        return (
+            self._drag is None and
+            self._pan is None and
+            len(self._moves) == 0 and
+            len(self._z_levels) == 0 and
+            len(self._visibility) == 0
+        )
+
+    def take(self):
+        """
+        Empties the queue.
+        :return: Dict from kind to the pending update of that kind, or None
+        if there is none. Moves are a (pids, x, y, z, rotation) tuple of
+        arrays, z levels a list of (z, pid) tuples and visibility a dict
+        from tray to whether it is shown.
+        """
+        updates = {
+            'drag': self._drag,
+            'pan': self._pan,
+            'moves': _last_moves(self._moves) if self._moves else None,
+            'z_levels': self._z_levels or None,
+            'visibility': self._visibility or None
+        }
+        self._clear()
+        for kind, update in updates.items():
+            if update is not None:
+                self.num_updates[kind] += 1
+        return updates
+
+    def events_per_update(self, kind):
+        if self.num_updates[kind] == 0:
+            return 0
+        return self.num_events[kind] / self.num_updates[kind]
+
+    def __str__(self):
+        return ', '.join(
+            f'{kind}: {self.num_events[kind]} events in '
+            f'{self.num_updates[kind]} updates'
+            for kind in KINDS
+        )
+
+
+def _add(offset, dx, dy):
+    if offset is None:
+        return dx, dy
+    return offset[0] + dx, offset[1] + dy
+
+
+def _last_moves(moves):
+    pids, x, y, z, rotation = (
+        np.concatenate(column) for column in zip(*moves)
+    )
+    # np.unique gives the first occurrence, so look from the end
+    _, index = np.unique(pids[::-1], return_index=True)
+    index = np.sort(len(pids) - 1 - index)
+    return pids[index], x[index], y[index], z[index], rotation[index]
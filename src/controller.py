@@ -2,20 +2,36 @@ import os
 import glob
 
 import pyglet
-from compress_pickle import dump, load
+import numpy as np
+from compress_pickle import load
 
+from src.coalesce import EventQueue
 from src.model import Model
+from src import savefile
+from src.picking import Picker
 from src.view import View, Jigsaw
 import src.settings as settings
 
 
+# Seconds between checks of whether the pieces need to be moved back around
+# the origin
+WORLD_UPDATE_INTERVAL = 5.0
+# Most pieces whose z levels are renumbered per frame while the z levels are
+# being compacted
+Z_COMPACTION_BATCH_SIZE = 500
+
+
 class Controller:
     def __init__(self):
         self.window = Jigsaw()
         self.window.push_handlers(self)
         self.model = None
         self.view = None
+        self.picker = None
+        self.events = EventQueue()
         self._new_puzzle()
+        pyglet.clock.schedule_interval(
+            self.update_world, WORLD_UPDATE_INTERVAL)
 
     def _new_puzzle(self):
         texture = pyglet.image.load(settings.image.path).get_texture()
@@ -25,12 +41,17 @@ class Controller:
 
         self.model = Model()
         self.model.reset()
+        self.picker = Picker(
+            self.model, self.window.jigsaw_projection.view_to_clip_coord)
         self.view = View(self.window)
         self.view.reset(
             texture,
             self.model.get_piece_data(),
             self.model.trays.visible_trays,
-
+            self.model.contours,
+            self.model.cut_key,
+            self.model.trays.parent.tolist(),
+            self.model.levels_of_detail()
         )
 
         self.model.push_handlers(self)
@@ -41,6 +62,7 @@ class Controller:
         self.view.toggle_pause(False)
 
     def on_new_game(self, s):
+        self.events.take()
         self.window.pop_handlers()
         self.view.destroy_pieces()
 
@@ -54,28 +76,31 @@ class Controller:
         if not os.path.exists('saves'):
             os.makedirs('saves')
 
-        dump(
-            obj=self.model.to_dict(),
-            path=f'saves/{self.model}.sav',
-            compression='bz2',
-            set_default_extension=False
-        )
+        savefile.save(f'saves/{self.model}.sav', *self.model.to_arrays())
 
     def on_quickload(self):
         print("quickload!")
+        path = _most_recently_modified_file_in_folder('saves')
+        try:
+            data, arrays = _read_save(path)
+        except ValueError as e:
+            print(f"Can't load {path}: {e}")
+            return
+
+        self.events.take()
         self.window.pop_handlers()
         self.view.destroy_pieces()
 
-        data = load(
-            _most_recently_modified_file_in_folder('saves'),
-            compression='bz2',
-            set_default_extension=False
-        )
         settings.gameplay = settings.Gameplay(**data['gameplay_settings'])
         settings.window = settings.Window(**data['window_settings'])
         settings.image = settings.Image(**data['image_settings'])
 
-        self.model = Model.from_dict(data)
+        if arrays is None:
+            self.model = Model.from_dict(data)
+        else:
+            self.model = Model.from_arrays(data, arrays)
+        self.picker = Picker(
+            self.model, self.window.jigsaw_projection.view_to_clip_coord)
         texture = pyglet.image.load(settings.image.path).get_texture()
 
         self.view = View(self.window)
@@ -83,6 +108,10 @@ class Controller:
             texture=texture,
             piece_data=self.model.get_piece_data(),
             visible_trays=self.model.trays.visible_trays,
+            contours=self.model.contours,
+            cut_key=self.model.cut_key,
+            tray_parents=self.model.trays.parent.tolist(),
+            levels_of_detail=self.model.levels_of_detail()
         )
 
         self.model.push_handlers(self)
@@ -91,6 +120,7 @@ class Controller:
         self.model.timer.start()
 
     def on_mouse_down(self, x, y, is_shift):
+        self.flush_events()
         if (piece := self.model.piece_at_coordinate(x, y)) is not None:
             self.view.mouse_down_on_piece(piece.pid)
         elif is_shift:
@@ -99,12 +129,34 @@ class Controller:
             self.view.drop_everything()
 
     def on_mouse_up(self, x, y):
-        pass
+        # The hand must be where the pending drags put it before it is dropped
+        self.flush_events()
+
+    def on_hand_drag(self, dx, dy):
+        self.events.drag(dx, dy)
+
+    def on_view_pan(self, dx, dy):
+        self.events.pan(dx, dy)
+
+    def on_hover(self, x_, y_):
+        self.picker.move_to(x_, y_)
+
+    def on_draw(self):
+        self.flush_events()
+        if self.view.is_paused:
+            return
+        self.model.compact_z_levels(Z_COMPACTION_BATCH_SIZE)
+        self.view.update_level_of_detail()
+        pid, _ = self.picker.update()
+        # The hovered piece may have moved even if it is the same piece
+        self.view.hover_piece(
+            None if pid is None else self.model.pieces[pid].bbox)
 
     def on_scroll(self, x, y, direction):
         self.model.rotate_piece_at_coordinate(x, y, direction)
 
     def on_piece_rotated(self, pid, rotation, position):
+        self.flush_events()
         self.view.rotate_piece(pid, rotation, position)
 
     def on_view_pieces_moved(self, pids, dx, dy):
@@ -114,14 +166,29 @@ class Controller:
         self.model.move_pieces_to_top(pids)
 
     def on_z_levels_changed(self, msg):
-        self.view.remember_new_z_levels(msg)
+        self.events.change_z_levels(msg)
+
+    def on_z_levels_compacted(self, msg, max_z_level):
+        self.flush_events()
+        self.view.compact_z_levels(msg, max_z_level)
 
     def on_piece_moved(self, pid, x, y, z, r):
-        self.view.move_piece(pid, x, y, z, r)
+        self.events.move(
+            np.array([pid]), np.array([x]), np.array([y]), np.array([z]),
+            np.array([r])
+        )
+
+    def on_pieces_moved(self, pids, x, y, z, rotation):
+        self.events.move(pids, x, y, z, rotation)
 
     def on_pieces_merged(self, pid1, pid2):
+        self.flush_events()
         self.view.merge_pieces(pid1, pid2)
 
+    def on_pieces_merged_bulk(self, merges):
+        self.flush_events()
+        self.view.merge_pieces_bulk(merges)
+
     def on_view_spread_out(self, pids):
         self.model.spread_out(pids)
 
@@ -129,32 +196,99 @@ class Controller:
         self.model.merge_random_pieces(n)
 
     def on_selection_box(self, rect):
+        self.flush_events()
         pids = self.model.piece_ids_in_rect(rect)
         self.view.select_pieces(pids)
 
     def on_move_pieces_to_tray(self, tray, pids):
         self.model.move_pieces_to_tray(tray, pids)
+        self.picker.invalidate()
 
     def on_toggle_visibility(self, tray):
         self.model.toggle_visibility(tray)
 
-    def on_visibility_changed(self, tray, is_visible, hidden_pieces):
-        self.view.set_visibility(tray, is_visible)
-        self.view.drop_specific_pieces_from_hand(hidden_pieces)
+    def on_visibility_changed(self, tray, is_shown):
+        self.picker.invalidate()
+        self.events.change_visibility(tray, is_shown)
+
+    def on_tray_page(self, num_trays):
+        # Trays are added when a page of trays is first reached
+        while self.model.trays.num_trays < num_trays:
+            self.model.add_tray()
+
+    def on_tray_added(self, tray, parent):
+        self.view.add_tray(tray, parent)
 
     def on_info(self):
         self.view.print_info(
             elapsed_seconds=self.model.elapsed_seconds,
             percent_complete=self.model.percent_complete
         )
+        print(f'Coalesced events: {self.events}')
 
     def on_pause(self, is_paused):
+        self.flush_events()
         self.model.toggle_pause(is_paused)
         self.view.toggle_pause(is_paused)
 
+    def update_world(self, dt):
+        if self.view.is_paused or not self.view.hand.is_empty:
+            return
+        self.model.update_world()
+
+    def on_world_changed(self, dx, dy, bounds):
+        self.flush_events()
+        if dx != 0 or dy != 0:
+            self.view.rebase(dx, dy)
+            self.picker.invalidate()
+        self.view.table.fit(bounds)
+
     def on_win(self, elapsed_seconds):
         self.view.game_over(elapsed_seconds)
 
+    def flush_events(self):
+        """
+        Applies everything that has piled up in the event queue since the
+        last flush. Happens once per frame, and before anything that needs
+        the view to be up to date, like merging pieces or dropping the hand.
+        """
+        updates = self.events.take()
+        if (drag := updates['drag']) is not None:
+            self.view.hand.move(*drag)
+        if (pan := updates['pan']) is not None:
+            self.view.pan(*pan)
+        if (moves := updates['moves']) is not None:
+            self.view.move_pieces(*moves)
+        if (z_levels := updates['z_levels']) is not None:
+            self.view.remember_new_z_levels(z_levels)
+        # Last, since dropping pieces from the hand moves them in the model,
+        # which queues new events
+        if (visibility := updates['visibility']) is not None:
+            for tray, is_shown in visibility.items():
+                self.view.set_visibility(tray, is_shown)
+            # Only the pieces in the hand need to be checked
+            pids = set(self.view.hand.pieces)
+            visible_pids = self.model.trays.filter_visible(pids)
+            self.view.drop_specific_pieces_from_hand(
+                pids.difference(visible_pids))
+
+
+def _read_save(path):
+    """
+    :return: Tuple (data, arrays) for Model.from_arrays, or (data, None) for
+    Model.from_dict if the save is from before the columnar format.
+    """
+    if savefile.is_save_file(path):
+        return savefile.load(path)
+    try:
+        data = load(path, compression='bz2', set_default_extension=False)
+    except (AttributeError, ImportError) as e:
+        # Pickled classes that have since changed or been removed
+        raise ValueError(f"Unsupported save version: {e}") from e
+    if 'seed' not in data:
+        raise ValueError("Unsupported save version, the save has no seed")
+    return data, None
+
 
 def _most_recently_modified_file_in_folder(path):
     files = glob.glob(f"{path}/*.sav")
@@ -0,0 +1,241 @@
+import math
+
+import numpy as np
+
+
+# Number of masks rasterized at once, to bound the memory used
+CHUNK_SIZE = 256
+
+EAST = 0
+NORTH = 1
+
+
+class HitMasks:
+    """
+    Rasterized outlines of the pieces, so that testing whether a point is
+    inside a piece is mostly a matter of looking up one bit.
+
+    Piece.contains only ever tests a point against the edge between the
+    piece the point is over and its closest neighbour, so the masks are made
+    per edge rather than per piece: one mask covers the piece-sized
+    rectangle centred on the edge, and tells whether each pixel is inside
+    the piece to the left of (or below) the edge. The piece on the other
+    side of the edge shares the same mask and uses the complement.
+
+    Pixels that the outline passes through, and their neighbours, are
+    marked as border pixels, where the caller has to fall back to an exact
+    point in polygon test. Both the inside and the border bits are packed
+    eight to a byte.
+
+    The east edge of piece pid is between pid and pid + 1, and its north
+    edge is between pid and pid + nx.
+    """
+    def __init__(self, inside, border, nx, width, height, resolution):
+        """
+        :param inside: (num_pieces, 2, rows, ceil(columns / 8)) uint8 array
+        of packed bits, for the east and north edge of each piece.
+        :param border: Same as inside, for the border bits.
+        :param resolution: Size of a mask pixel in image pixels
+        """
+        self.inside = inside
+        self.border = border
+        self.nx = nx
+        self.width = width
+        self.height = height
+        self.resolution = resolution
+        self.num_pieces = len(inside)
+        self.rows = inside.shape[2]
+        self.columns = math.ceil(width / resolution)
+
+    @classmethod
+    def from_contours(cls, contours, nx, ny, width, height, resolution):
+        num_pieces = nx * ny
+        rows = math.ceil(height / resolution)
+        columns = math.ceil(width / resolution)
+        inside = np.zeros(
+            (num_pieces, 2, rows, math.ceil(columns / 8)), dtype=np.uint8)
+        border = np.zeros_like(inside)
+
+        pid = np.arange(num_pieces)
+        col = pid % nx
+        row = pid // nx
+        # Lower left corner of the mask of each edge, in the coordinates of
+        # the polygons.
+        corners = np.stack([
+            np.stack([width * (col + 1), height * row + height / 2], axis=1),
+            np.stack([width * col + width / 2, height * (row + 1)], axis=1)
+        ], axis=1)
+        has_edge = np.stack([col < nx - 1, row < ny - 1], axis=1)
+
+        for start in range(0, num_pieces, CHUNK_SIZE):
+            chunk = pid[start:start + CHUNK_SIZE]
+            segments = polygon_segments(contours, chunk)
+            samples, sample_index = outline_samples(segments, resolution)
+            for side in [EAST, NORTH]:
+                is_included = has_edge[chunk, side]
+                pids = chunk[is_included]
+                if len(pids) == 0:
+                    continue
+                corner = corners[pids, side]
+                inside_bits = rasterize(
+                    segments[is_included], corner, rows, columns, resolution)
+                # Map the samples of the included pieces to 0, ..., len(pids)
+                new_index = np.cumsum(is_included) - 1
+                is_sample_included = is_included[sample_index]
+                border_bits = border_band(
+                    samples[is_sample_included],
+                    new_index[sample_index[is_sample_included]],
+                    corner,
+                    rows,
+                    columns,
+                    resolution
+                )
+                inside[pids, side] = np.packbits(inside_bits, axis=-1)
+                border[pids, side] = np.packbits(border_bits, axis=-1)
+
+        return cls(inside, border, nx, width, height, resolution)
+
+    def lookup(self, pid, neighbour, point):
+        """
+        :param point: Point in the coordinates of the polygons
+        :return: True if the point is inside pid, False if it is inside
+        neighbour, or None if the masks can't tell and the polygon has to be
+        tested.
+        """
+        a, b = min(pid, neighbour), max(pid, neighbour)
+        if a < 0 or b >= self.num_pieces:
+            return None
+        if b == a + 1 and a % self.nx != self.nx - 1:
+            side = EAST
+            left = self.width * (a % self.nx + 1)
+            bottom = self.height * (a // self.nx) + self.height / 2
+        elif b == a + self.nx:
+            side = NORTH
+            left = self.width * (a % self.nx) + self.width / 2
+            bottom = self.height * (a // self.nx + 1)
+        else:
+            return None
+
+        column = math.floor((point.x - left) / self.resolution)
+        row = math.floor((point.y - bottom) / self.resolution)
+        if not (0 <= row < self.rows and 0 <= column < self.columns):
+            return None
+
+        byte, bit = divmod(column, 8)
+        mask = 0x80 >> bit
+        if self.border[a, side, row, byte] & mask:
+            return None
+
+        is_inside_a = bool(self.inside[a, side, row, byte] & mask)
+        return is_inside_a if pid == a else not is_inside_a
+
+    @property
+    def nbytes(self):
+        return self.inside.nbytes + self.border.nbytes
+
+
+def rasterize(segments, corners, rows, columns, resolution):
+    """
+    Tests the centre of every pixel for being inside the polygons, with
+    scanlines: a pixel is inside if an odd number of polygon segments cross
+    its row to the left of its centre.
+    :param segments: (n, num_segments, 2, 2) array of polygon segments
+    :param corners: (n, 2) array with the lower left corner of each mask
+    :return: (n, rows, columns) bool array
+    """
+    n = len(segments)
+    y = corners[:, 1, None] + resolution * (np.arange(rows) + 0.5)
+    p0 = segments[:, None, :, 0]
+    p1 = segments[:, None, :, 1]
+    y_centre = y[:, :, None]
+    crosses = (p0[..., 1] <= y_centre) != (p1[..., 1] <= y_centre)
+    index, row, segment = np.nonzero(crosses)
+    x0, y0 = p0[index, 0, segment].T
+    x1, y1 = p1[index, 0, segment].T
+    x = x0 + (y[index, row] - y0) * (x1 - x0) / (y1 - y0)
+
+    # The index of the first pixel centre to the right of each crossing.
+    # Counting the crossings per pixel and summing along the row gives the
+    # number of crossings to the left of each centre.
+    first_centre = corners[index, 0] + resolution / 2
+    column = np.clip(
+        np.ceil((x - first_centre) / resolution), 0, columns
+    ).astype(np.int64)
+    counts = np.zeros((n, rows, columns + 1), dtype=np.int64)
+    np.add.at(counts, (index, row, column), 1)
+    return np.cumsum(counts[..., :-1], axis=-1) % 2 == 1
+
+
+def outline_samples(segments, resolution):
+    """
+    Samples the outlines at most half a pixel apart.
+    :param segments: (n, num_segments, 2, 2) array of polygon segments
+    :return: (samples, index) tuple, where samples is a (num_samples, 2)
+    array and index tells which of the n outlines each sample is on.
+    """
+    num_segments = segments.shape[1]
+    p0 = segments[:, :, 0].reshape(-1, 2)
+    p1 = segments[:, :, 1].reshape(-1, 2)
+    length = np.linalg.norm(p1 - p0, axis=-1)
+    steps = np.ceil(2 * length / resolution).astype(np.int64) + 1
+    segment = np.repeat(np.arange(len(steps)), steps)
+    t = (np.arange(len(segment)) - (np.cumsum(steps) - steps)[segment]) / \
+        np.maximum(steps - 1, 1)[segment]
+    samples = p0[segment] + t[:, None] * (p1 - p0)[segment]
+    return samples, segment // num_segments
+
+
+def border_band(samples, index, corners, rows, columns, resolution):
+    """
+    Marks the pixels that the outlines pass through, and all their
+    neighbours, since a pixel centre can be on one side of the outline while
+    other parts of the pixel are on the other.
+    :param samples: (num_samples, 2) array from outline_samples
+    :param index: (num_samples) array, which mask each sample belongs to
+    :param corners: (n, 2) array with the lower left corner of each mask
+    :return: (n, rows, columns) bool array
+    """
+    n = len(corners)
+    pixel = np.floor(
+        (samples - corners[index]) / resolution
+    ).astype(np.int64)
+    column = pixel[:, 0]
+    row = pixel[:, 1]
+    # Samples just outside the mask still make the pixels next to them
+    # border pixels.
+    is_in_mask = (
+        (-1 <= row) & (row <= rows) & (-1 <= column) & (column <= columns)
+    )
+
+    band = np.zeros((n, rows + 2, columns + 2), dtype=bool)
+    band[
+        index[is_in_mask],
+        row[is_in_mask] + 1,
+        column[is_in_mask] + 1
+    ] = True
+
+    dilated = np.zeros((n, rows, columns), dtype=bool)
+    for dy in range(3):
+        for dx in range(3):
+            dilated |= band[:, dy:dy + rows, dx:dx + columns]
+    return dilated
+
+
+def polygon_segments(contours, pids):
+    """
+    :return: (len(pids), max_length, 2, 2) array of the closed polygons of
+    the pieces as segments, padded with empty segments.
+    """
+    starts = contours.offsets[pids]
+    lengths = contours.offsets[pids + 1] - starts
+    j = np.arange(lengths.max())
+    is_padding = j[None, :] >= lengths[:, None]
+    first = starts[:, None] + np.where(is_padding, 0, j)
+    second = starts[:, None] + np.where(
+        is_padding, 0, (j + 1) % lengths[:, None])
+    vertices = contours.vertices
+    indices = contours.indices
+    return np.stack([
+        vertices[indices[first]],
+        vertices[indices[second]]
+    ], axis=2)
@@ -1,52 +1,96 @@
 import math
 import random
-import itertools
 import time
 import pathlib
 from datetime import datetime
-from dataclasses import dataclass, asdict
-from typing import List, Set, Dict
+from dataclasses import asdict
+from typing import Set, Dict
 
+import numpy as np
 from pyglet.window import EventDispatcher
 from tqdm import tqdm
-from pyqtree import Index as QuadTree
 
 import src.settings as settings
 from src.database import save_statistics
-from src.bezier import Point, Rectangle, make_random_edges, bounding_box, \
-    point_in_polygon
+from src.cache import CutCache
+from src.clusters import ClusterSet
+from src.spatial import SpatialHash
+from src.hitmask import HitMasks
+from src.selection import world_segments, polygons_in_region
+from src.bezier import Point, Rectangle, make_random_edges, point_in_polygon, \
+    to_points, edge_control_points, sample_beziers, flatness_segments
+
+
+# Number of points sampled along each of the four Beziers of a curved edge,
+# unless settings.gameplay.flatness_tolerance is set.
+BEZIER_SAMPLES = 10
+
+# The arrays of Contours that are stored in the cut cache
+CONTOUR_ARRAYS = ('vertices', 'indices', 'offsets')
+# The arrays of HitMasks that are stored in the cut cache
+HIT_MASK_ARRAYS = ('inside', 'border')
+# The z levels are compacted when the highest one is this many times the
+# number of pieces
+Z_COMPACTION_FACTOR = 4
+# Most trays in a chain of nested trays, counting the tray at the top. The
+# piece shader walks at most this many trays up to find out if a piece is
+# hidden.
+MAX_TRAY_DEPTH = 16
 
 
 class Model(EventDispatcher):
     def __init__(self):
         self.pieces = None
+        self.store = None
+        self._merge_order = None
+        self._merge_cursor = 0
         self.trays = None
-        self.quadtree = None
+        self.spatial_hash = None
+        self.seed = None
+        self.contours = None
+        self.hit_masks = None
         self.current_max_z_level = settings.gameplay.num_pieces
+        self._z_order = None
+        self._z_cursor = 0
+        self._z_level = 0
         self.timer = Timer()
         self.start_time = datetime.now()
         self.cheated = False
 
-    def reset(self):
+    def reset(self, seed=None):
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        self._merge_order = None
+        self._merge_cursor = 0
         self.current_max_z_level = settings.gameplay.num_pieces
+        self._z_order = None
         self.trays = Tray(num_pids=settings.gameplay.num_pieces)
-        self.quadtree = QuadTree(bbox=(-100000, -100000, 100000, 100000))
+        self.contours = self._load_or_make_contours()
+        self.hit_masks = self._load_or_make_hit_masks()
+        self.store = PieceStore(settings.gameplay.num_pieces)
         self.pieces = make_jigsaw_cut(
             settings.image.width,
             settings.image.height,
             settings.gameplay.nx,
             settings.gameplay.ny,
-            settings.gameplay.piece_rotation
+            settings.gameplay.piece_rotation,
+            seed=seed,
+            contours=self.contours,
+            store=self.store,
+            hit_masks=self.hit_masks
         )
-        for piece in tqdm(self.pieces.values(), desc="Building quad-tree"):
-            self.quadtree.insert(piece, piece.bbox)
+        self._build_spatial_hash()
 
     def to_dict(self):
+        # The geometry of the pieces is fully determined by the seed and the
+        # settings, so only the state that changes during the game is saved.
         return {
             'gameplay_settings': asdict(settings.gameplay),
             'window_settings': asdict(settings.window),
             'image_settings': asdict(settings.image),
-            'pieces': self.pieces,
+            'seed': self.seed,
+            'pieces': [piece.state for piece in self.pieces.values()],
             'trays': self.trays,
             'current_max_z_level': self.current_max_z_level,
             'elapsed_seconds': self.elapsed_seconds,
@@ -56,67 +100,459 @@ class Model(EventDispatcher):
 
     @classmethod
     def from_dict(cls, data):
+        if 'seed' not in data:
+            # Saves from before the seed was saved hold the full geometry of
+            # the pieces, in classes that no longer exist
+            raise ValueError("Unsupported save version, the save has no seed")
         model = cls()
-        model.pieces = data['pieces']
+        model.seed = data['seed']
+        model.contours = model._load_or_make_contours()
+        model.hit_masks = model._load_or_make_hit_masks()
+        model.store = PieceStore(settings.gameplay.num_pieces)
+        model.pieces = restore_pieces(
+            make_jigsaw_cut(
+                settings.image.width,
+                settings.image.height,
+                settings.gameplay.nx,
+                settings.gameplay.ny,
+                seed=model.seed,
+                contours=model.contours,
+                store=model.store,
+                hit_masks=model.hit_masks
+            ),
+            data['pieces']
+        )
         model.trays = data['trays']
+        num_missing = settings.gameplay.num_pieces - len(model.trays.tray)
+        if num_missing > 0:
+            model.trays.tray = np.append(
+                model.trays.tray, np.full(num_missing, -1, dtype=np.int64))
+        for pid, tray in model.trays.pid_to_tray.items():
+            model.store.tray[pid] = tray
         model.current_max_z_level = data['current_max_z_level']
         model.timer = Timer(data['elapsed_seconds'])
         model.cheated = data['cheated']
         model.start_time = data['start_time']
-        model.quadtree = QuadTree(bbox=(-100000, -100000, 100000, 100000))
-        for piece in tqdm(model.pieces.values(), desc="Building quad-tree"):
-            model.quadtree.insert(piece, piece.bbox)
+        model._build_spatial_hash()
         return model
 
+    def to_arrays(self):
+        """
+        Like to_dict, but with the state of the pieces and trays as one
+        array per field, for src.savefile.
+        :return: Tuple (meta, arrays), where meta can be written as JSON
+        """
+        clusters = self.store.clusters
+        meta = {
+            'gameplay_settings': asdict(settings.gameplay),
+            'window_settings': asdict(settings.window),
+            'image_settings': asdict(settings.image),
+            'seed': self.seed,
+            'current_max_z_level': self.current_max_z_level,
+            'elapsed_seconds': self.elapsed_seconds,
+            'cheated': self.cheated,
+            'start_time': self.start_time.isoformat(),
+        }
+        arrays = {
+            # The position, z and rotation of a merged piece are in the row
+            # of its label
+            'x': self.store.x,
+            'y': self.store.y,
+            'z': self.store.z,
+            'rotation': self.store.rotation,
+            'label': np.array(
+                [clusters.find(pid) for pid in range(len(self.store))],
+                dtype=np.int64
+            ),
+            'tray': self.trays.tray,
+            'tray_parent': self.trays.parent,
+            'is_tray_shown': self.trays.is_tray_shown,
+        }
+        return meta, arrays
+
+    @classmethod
+    def from_arrays(cls, meta, arrays):
+        label = np.asarray(arrays['label'])
+        order = np.argsort(label, kind='stable')
+        splits = np.flatnonzero(np.diff(label[order])) + 1
+        x = arrays['x']
+        y = arrays['y']
+        z = arrays['z']
+        rotation = arrays['rotation']
+        states = []
+        for members in np.split(order, splits):
+            pid = int(label[members[0]])
+            states.append({
+                'pid': pid,
+                'x': float(x[pid]),
+                'y': float(y[pid]),
+                'z': float(z[pid]),
+                'rotation': int(rotation[pid]),
+                'members': set(members.tolist())
+            })
+        return cls.from_dict({
+            **meta,
+            'pieces': states,
+            'trays': Tray.from_arrays(
+                arrays['tray'], arrays['tray_parent'], arrays['is_tray_shown']
+            ),
+            'start_time': datetime.fromisoformat(meta['start_time']),
+        })
+
+    def _build_spatial_hash(self):
+        # One cell per piece
+        self.spatial_hash = SpatialHash(
+            max(1, settings.image.width // settings.gameplay.nx),
+            max(1, settings.image.height // settings.gameplay.ny)
+        )
+        for piece in tqdm(self.pieces.values(), desc="Building spatial hash"):
+            self._index_piece(piece)
+
+    def _index_piece(self, piece):
+        # Every member gets its own box in the spatial hash, so that a big,
+        # oddly shaped piece only covers the cells where it actually is.
+        members = self.clusters.members(piece.pid)
+        boxes = self.store.member_boxes(
+            members, piece.x, piece.y, piece.rotation)
+        for member, box in zip(members, boxes.tolist()):
+            self.spatial_hash.insert(member, tuple(box), piece.z)
+
+    def _unindex_piece(self, piece):
+        for member in self.clusters.members(piece.pid):
+            self.spatial_hash.remove(member)
+
+    def _move_members_onto(self, piece, other):
+        """
+        Moves the members of other in the spatial hash to where they are once
+        other is merged into piece, i.e. to the position, z level and
+        rotation of piece. Only the members of other are touched, so this
+        should be called before the two are merged, with other the smaller.
+        """
+        members = self.clusters.members(other.pid)
+        if other.rotation != piece.rotation:
+            for member in members:
+                self.spatial_hash.remove(member)
+            boxes = self.store.member_boxes(
+                members, piece.x, piece.y, piece.rotation)
+            for member, box in zip(members, boxes.tolist()):
+                self.spatial_hash.insert(member, tuple(box), piece.z)
+            return
+
+        self.spatial_hash.translate(
+            members, piece.x - other.x, piece.y - other.y)
+        if other.z != piece.z:
+            self.spatial_hash.set_z(members, [piece.z] * len(members))
+
+    @property
+    def clusters(self):
+        return self.store.clusters
+
+    @property
+    def cut_key(self):
+        return self._cut_key(settings.gameplay.flatness_tolerance)
+
+    def _cut_key(self, tolerance):
+        return CutCache.key(
+            settings.image.width,
+            settings.image.height,
+            settings.gameplay.nx,
+            settings.gameplay.ny,
+            self.seed,
+            f'tolerance{tolerance}' if tolerance > 0 else BEZIER_SAMPLES
+        )
+
+    def levels_of_detail(self):
+        """
+        The cut sampled with each of settings.gameplay.lod_tolerances, for
+        the view to draw when it is zoomed out far enough that the outlines
+        of the pieces don't need to be as fine. The model itself always uses
+        self.contours.
+        :return: List of (tolerance, cut key, Contours) tuples, from the
+        finest to the coarsest
+        """
+        return [
+            (
+                tolerance,
+                self._cut_key(tolerance),
+                self._load_or_make_contours(tolerance)
+            )
+            for tolerance in sorted(settings.gameplay.lod_tolerances)
+        ]
+
+    def _load_or_make_contours(self, tolerance=None):
+        if tolerance is None:
+            tolerance = settings.gameplay.flatness_tolerance
+        key = self._cut_key(tolerance)
+        cache = CutCache(max_bytes=settings.gameplay.cut_cache_size)
+        if (entry := cache.load(key, *CONTOUR_ARRAYS)) is not None:
+            return Contours(**entry)
+
+        contours = make_cut_contours(
+            settings.image.width,
+            settings.image.height,
+            settings.gameplay.nx,
+            settings.gameplay.ny,
+            self.seed,
+            tolerance
+        )
+        cache.store(key, **{
+            name: getattr(contours, name) for name in CONTOUR_ARRAYS
+        })
+        return contours
+
+    def _load_or_make_hit_masks(self):
+        resolution = settings.gameplay.hit_mask_resolution
+        if resolution <= 0:
+            return None
+
+        nx = settings.gameplay.nx
+        width = settings.image.width // nx
+        height = settings.image.height // settings.gameplay.ny
+        if width <= 0 or height <= 0:
+            return None
+
+        cache = CutCache(max_bytes=settings.gameplay.cut_cache_size)
+        key = f'{self.cut_key}_hitmasks{resolution}'
+        if (entry := cache.load(key, *HIT_MASK_ARRAYS)) is not None:
+            return HitMasks(**entry, nx=nx, width=width, height=height,
+                            resolution=resolution)
+
+        hit_masks = HitMasks.from_contours(
+            self.contours,
+            nx,
+            settings.gameplay.ny,
+            width,
+            height,
+            resolution
+        )
+        cache.store(key, **{
+            name: getattr(hit_masks, name) for name in HIT_MASK_ARRAYS
+        })
+        return hit_masks
+
     def piece_at_coordinate(self, x, y):
         return self._top_piece_at_location(x, y)
 
-    def piece_ids_in_rect(self, rect):
-        def to_pid(piece):
-            return piece.pid
-
-        pieces_in_rect = self.quadtree.intersect(
-            bbox=(rect.left, rect.bottom, rect.right, rect.top)
+    def piece_ids_in_rect(self, rect, mode=None):
+        """
+        :param mode: How the pieces are tested against the rectangle, see
+        piece_ids_in_polygon.
+        """
+        return self.piece_ids_in_polygon(
+            [
+                (rect.left, rect.bottom),
+                (rect.right, rect.bottom),
+                (rect.right, rect.top),
+                (rect.left, rect.top)
+            ],
+            mode
         )
 
-        return list(self.trays.filter_visible(map(to_pid, pieces_in_rect)))
+    def piece_ids_in_polygon(self, vertices, mode=None):
+        """
+        Finds the visible pieces in a selection polygon, like a rectangle or
+        a lasso. The candidates are taken from the spatial hash, and then the
+        outlines of all their members are tested in bulk.
+        :param vertices: The corners of the polygon, as (x, y) pairs
+        :param mode: 'bbox' to select the pieces whose bounding boxes overlap
+        the bounding box of the polygon, 'overlap' for the pieces whose
+        outlines overlap the polygon and 'inside' for the pieces that are
+        entirely inside it. Defaults to settings.gameplay.selection_mode.
+        """
+        if mode is None:
+            mode = settings.gameplay.selection_mode
+        vertices = np.asarray(vertices, dtype=float)
+        members = self.spatial_hash.intersect(
+            (*vertices.min(axis=0), *vertices.max(axis=0)))
+        if mode == 'bbox' or len(members) == 0:
+            pids = {self.clusters.find(member) for member in members}
+            return self.trays.filter_visible(pids)
+
+        members = np.array(sorted(members))
+        labels = np.array([self.clusters.find(m) for m in members.tolist()])
+        is_selected = polygons_in_region(
+            world_segments(
+                self.contours,
+                members,
+                self.store.x[labels],
+                self.store.y[labels],
+                self.store.rotation[labels]
+            ),
+            vertices,
+            mode
+        )
+        if mode == 'inside':
+            # A piece is only inside if all of its members are
+            selected_labels, counts = np.unique(
+                labels[is_selected], return_counts=True)
+            pids = {
+                label for label, count in zip(
+                    selected_labels.tolist(), counts.tolist())
+                if count == self.clusters.cluster_size(label)
+            }
+        else:
+            pids = set(labels[is_selected].tolist())
+        return self.trays.filter_visible(pids)
 
     def merge_random_pieces(self, n):
+        """
+        Makes n random merges at once. Edges between pieces are drawn from a
+        shuffled list that is consumed across calls, so that each edge is
+        looked at most once per game, and all the merges are applied to the
+        clusters before any piece is moved. Every merged cluster is moved
+        onto the cluster it is merged into, and the view gets a single
+        on_pieces_merged_bulk event.
+        """
         self.cheated = True
         n = min(n, len(self.pieces) - 1)
-        for _ in range(n):
-            piece = random.choice(list(self.pieces.values()))
-            neighbour = self.pieces[random.choice(list(piece.neighbours))]
-            self.quadtree.remove(piece, piece.bbox)
-
-            if (rotation := neighbour.rotation - piece.rotation) != 0:
-                piece.rotate(rotation, Point(0, 0))
-            piece.x = neighbour.x
-            piece.y = neighbour.y
-            self.dispatch_event(
-                'on_piece_moved',
-                piece.pid,
-                piece.x,
-                piece.y,
-                piece.z,
-                piece.rotation
+        if n < 1:
+            return
+        if self._merge_order is None:
+            self._merge_order = shuffled_piece_edges(
+                settings.gameplay.nx,
+                settings.gameplay.ny
             )
-            self._merge_pieces(piece, neighbour)
-            self.quadtree.insert(piece, piece.bbox)
 
-    def move_pieces(self, pids, dx, dy):
-        snap_to_neighbours = len(pids) == 1
-        for pid in pids:
-            self.move_piece(pid, dx, dy, snap_to_neighbours=snap_to_neighbours)
+        clusters = self.clusters
+        merged = []
+        while len(merged) < n:
+            pid1, pid2 = self._merge_order[self._merge_cursor]
+            self._merge_cursor += 1
+            label1 = clusters.find(pid1)
+            label2 = clusters.find(pid2)
+            if label1 == label2:
+                continue
+            # Keep the larger cluster in place, since it's the one most
+            # likely to already be where the player wants it.
+            if clusters.cluster_size(label1) < clusters.cluster_size(label2):
+                label1, label2 = label2, label1
+            self._move_members_onto(self.pieces[label1], self.pieces[label2])
+            clusters.union(label1, label2)
+            merged.append(label2)
+
+        self._move_merged_pieces(merged)
+
+    def _move_merged_pieces(self, merged):
+        """
+        Finishes merges that have already been made in self.clusters: every
+        merged piece is moved onto the piece it was merged into, and the view
+        gets a single on_pieces_merged_bulk event. The members must already
+        have been moved in the spatial hash with _move_members_onto, before
+        each merge.
+        :param merged: The pids of the pieces that were merged into others
+        """
+        groups = {}
+        for pid in merged:
+            groups.setdefault(self.clusters.find(pid), []).append(pid)
+
+        for pid, others in groups.items():
+            piece = self.pieces[pid]
+            for other_pid in others:
+                other = self.pieces.pop(other_pid)
+                if (rotation := piece.rotation - other.rotation) != 0:
+                    other.rotate(rotation, Point(0, 0))
+                other.x = piece.x
+                other.y = piece.y
+                piece.extend_bounding_box(other)
+                self.trays.merge_pids(pid, other_pid)
+
+        self.dispatch_event(
+            'on_pieces_merged_bulk',
+            list(groups.items())
+        )
+        self._check_game_over()
+
+    def auto_solve(self, fraction):
+        """
+        Merges the given fraction of the remaining pieces
+        """
+        self.merge_random_pieces(math.ceil(fraction * (len(self.pieces) - 1)))
+
+    def move_pieces(self, pids, dx, dy, snap_to_neighbours=True):
+        if len(pids) == 1:
+            self.move_piece(pids[0], dx, dy, snap_to_neighbours)
+            return
+
+        members = [
+            member for pid in pids for member in self.clusters.members(pid)
+        ]
+        self.store.move(list(pids), dx, dy)
+        self.spatial_hash.translate(members, dx, dy)
+        if snap_to_neighbours:
+            self.snap_pieces_to_neighbours(pids)
+
+    def snap_pieces_to_neighbours(self, pids):
+        """
+        Snaps pieces that were moved together to their neighbours, like
+        snap_piece_to_neighbours, but with the distances of all (piece,
+        neighbour) pairs computed at once and all merges applied in bulk.
+        A moved piece that snaps to a piece that wasn't moved jumps to its
+        position, while moved pieces that snap to each other stay put.
+        """
+        clusters = self.clusters
+        pairs = [
+            (pid, neighbour)
+            for pid in pids for neighbour in clusters.neighbours(pid)
+        ]
+        if len(pairs) == 0:
+            return
+
+        piece_pids, neighbour_pids = np.array(pairs).T
+        store = self.store
+        is_close = (
+            (store.rotation[piece_pids] == store.rotation[neighbour_pids]) &
+            (np.hypot(
+                store.x[piece_pids] - store.x[neighbour_pids],
+                store.y[piece_pids] - store.y[neighbour_pids]
+            ) < settings.gameplay.snap_distance)
+        )
+
+        moved = set(pids)
+        jumped = set()
+        merged = []
+        for pid, neighbour in zip(
+                piece_pids[is_close].tolist(),
+                neighbour_pids[is_close].tolist()):
+            if not self.trays.is_visible(neighbour):
+                continue
+            # The labels of moved pieces are kept, since they are the ones
+            # in the hand.
+            label = clusters.find(pid)
+            other = clusters.find(neighbour)
+            if label == other:
+                continue
+            piece = self.pieces[label]
+            other_piece = self.pieces[other]
+            # A moved piece jumps to the first piece that wasn't moved that
+            # it snaps to, or to where a moved piece that it snaps to jumped
+            if label not in jumped and (other not in moved or other in jumped):
+                self.spatial_hash.translate(
+                    clusters.members(label),
+                    other_piece.x - piece.x,
+                    other_piece.y - piece.y
+                )
+                piece.x = other_piece.x
+                piece.y = other_piece.y
+                jumped.add(label)
+            jumped.discard(other)
+            self._move_members_onto(piece, other_piece)
+            clusters.union(label, other)
+            merged.append(other)
+
+        if len(merged) == 0:
+            return
+
+        if len(jumped) > 0:
+            self._dispatch_pieces_moved(np.array(sorted(jumped)))
+        self._move_merged_pieces(merged)
 
     def move_piece(self, pid, dx, dy, snap_to_neighbours=True):
         piece = self.pieces[pid]
-        self.quadtree.remove(piece, piece.bbox)
         piece.x += dx
         piece.y += dy
+        self.spatial_hash.translate(self.clusters.members(pid), dx, dy)
         if snap_to_neighbours:
             self.snap_piece_to_neighbours(piece)
-        self.quadtree.insert(piece, piece.bbox)
 
     def snap_piece_to_neighbours(self, piece):
         for neighbour_pid in piece.neighbours:
@@ -132,22 +568,30 @@ class Model(EventDispatcher):
                 Point(neighbour.x, neighbour.y)
             )
             if dist < settings.gameplay.snap_distance:
-                piece.x = neighbour.x
-                piece.y = neighbour.y
-                neighbour.z = piece.z
+                # The smaller of the two is moved onto the larger one, so
+                # that a late snap onto a big piece only moves a few boxes in
+                # the spatial hash. The merged piece keeps the pid of piece.
+                if piece.num_members < neighbour.num_members:
+                    moved, kept = piece, neighbour
+                else:
+                    moved, kept = neighbour, piece
+                self._move_members_onto(kept, moved)
+                moved.x = kept.x
+                moved.y = kept.y
+                moved.z = kept.z
                 self.dispatch_event(
                     'on_piece_moved',
-                    piece.pid,
-                    piece.x,
-                    piece.y,
-                    piece.z,
-                    piece.rotation
+                    moved.pid,
+                    moved.x,
+                    moved.y,
+                    moved.z,
+                    moved.rotation
                 )
 
                 self._merge_pieces(piece, neighbour)
 
     def set_piece_position(self, piece, x, y):
-        self.quadtree.remove(piece, piece.bbox)
+        self._unindex_piece(piece)
         piece.x = x
         piece.y = y
 
@@ -160,11 +604,36 @@ class Model(EventDispatcher):
             piece.rotation
         )
 
-        self.quadtree.insert(piece, piece.bbox)
+        self._index_piece(piece)
+
+    def set_piece_positions(self, pids, x, y):
+        """
+        Like set_piece_position for many pieces, with a single
+        on_pieces_moved event instead of one on_piece_moved per piece.
+        :param pids: Array of pids
+        :param x, y: Arrays with the new position of each piece
+        """
+        pieces = [self.pieces[pid] for pid in pids.tolist()]
+        for piece in pieces:
+            self._unindex_piece(piece)
+        self.store.set_positions(pids, x, y)
+        for piece in pieces:
+            self._index_piece(piece)
+        self._dispatch_pieces_moved(pids)
+
+    def _dispatch_pieces_moved(self, pids):
+        self.dispatch_event(
+            'on_pieces_moved',
+            pids,
+            self.store.x[pids],
+            self.store.y[pids],
+            self.store.z[pids],
+            self.store.rotation[pids]
+        )
 
     def spread_out(self, pids):
         single_pieces = list(filter(
-            lambda piece: len(piece.members) == 1,
+            lambda piece: piece.num_members == 1,
             map(lambda pid: self.pieces[pid], pids)
         ))
         if len(single_pieces) < 1:
@@ -172,21 +641,45 @@ class Model(EventDispatcher):
 
         n = math.ceil(math.sqrt(len(single_pieces)))
 
-        left = min(map(
-            lambda piece: piece.bounding_box.left + piece.x,
-            single_pieces,
-        ))
-        bottom = min(map(
-            lambda piece: piece.bounding_box.bottom + piece.y,
-            single_pieces
-        ))
-
-        for i, piece in enumerate(single_pieces):
-            self.set_piece_position(
-                piece,
-                left + 2 * piece.width * (i % n) - piece.bounding_box.left,
-                bottom + 2 * piece.height * (i // n) - piece.bounding_box.bottom
-            )
+        pids = np.array([piece.pid for piece in single_pieces])
+        box_left = np.array([p.bounding_box.left for p in single_pieces])
+        box_bottom = np.array([p.bounding_box.bottom for p in single_pieces])
+        left = (box_left + self.store.x[pids]).min()
+        bottom = (box_bottom + self.store.y[pids]).min()
+
+        # All pieces have the same width and height
+        i = np.arange(len(single_pieces))
+        x = left + 2 * single_pieces[0].width * (i % n) - box_left
+        y = bottom + 2 * single_pieces[0].height * (i // n) - box_bottom
+
+        self.set_piece_positions(pids, x, y)
+
+    def update_world(self):
+        """
+        Should be called every now and then, when no pieces are being moved.
+        If the pieces have drifted further than settings.gameplay.
+        rebase_distance from the origin, they are all moved back around it,
+        by a whole number of cells so that the spatial hash stays valid.
+        Dispatches on_world_changed with the offset that all pieces were
+        moved by, and the bounds of the area they are in.
+        """
+        if (bounds := self.spatial_hash.bounds()) is None:
+            return
+        left, bottom, right, top = bounds
+        x = (left + right) / 2
+        y = (bottom + top) / 2
+        dx = dy = 0
+        if max(abs(x), abs(y)) > settings.gameplay.rebase_distance:
+            di = -round(x / self.spatial_hash.cell_width)
+            dj = -round(y / self.spatial_hash.cell_height)
+            self.spatial_hash.shift(di, dj)
+            dx = di * self.spatial_hash.cell_width
+            dy = dj * self.spatial_hash.cell_height
+            self.store.x += dx
+            self.store.y += dy
+            bounds = (left + dx, bottom + dy, right + dx, top + dy)
+
+        self.dispatch_event('on_world_changed', dx, dy, bounds)
 
     def move_pieces_to_top(self, pids):
         new_z_levels = list(range(
@@ -201,25 +694,122 @@ class Model(EventDispatcher):
         )
 
         msg = []
+        members = []
+        member_z_levels = []
         for z, piece in zip(new_z_levels, sorted_pieces):
             piece.z = z
             msg.append((z, piece.pid))
+            piece_members = self.clusters.members(piece.pid)
+            members += piece_members
+            member_z_levels += [z] * len(piece_members)
+        self.spatial_hash.set_z(members, member_z_levels)
 
         self.dispatch_event(
             'on_z_levels_changed',
             msg
         )
 
+        is_too_high = (
+            self.current_max_z_level > Z_COMPACTION_FACTOR * len(self.store)
+        )
+        if is_too_high and self._z_order is None:
+            self._start_z_compaction()
+
+    def _start_z_compaction(self):
+        pids = np.array(list(self.pieces))
+        z = self.store.z[pids]
+        order = np.argsort(z, kind='stable')
+        self._z_order = list(zip(z[order].tolist(), pids[order].tolist()))
+        self._z_cursor = 0
+        self._z_level = 0
+
+    @property
+    def is_compacting_z_levels(self):
+        return self._z_order is not None
+
+    def compact_z_levels(self, max_pieces):
+        """
+        Does the next part of a z compaction, if one is going on. Moving
+        pieces to the top makes z grow without bound, so once it gets
+        Z_COMPACTION_FACTOR times larger than the number of pieces, the
+        pieces are renumbered 0, 1, 2, ... from the bottom up, a few at a
+        time so that no single frame has to do it all.
+
+        The z levels are distinct integers, so the i-th lowest piece is at
+        z >= i, and giving it z = i keeps it below all the pieces that have
+        not been renumbered yet. Pieces that are moved to the top during the
+        compaction are above them all, and are renumbered last.
+
+        Renumbers at most max_pieces pieces, and dispatches a single
+        on_z_levels_compacted event with their new z levels.
+        """
+        if self._z_order is None:
+            return
+
+        batch = self._z_order[self._z_cursor:self._z_cursor + max_pieces]
+        self._z_cursor += len(batch)
+        is_done = self._z_cursor >= len(self._z_order)
+        msg = self._renumber_z_levels(batch)
+        if is_done:
+            # What is left are the pieces moved to the top since the
+            # compaction started
+            pids = np.array(list(self.pieces))
+            z = self.store.z[pids]
+            is_left = z >= self._z_level
+            order = np.argsort(z[is_left], kind='stable')
+            msg += self._renumber_z_levels(zip(
+                z[is_left][order].tolist(),
+                pids[is_left][order].tolist()
+            ))
+            self.current_max_z_level = self._z_level
+            self._z_order = None
+
+        self.dispatch_event(
+            'on_z_levels_compacted',
+            msg,
+            self.current_max_z_level
+        )
+
+    def _renumber_z_levels(self, z_levels):
+        # Gives the next z levels to the pieces of the (z, pid) pairs that
+        # still exist and are still at the same z level.
+        msg = []
+        members = []
+        member_z_levels = []
+        for z, pid in z_levels:
+            if pid not in self.pieces or self.store.z[pid] != z:
+                continue
+            self.store.z[pid] = self._z_level
+            msg.append((self._z_level, pid))
+            piece_members = self.clusters.members(pid)
+            members += piece_members
+            member_z_levels += [self._z_level] * len(piece_members)
+            self._z_level += 1
+        self.spatial_hash.set_z(members, member_z_levels)
+        return msg
+
     def move_pieces_to_tray(self, tray, pids):
         self.trays.move_pids_to_tray(tray=tray, pids=pids)
+        self.store.tray[list(pids)] = tray
         if self._tray_is_hidden(tray):
             self.dispatch_event(
                 'on_visibility_changed',
                 tray,
-                False,
-                self.trays.hidden_pieces
+                self.trays.tray_is_shown(tray)
             )
 
+    def add_tray(self, parent=-1):
+        """
+        Adds a tray, optionally nested in the tray parent, so that it is
+        hidden whenever parent is.
+        :return: The new tray
+        :raises ValueError: If parent isn't a tray, or the new tray would be
+        nested more than MAX_TRAY_DEPTH deep
+        """
+        tray = self.trays.add_tray(parent)
+        self.dispatch_event('on_tray_added', tray, parent)
+        return tray
+
     def rotate_piece_at_coordinate(self, x, y, direction):
         if not settings.gameplay.piece_rotation:
             return
@@ -227,8 +817,9 @@ class Model(EventDispatcher):
             return
 
         self.move_pieces_to_top([piece.pid])
-        self.quadtree.remove(piece, piece.bbox)
+        self._unindex_piece(piece)
         piece.rotate(direction, Point(x, y))
+        self._index_piece(piece)
         self.dispatch_event(
             'on_piece_rotated',
             piece.pid,
@@ -236,17 +827,29 @@ class Model(EventDispatcher):
             piece.position
         )
         self.snap_piece_to_neighbours(piece)
-        self.quadtree.insert(piece, piece.bbox)
 
     def get_hidden_pieces(self):
         return self.trays.hidden_pieces
 
     def get_piece_data(self):
+        pids = list(self.pieces)
+        x = self.store.x[pids].tolist()
+        y = self.store.y[pids].tolist()
+        z = self.store.z[pids].tolist()
+        rotation = self.store.rotation[pids].tolist()
+        tray = self.store.tray[pids].tolist()
+
         data = []
-        for pid, piece in self.pieces.items():
-            piece_data = piece.data
-            piece_data['tray'] = self.trays.pid_to_tray[pid]
-            data.append(piece_data)
+        for i, piece in enumerate(self.pieces.values()):
+            data.append({
+                'pid': piece.pid,
+                'polygons': piece.polygon,
+                'position': (x[i], y[i], z[i]),
+                'rotation': rotation[i],
+                'width': piece.width,
+                'height': piece.height,
+                'tray': tray[i]
+            })
 
         return data
 
@@ -255,8 +858,7 @@ class Model(EventDispatcher):
         self.dispatch_event(
             'on_visibility_changed',
             tray,
-            self._tray_is_visible(tray),
-            self.trays.hidden_pieces
+            self.trays.tray_is_shown(tray)
         )
 
     def toggle_pause(self, is_paused):
@@ -276,22 +878,17 @@ class Model(EventDispatcher):
         return 100 * moves_made / total_moves
 
     def _tray_is_visible(self, tray):
-        return tray in self.trays.visible_trays
+        return self.trays.tray_is_visible(tray)
 
     def _tray_is_hidden(self, tray):
         return not self._tray_is_visible(tray)
 
     def _merge_pieces(self, p1, p2):
-        # Merges p2 into p1
+        # Merges p2 into p1. The caller is responsible for moving the members
+        # of both to where the merged piece is in the spatial hash first, see
+        # _move_members_onto.
         p1.merge(p2)
         self.pieces.pop(p2.pid)
-        p2.neighbours.remove(p1.pid)
-        for neighbour_pid in p2.neighbours:
-            neighbour = self.pieces[neighbour_pid]
-            neighbour.neighbours.remove(p2.pid)
-            neighbour.neighbours.add(p1.pid)
-
-        self.quadtree.remove(p2, p2.bbox)
         self.trays.merge_pids(p1.pid, p2.pid)
         self.dispatch_event(
             'on_pieces_merged',
@@ -302,17 +899,20 @@ class Model(EventDispatcher):
         self._check_game_over()
 
     def _pieces_at_location(self, x, y):
-        for piece in self.quadtree.intersect(bbox=(x, y, x, y)):
-            if (self.trays.is_visible(piece.pid)
+        # From the top down, so that the first piece is the top piece
+        find = self.clusters.find
+        seen = set()
+        for member in self.spatial_hash.intersect_point(x, y):
+            if (pid := find(member)) in seen:
+                continue
+            seen.add(pid)
+            piece = self.pieces[pid]
+            if (self.trays.is_visible(pid)
                     and piece.contains(Point(x, y), settings.gameplay.nx)):
                 yield piece
 
     def _top_piece_at_location(self, x, y):
-        return max(
-            self._pieces_at_location(x, y),
-            key=(lambda p: p.z),
-            default=None
-        )
+        return next(self._pieces_at_location(x, y), None)
 
     def _check_game_over(self):
         if len(self.pieces) == 1:
@@ -336,7 +936,7 @@ class Model(EventDispatcher):
             self.current_max_z_level == other.current_max_z_level,
             self.pieces == other.pieces,
             self.trays == other.trays,
-            self.quadtree == other.quadtree,
+            self.spatial_hash == other.spatial_hash,
         )
 
     def __str__(self):
@@ -346,26 +946,155 @@ class Model(EventDispatcher):
 
 Model.register_event_type('on_piece_rotated')
 Model.register_event_type('on_piece_moved')
+Model.register_event_type('on_pieces_moved')
 Model.register_event_type('on_pieces_merged')
+Model.register_event_type('on_pieces_merged_bulk')
 Model.register_event_type('on_z_levels_changed')
+Model.register_event_type('on_z_levels_compacted')
 Model.register_event_type('on_visibility_changed')
+Model.register_event_type('on_tray_added')
+Model.register_event_type('on_world_changed')
 Model.register_event_type('on_win')
 
 
-@dataclass
+class PieceStore:
+    """
+    Structure of arrays holding the state of every piece, indexed by pid. A
+    merged piece keeps its position, z and rotation in the row of its own
+    pid (the pid that is a key in Model.pieces), and clusters keeps track of
+    which pieces have been merged. Having everything in arrays means that
+    operations on many pieces at once can be done without looping in Python.
+    """
+    def __init__(self, num_pieces):
+        self.x = np.zeros(num_pieces)
+        self.y = np.zeros(num_pieces)
+        self.z = np.zeros(num_pieces)
+        self.rotation = np.zeros(num_pieces, dtype=np.int8)
+        self.tray = np.zeros(num_pieces, dtype=np.int64)
+        # (left, bottom, right, top) of every single piece, unrotated and
+        # relative to the position of the piece
+        self.boxes = np.zeros((num_pieces, 4))
+        self.clusters = ClusterSet(num_pieces)
+
+    def move(self, pids, dx, dy):
+        self.x[pids] += dx
+        self.y[pids] += dy
+
+    def set_positions(self, pids, x, y):
+        self.x[pids] = x
+        self.y[pids] = y
+
+    def member_boxes(self, pids, x, y, rotation):
+        """
+        :return: (len(pids), 4) array of the boxes of the single pieces pids,
+        rotated and moved to where a piece at (x, y) with the given rotation
+        has them.
+        """
+        left, bottom, right, top = self.boxes[pids].T
+        for _ in range(rotation % 4):
+            # Like Rectangle.flip
+            left, bottom, right, top = -top, left, -bottom, right
+        return np.stack([left + x, bottom + y, right + x, top + y], axis=1)
+
+    def pids_in_rect(self, pids, left, bottom, right, top):
+        """
+        :return: The pids whose position is inside the rectangle
+        """
+        pids = np.asarray(pids)
+        x = self.x[pids]
+        y = self.y[pids]
+        return pids[(left <= x) & (x <= right) & (bottom <= y) & (y <= top)]
+
+    def __len__(self):
+        return len(self.x)
+
+
 class Piece:
-    pid: int
-    polygon: Dict[int, List[Point]]
-    bounding_box: Rectangle
-    origin: Point
-    neighbours: Set[int]
-    members: Set[int]
-    width: int = 200
-    height: int = 200
-    x: float = 0
-    y: float = 0
-    z: float = 0
-    rotation: int = 0
+    """
+    A piece, or a group of pieces that have been merged. The bounding box
+    lives here, while position, z and rotation are stored in row pid of a
+    PieceStore that is shared by all pieces of the puzzle, and members and
+    neighbours are looked up in its ClusterSet.
+    """
+    def __init__(self, pid, polygons, bounding_box, origin, width=200,
+                 height=200, x=0, y=0, z=0, rotation=0, store=None,
+                 hit_masks=None):
+        """
+        :param polygons: The polygons of all pieces of the puzzle, indexed by
+        pid, shared by all pieces.
+        :param hit_masks: Optional HitMasks of the puzzle, shared by all
+        pieces, that make contains faster.
+        """
+        self.pid = pid
+        self.polygons = polygons
+        self.hit_masks = hit_masks
+        self.bounding_box: Rectangle = bounding_box
+        self.origin: Point = origin
+        self.width = width
+        self.height = height
+        self.store = store if store is not None else PieceStore(pid + 1)
+        self.x = x
+        self.y = y
+        self.z = z
+        self.rotation = rotation
+
+    @property
+    def x(self):
+        return float(self.store.x[self.pid])
+
+    @x.setter
+    def x(self, x):
+        self.store.x[self.pid] = x
+
+    @property
+    def y(self):
+        return float(self.store.y[self.pid])
+
+    @y.setter
+    def y(self, y):
+        self.store.y[self.pid] = y
+
+    @property
+    def z(self):
+        return float(self.store.z[self.pid])
+
+    @z.setter
+    def z(self, z):
+        self.store.z[self.pid] = z
+
+    @property
+    def rotation(self):
+        return int(self.store.rotation[self.pid])
+
+    @rotation.setter
+    def rotation(self, rotation):
+        self.store.rotation[self.pid] = rotation
+
+    @property
+    def members(self) -> Set[int]:
+        return set(self.store.clusters.members(self.pid))
+
+    @property
+    def neighbours(self) -> Set[int]:
+        return self.store.clusters.neighbours(self.pid)
+
+    @property
+    def polygon(self) -> Dict[int, np.ndarray]:
+        # The polygons of all members, keyed by pid
+        return {
+            member: self.polygons[member]
+            for member in self.store.clusters.members(self.pid)
+        }
+
+    @property
+    def num_members(self):
+        return self.store.clusters.cluster_size(self.pid)
+
+    def is_member(self, pid):
+        return (
+            0 <= pid < len(self.store) and
+            self.store.clusters.find(pid) == self.pid
+        )
 
     def rotate(self, direction, pivot):
         self.rotation = (self.rotation + direction) % 4
@@ -390,6 +1119,22 @@ class Piece:
     def position(self):
         return Point(self.x, self.y)
 
+    def points(self, pid):
+        # The polygon of member pid as a list of Points
+        return to_points(self.polygons[pid])
+
+    @property
+    def state(self):
+        # Everything about the piece that isn't given by the jigsaw cut
+        return {
+            'pid': self.pid,
+            'x': self.x,
+            'y': self.y,
+            'z': self.z,
+            'rotation': self.rotation,
+            'members': self.members
+        }
+
     @property
     def data(self):
         return {
@@ -403,11 +1148,10 @@ class Piece:
 
     def merge(self, other):
         assert isinstance(other, Piece)
-        self.members = self.members.union(other.members)
-        self.neighbours = self.neighbours.union(other.neighbours)
-        self.neighbours.remove(self.pid)
-        self.neighbours.remove(other.pid)
-        self.polygon = {**self.polygon, **other.polygon}
+        self.store.clusters.union(self.pid, other.pid)
+        self.extend_bounding_box(other)
+
+    def extend_bounding_box(self, other):
         self.bounding_box = Rectangle(
             left=min(self.bounding_box.left, other.bounding_box.left),
             right=max(self.bounding_box.right, other.bounding_box.right),
@@ -415,6 +1159,20 @@ class Piece:
             top=max(self.bounding_box.top, other.bounding_box.top)
         )
 
+    def __eq__(self, other):
+        if not isinstance(other, Piece):
+            return NotImplemented
+        return (
+            self.state == other.state and
+            self.bounding_box == other.bounding_box and
+            self.neighbours == other.neighbours and
+            self.polygon.keys() == other.polygon.keys() and
+            all(
+                np.array_equal(polygon, other.polygon[pid])
+                for pid, polygon in self.polygon.items()
+            )
+        )
+
     def contains(self, point: Point, nx: int) -> bool:
         point = point - self.position
 
@@ -437,64 +1195,191 @@ class Piece:
             nx
         )
 
-        if pid in self.members and neighbour in self.members:
+        is_member = self.is_member(pid)
+        neighbour_is_member = self.is_member(neighbour)
+        if is_member and neighbour_is_member:
             return True
-        elif pid in self.members and neighbour not in self.members:
-            return point_in_polygon(point, self.polygon[pid])
-        elif pid not in self.members and neighbour in self.members:
-            return point_in_polygon(point, self.polygon[neighbour])
-        else:
+        elif not is_member and not neighbour_is_member:
             return False
 
+        if self.hit_masks is not None:
+            is_inside = self.hit_masks.lookup(pid, neighbour, point)
+            if is_inside is not None:
+                return is_inside == is_member
+
+        if is_member:
+            return point_in_polygon(point, self.polygons[pid])
+        else:
+            return point_in_polygon(point, self.polygons[neighbour])
+
 
 class Tray:
+    """
+    Which tray each piece is in, and which trays are shown. There can be any
+    number of trays, and trays can be nested in other trays; a piece is only
+    visible if its tray and every tray that it is nested in are shown.
+
+    The tray of each pid is kept in an array, with -1 for pids that have been
+    merged into other pieces, and the parent and shown flag of each tray in
+    arrays indexed by tray. Toggling a tray only flips its flag, no matter
+    how many pieces or trays are in it, while the visibility of pieces is
+    found by walking up from their trays when it is asked for. That is done
+    for all pieces in a query at once, one level of nesting at a time.
+    """
     def __init__(self, num_pids, num_trays=10):
         self.trays = {tray: set() for tray in range(num_trays)}
         self.trays[0] = set(range(num_pids))
-        self.visible_trays = set(range(num_trays))
-        self.pid_to_tray = {pid: 0 for pid in range(num_pids)}
+        self.tray = np.zeros(num_pids, dtype=np.int64)
+        self.parent = np.full(num_trays, -1, dtype=np.int64)
+        self.is_tray_shown = np.ones(num_trays, dtype=bool)
+
+    @classmethod
+    def from_arrays(cls, tray, parent, is_tray_shown):
+        trays = cls(num_pids=0, num_trays=0)
+        trays.tray = np.array(tray, dtype=np.int64)
+        trays.parent = np.array(parent, dtype=np.int64)
+        trays.is_tray_shown = np.array(is_tray_shown, dtype=bool)
+        trays.trays = {t: set() for t in range(len(trays.parent))}
+        for pid, t in trays.pid_to_tray.items():
+            trays.trays[t].add(pid)
+        return trays
+
+    def __setstate__(self, state):
+        # Trays pickled by older versions are converted to the arrays
+        if 'pid_to_tray' in state:
+            # A dict of pids and a set of visible trays. Pids after the last
+            # one in the dict have been merged; Model.from_dict adds them.
+            tray = np.full(
+                max(state['pid_to_tray'], default=-1) + 1, -1, dtype=np.int64)
+            for pid, t in state['pid_to_tray'].items():
+                tray[pid] = t
+            is_tray_shown = np.zeros(max(state['trays']) + 1, dtype=bool)
+            is_tray_shown[list(state['visible_trays'])] = True
+            state = {
+                'trays': state['trays'],
+                'tray': tray,
+                'parent': np.full(len(is_tray_shown), -1, dtype=np.int64),
+                'is_tray_shown': is_tray_shown
+            }
+        elif 'is_tray_visible' in state:
+            # Arrays, but no nesting and an extra entry for merged pids
+            is_tray_shown = state['is_tray_visible'][:-1]
+            state = {
+                'trays': state['trays'],
+                'tray': state['tray'],
+                'parent': np.full(len(is_tray_shown), -1, dtype=np.int64),
+                'is_tray_shown': is_tray_shown
+            }
+        self.__dict__.update(state)
+
+    @property
+    def num_trays(self):
+        return len(self.parent)
+
+    def add_tray(self, parent=-1):
+        """
+        :param parent: The tray that the new tray is nested in, or -1
+        :return: The new tray
+        """
+        if not -1 <= parent < self.num_trays:
+            raise ValueError(f"There is no tray {parent}")
+        if parent >= 0 and self.depth(parent) >= MAX_TRAY_DEPTH:
+            raise ValueError(
+                f"Trays can't be nested more than {MAX_TRAY_DEPTH} deep")
+        tray = self.num_trays
+        self.trays[tray] = set()
+        self.parent = np.append(self.parent, parent)
+        self.is_tray_shown = np.append(self.is_tray_shown, True)
+        return tray
+
+    def depth(self, tray):
+        """
+        :return: Number of trays from tray up to the top, counting both
+        """
+        depth = 0
+        while tray >= 0:
+            depth += 1
+            tray = self.parent[tray]
+        return depth
+
+    @property
+    def visible_trays(self):
+        # The trays that are shown, whether or not their parents are
+        return set(np.flatnonzero(self.is_tray_shown).tolist())
+
+    @visible_trays.setter
+    def visible_trays(self, visible_trays):
+        self.is_tray_shown[:] = False
+        self.is_tray_shown[list(visible_trays)] = True
+
+    @property
+    def pid_to_tray(self):
+        return {
+            pid: tray for pid, tray in enumerate(self.tray.tolist())
+            if tray >= 0
+        }
+
+    def tray_is_shown(self, tray):
+        return bool(self.is_tray_shown[tray])
+
+    def tray_is_visible(self, tray):
+        while tray >= 0:
+            if not self.is_tray_shown[tray]:
+                return False
+            tray = self.parent[tray]
+        return True
 
     def is_visible(self, pid):
-        return (
-            pid in self.pid_to_tray and
-            self.pid_to_tray[pid] in self.visible_trays
-        )
+        if not 0 <= pid < len(self.tray):
+            return False
+        tray = int(self.tray[pid])
+        return tray >= 0 and self.tray_is_visible(tray)
 
     def filter_visible(self, pids):
-        for pid in pids:
-            if self.is_visible(pid):
-                yield pid
+        """
+        :return: List of the pids that exist and are visible, in the same
+        order as pids.
+        """
+        pids = np.fromiter(pids, dtype=np.int64)
+        pids = pids[(0 <= pids) & (pids < len(self.tray))]
+        return pids[self._are_visible(pids)].tolist()
+
+    def _are_visible(self, pids):
+        tray = self.tray[pids]
+        is_visible = tray >= 0
+        # Walk up one level of nesting at a time, for the pids that are still
+        # visible and haven't reached a tray at the top yet.
+        while len(active := np.flatnonzero(is_visible & (tray >= 0))) > 0:
+            active_tray = tray[active]
+            is_visible[active] = self.is_tray_shown[active_tray]
+            tray[active] = self.parent[active_tray]
+        return is_visible
 
     def move_pids_to_tray(self, pids, tray):
+        pids = list(pids)
         for pid in pids:
-            old_tray = self.pid_to_tray[pid]
-            self.pid_to_tray[pid] = tray
-            self.trays[old_tray].remove(pid)
-            self.trays[tray].add(pid)
+            self.trays[self.tray[pid]].remove(pid)
+        self.trays[tray].update(pids)
+        self.tray[pids] = tray
 
     def merge_pids(self, _, pid2):
-        self.trays[self.pid_to_tray[pid2]].remove(pid2)
-        self.pid_to_tray.pop(pid2)
+        self.trays[self.tray[pid2]].remove(pid2)
+        self.tray[pid2] = -1
 
     def toggle_visibility(self, tray):
-        if tray in self.visible_trays:
-            self.visible_trays.remove(tray)
-        else:
-            self.visible_trays.add(tray)
+        self.is_tray_shown[tray] = not self.is_tray_shown[tray]
 
     @property
     def hidden_pieces(self):
-        hidden = tuple(
-            pieces for tray, pieces in self.trays.items()
-            if tray not in self.visible_trays
-        )
-        return set().union(*hidden)
+        pids = np.flatnonzero(self.tray >= 0)
+        return set(pids[~self._are_visible(pids)].tolist())
 
     def __eq__(self, other):
         return (
             self.trays == other.trays and
-            self.visible_trays == other.visible_trays and
-            self.pid_to_tray == other.pid_to_tray
+            np.array_equal(self.tray, other.tray) and
+            np.array_equal(self.parent, other.parent) and
+            np.array_equal(self.is_tray_shown, other.is_tray_shown)
         )
 
 
@@ -529,64 +1414,283 @@ class Timer:
         return self.seconds
 
 
-def make_jigsaw_cut(image_width, image_height, nx, ny, random_rotation=False):
+def make_jigsaw_cut(image_width, image_height, nx, ny, random_rotation=False,
+                    seed=None, contours=None, store=None, hit_masks=None):
+    """
+    All random choices are drawn from two random streams derived from the
+    seed: one for the shape of the edges and one for the initial layout of
+    the pieces. The same seed and grid therefore always give exactly the same
+    pieces, which is what lets a saved game store the seed instead of the
+    geometry, and the contours can be taken from a cache without changing
+    where the pieces end up.
+    :param contours: Contours from make_cut_contours with the same seed, if
+    they are already known.
+    :param store: PieceStore with room for nx * ny pieces, where the state of
+    the pieces is kept. A new one is made if not given.
+    :param hit_masks: Optional HitMasks made from the contours
+    """
     # TODO: with global settings, the input params are no longer needed?
-    num_edges = 2 * nx * ny - nx - ny
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    if contours is None:
+        contours = make_cut_contours(image_width, image_height, nx, ny, seed)
+
+    rng = random.Random(f'{seed}:layout')
     num_pieces = nx * ny
-    nv = (nx - 1) * ny
+    if store is None:
+        store = PieceStore(num_pieces)
     width = image_width // nx
     height = image_height // ny
 
-    edges = make_random_edges(num_edges)
-
-    def get_epid(pid, orientation):
-        if orientation == "N" and pid >= nx:
-            return pid - nx + nv
-        elif orientation == "W" and pid % nx:
-            return pid - (pid // nx) - 1
-        elif orientation == "S" and pid < num_pieces - nx:
-            return pid + nv
-        elif orientation == "E" and pid % nx != nx - 1:
-            return pid - (pid // nx)
-        return -1
-
-    def piece_contour(pid):
-        offset = Point(
-            width * (pid % nx) + width / 2,
-            height * (pid // nx) + height / 2
-        )
-        contour = [
-            edges[get_epid(pid, "N")].stretch(width, height).translate(offset),
-            edges[get_epid(pid, "E")].stretch(height, width).rotate().translate(offset + Point(width, 0)),
-            edges[get_epid(pid, "S")].stretch(width, height).translate(offset + Point(0, height)).reverse(),
-            edges[get_epid(pid, "W")].stretch(height, width).rotate().translate(offset).reverse()
-        ]
-        return list(itertools.chain.from_iterable([
-            edge.evaluate(10) for edge in contour]))
+    lower, upper = contours.bounding_boxes()
+    store.boxes[:num_pieces] = np.hstack([lower, upper])
+    lower = lower.tolist()
+    upper = upper.tolist()
 
     pieces = {}
     for pid in tqdm(range(num_pieces), desc="Designing pieces"):
+        for neighbour in create_neighbours(pid, num_pieces, nx):
+            if neighbour > pid:
+                store.clusters.connect(pid, neighbour)
+
         piece = Piece(
             pid=pid,
-            polygon={pid: (polygon := piece_contour(pid))},
-            bounding_box=bounding_box(polygon),
+            polygons=contours,
+            bounding_box=Rectangle(
+                left=lower[pid][0],
+                right=upper[pid][0],
+                top=upper[pid][1],
+                bottom=lower[pid][1]
+            ),
             origin=(origin := origin_of_pid(pid, nx, width, height)),
-            neighbours=create_neighbours(pid, num_pieces, nx),
-            members={pid},
             width=width,
             height=height,
-            x=random.randint(0, int(image_width * 2)) - origin.x,
-            y=random.randint(0, int(image_height * 2)) - origin.y,
-            z=pid
+            x=rng.randint(0, int(image_width * 2)) - origin.x,
+            y=rng.randint(0, int(image_height * 2)) - origin.y,
+            z=pid,
+            store=store,
+            hit_masks=hit_masks
         )
         if random_rotation:
-            piece.rotate(random.randint(0, 3), piece.position)
+            piece.rotate(rng.randint(0, 3), piece.position)
 
         pieces[pid] = piece
 
     return pieces
 
 
+def make_cut_contours(image_width, image_height, nx, ny, seed, tolerance=0):
+    num_edges = 2 * nx * ny - nx - ny
+    edges = make_random_edges(num_edges, random.Random(seed))
+    return make_contours(
+        edge_control_points(edges, num_edges),
+        nx,
+        ny,
+        image_width // nx,
+        image_height // ny,
+        n=BEZIER_SAMPLES,
+        tolerance=tolerance
+    )
+
+
+def restore_pieces(pieces, states):
+    """
+    Puts freshly cut, unrotated pieces back into a saved state, by merging
+    the members of each saved piece into it and moving and rotating it.
+    :param pieces: Dict of pieces from make_jigsaw_cut
+    :param states: List of Piece.state dicts
+    :return: Dict of the restored pieces, keyed by pid
+    """
+    restored = {}
+    for state in states:
+        piece = pieces[state['pid']]
+        members = [pieces[member] for member in sorted(state['members'])]
+        for member in members:
+            piece.store.clusters.union(piece.pid, member.pid)
+        piece.bounding_box = Rectangle(
+            left=min(member.bounding_box.left for member in members),
+            right=max(member.bounding_box.right for member in members),
+            top=max(member.bounding_box.top for member in members),
+            bottom=min(member.bounding_box.bottom for member in members)
+        )
+        piece.bounding_box.flip(state['rotation'])
+        piece.rotation = state['rotation']
+        piece.x = state['x']
+        piece.y = state['y']
+        piece.z = state['z']
+        restored[piece.pid] = piece
+
+    return restored
+
+
+def edge_ids(nx, ny):
+    """
+    The edge id of each side of each piece, in the order north, east, south,
+    west. Sides along the border of the puzzle are flat and get id -1.
+    :return: (nx * ny, 4) array of edge ids
+    """
+    pid = np.arange(nx * ny)
+    row = pid // nx
+    col = pid % nx
+    nv = (nx - 1) * ny
+    return np.stack([
+        np.where(row > 0, pid - nx + nv, -1),
+        np.where(col < nx - 1, pid - row, -1),
+        np.where(row < ny - 1, pid + nv, -1),
+        np.where(col > 0, pid - row - 1, -1),
+    ], axis=1)
+
+
+class Contours:
+    """
+    The outlines of all pieces in a cut. Every interior edge is shared by two
+    pieces, so each edge is sampled once into a shared vertex buffer, and the
+    polygon of a piece is a list of indices into that buffer: forwards along
+    its north and east edges and backwards along its south and west edges.
+    Flat sides on the border only contribute a corner of the grid.
+
+    The indices of piece pid are indices[offsets[pid]:offsets[pid + 1]].
+
+    The polygon of a piece is gathered from the shared buffer each time it is
+    asked for, so that no copy of all the outlines is kept around. Indexing
+    the contours by pid gives the same polygon, which lets them stand in for
+    a list of polygons.
+    """
+    def __init__(self, vertices, indices, offsets):
+        self.vertices = vertices
+        self.indices = indices
+        self.offsets = offsets
+
+    @property
+    def points(self):
+        """
+        :return: New (len(indices), 2) array of the vertices of all polygons,
+        one polygon after the other
+        """
+        return self.vertices[self.indices]
+
+    def polygon(self, pid):
+        return self.vertices[
+            self.indices[self.offsets[pid]:self.offsets[pid + 1]]
+        ]
+
+    def bounding_boxes(self):
+        """
+        :return: (lower, upper) tuple of (num_pieces, 2) arrays
+        """
+        points = self.points
+        return (
+            np.minimum.reduceat(points, self.offsets[:-1]),
+            np.maximum.reduceat(points, self.offsets[:-1])
+        )
+
+    def __getitem__(self, pid):
+        return self.polygon(pid)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+def make_contours(control_points, nx, ny, width, height, n=10, tolerance=0):
+    """
+    Evaluates all the edges of the cut in one go. The control points are
+    stretched, rotated and translated into image coordinates as arrays, and
+    all the Beziers are then evaluated together.
+    Each edge is sampled once, in the direction used by the piece on its
+    south (for horizontal edges) or west (for vertical edges) side, including
+    its end point so that the piece on the other side can walk it backwards.
+
+    :param control_points: (num_edges, 4, 4, 2) array from edge_control_points
+    :param n: Number of samples per Bezier, when tolerance is 0.
+    :param tolerance: If positive, each Bezier gets as few samples as
+    possible while staying within this many pixels of the true curve.
+    :return: Contours of all the nx * ny pieces
+    """
+    num_pieces = nx * ny
+    num_edges = len(control_points)
+    nv = (nx - 1) * ny
+
+    # Vertical edges are the east side of the piece to the left of them and
+    # horizontal edges are the north side of the piece below them.
+    epid = np.arange(num_edges)
+    pid = np.where(
+        epid < nv,
+        epid + epid // (nx - 1) if nx > 1 else 0,
+        epid - nv + nx
+    )
+    is_vertical = (epid < nv)[:, None, None, None]
+    translation = np.stack([
+        width * (pid % nx) + width / 2 + np.where(epid < nv, width, 0),
+        height * (pid // nx) + height / 2
+    ], axis=1)
+
+    cp = np.where(
+        is_vertical,
+        (control_points * (height / 200, width / 200))[..., ::-1],
+        control_points * (width / 200, height / 200)
+    ) + translation[:, None, None, :]
+
+    beziers = cp.reshape(-1, 4, 2)
+    if tolerance > 0:
+        counts = flatness_segments(beziers, tolerance)
+    else:
+        counts = np.full(len(beziers), n)
+
+    # Edge e is vertices[edge_offsets[e]:edge_offsets[e + 1]], where the last
+    # vertex is the end point of the edge.
+    edge_lengths = counts.reshape(num_edges, 4).sum(axis=1)
+    edge_offsets = np.zeros(num_edges + 1, dtype=np.int64)
+    np.cumsum(edge_lengths + 1, out=edge_offsets[1:])
+    is_end_point = np.zeros(edge_offsets[-1], dtype=bool)
+    is_end_point[edge_offsets[1:] - 1] = True
+
+    corners = np.stack(np.meshgrid(
+        width * np.arange(nx + 1) + width / 2,
+        height * np.arange(ny + 1) + height / 2
+    ), axis=-1).reshape(-1, 2)
+    vertices = np.empty((edge_offsets[-1] + len(corners), 2))
+    vertices[:edge_offsets[-1]][~is_end_point] = sample_beziers(
+        beziers, counts)
+    vertices[:edge_offsets[-1]][is_end_point] = cp[:, 3, 3]
+    vertices[edge_offsets[-1]:] = corners
+
+    # The corner that a flat side starts in, as (column, row) offsets from the
+    # top left corner of the piece, for the north, east, south and west side.
+    first_corner = np.array([(0, 0), (1, 0), (1, 1), (0, 1)])
+    is_reversed = np.array([False, False, True, True])
+
+    epids = edge_ids(nx, ny)
+    is_curved = epids >= 0
+    lengths = np.where(is_curved, edge_lengths[epids], 1)
+    offsets = np.zeros(num_pieces + 1, dtype=np.int64)
+    np.cumsum(lengths.sum(axis=1), out=offsets[1:])
+    side_start = offsets[:-1, None] + np.cumsum(lengths, axis=1) - lengths
+
+    piece = np.arange(num_pieces)
+    indices = np.empty(offsets[-1], dtype=np.int32)
+    for side in range(4):
+        curved = is_curved[:, side]
+        edge = epids[curved, side]
+        side_lengths = edge_lengths[edge]
+        side_edge = np.repeat(np.arange(len(edge)), side_lengths)
+        k = np.arange(len(side_edge)) - (
+            np.cumsum(side_lengths) - side_lengths)[side_edge]
+        if is_reversed[side]:
+            index = edge_offsets[edge][side_edge] + side_lengths[side_edge] - k
+        else:
+            index = edge_offsets[edge][side_edge] + k
+        indices[side_start[curved, side][side_edge] + k] = index
+
+        flat = piece[~curved]
+        column = flat % nx + first_corner[side, 0]
+        row = flat // nx + first_corner[side, 1]
+        indices[side_start[~curved, side]] = (
+            edge_offsets[-1] + row * (nx + 1) + column
+        )
+
+    return Contours(vertices, indices, offsets)
+
+
 def create_neighbours(pid, n, nx):
     return set(filter(
         lambda p:
@@ -596,6 +1700,21 @@ def create_neighbours(pid, n, nx):
     ))
 
 
+def shuffled_piece_edges(nx, ny):
+    """
+    :return: (num_edges, 2) array of all pairs of neighbouring pids, in
+    random order
+    """
+    pids = np.arange(nx * ny).reshape(ny, nx)
+    edges = np.concatenate([
+        np.stack([pids[:, :-1].ravel(), pids[:, 1:].ravel()], axis=1),
+        np.stack([pids[:-1, :].ravel(), pids[1:, :].ravel()], axis=1)
+    ])
+    edges = edges.tolist()
+    random.shuffle(edges)
+    return edges
+
+
 def point_to_pid(p, nx, width, height):
     return int(
         ((p.x - width / 2) // width) % nx +
@@ -0,0 +1,80 @@
+class Picker:
+    """
+    Finds the piece under the mouse pointer for hovering, at most once per
+    frame. Motion events only record where the pointer is, and update, which
+    is called once per frame, makes the actual query.
+
+    The result is cached together with the cell of the spatial hash that the
+    pointer is in and the version of that cell. As long as the pointer stays
+    put and nothing in the cell is moved, rotated, merged or brought to the
+    top, the cached result is used without asking the model again. Changes
+    that the spatial hash doesn't know about, like hiding a tray, have to be
+    signalled with invalidate.
+
+    The pointer is kept in view coordinates and converted to model
+    coordinates on every update, so that the result follows the camera when
+    it is panned, zoomed or rebased while the mouse stands still.
+    """
+    def __init__(self, model, view_to_clip_coord):
+        """
+        :param view_to_clip_coord: Function that converts view coordinates,
+        i.e. pixels in the window, to clip coordinates, i.e. coordinates in
+        the model.
+        """
+        self.model = model
+        self.view_to_clip_coord = view_to_clip_coord
+        self.pid = None
+        self.num_queries = 0
+        self.num_cache_hits = 0
+        self._pointer = None
+        self._point = None
+        self._cell = None
+        self._version = None
+
+    def move_to(self, x_, y_):
+        """
+        :param x_, y_: View coordinates of the pointer
+        """
+        self._pointer = (x_, y_)
+
+    def invalidate(self):
+        self._version = None
+
+    def update(self):
+        """
+        :return: Tuple (pid, is_changed), where pid is the pid of the piece
+        under the pointer, or None if there isn't one, and is_changed tells
+        whether it differs from the previous frame.
+        """
+        if self._pointer is None:
+            return self.pid, False
+
+        point = self.view_to_clip_coord(*self._pointer)
+        spatial_hash = self.model.spatial_hash
+        cell = spatial_hash.cell_at(*point)
+        version = spatial_hash.version(cell)
+        is_cached = (
+            point == self._point and
+            cell == self._cell and
+            version == self._version
+        )
+        if is_cached:
+            self.num_cache_hits += 1
+            if self.pid is None:
+                return None, False
+            # The piece may have been merged into a smaller one that was
+            # moved onto it, which leaves this cell alone but changes the pid
+            pid = self.model.clusters.find(self.pid)
+            is_changed = pid != self.pid
+            self.pid = pid
+            return pid, is_changed
+
+        self.num_queries += 1
+        piece = self.model.piece_at_coordinate(*point)
+        pid = None if piece is None else piece.pid
+        is_changed = pid != self.pid
+        self.pid = pid
+        self._point = point
+        self._cell = cell
+        self._version = version
+        return pid, is_changed
@@ -1,3 +1,5 @@
+import multiprocessing
+
 import pyglet
 
 import src.settings as settings
@@ -5,5 +7,7 @@ from src.controller import Controller
 
 
 if __name__ == '__main__':
+    # Needed for the triangulation worker processes in the frozen executable
+    multiprocessing.freeze_support()
     controller = Controller()
     pyglet.app.run(interval=settings.window.refresh_interval)
@@ -0,0 +1,100 @@
+"""
+Saved games are stored in a single binary file made of a header and a
+number of raw arrays:
+
+    magic | format version | header length | JSON header | arrays
+
+The header is JSON with everything that isn't an array (the settings, the
+seed, the timer) and the dtype, shape and offset of every array. Each array
+starts at a multiple of ALIGNMENT bytes after the end of the header, so that
+the arrays can be memory mapped straight from the file, without parsing or
+decompressing anything.
+"""
+import json
+import os
+import struct
+import uuid
+
+import numpy as np
+
+
+MAGIC = b'PYGSAW\x00\x00'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+# Format version and header length
+_PREAMBLE = struct.Struct('<II')
+
+
+def save(path, meta, arrays):
+    """
+    :param meta: Dict that can be written as JSON
+    :param arrays: Dict of NumPy arrays, keyed by name
+    """
+    arrays = {
+        name: np.ascontiguousarray(array) for name, array in arrays.items()
+    }
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'offset': offset
+        }
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({'meta': meta, 'arrays': layout}).encode()
+
+    # Write to a temporary file first, so that an interrupted save never
+    # replaces a good save with a truncated one.
+    tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_PREAMBLE.pack(FORMAT_VERSION, len(header)))
+        f.write(header)
+        start = _align(f.tell())
+        for name, array in arrays.items():
+            f.seek(start + layout[name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(start + offset)
+    os.replace(tmp, path)
+
+
+def load(path):
+    """
+    :return: Tuple (meta, arrays), where arrays is a dict of read-only arrays
+    that are memory mapped from the file.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a saved game")
+        version, header_length = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if version != FORMAT_VERSION:
+            raise ValueError(
+                f"{path} has format version {version}, "
+                f"expected {FORMAT_VERSION}"
+            )
+        header = json.loads(f.read(header_length))
+        start = _align(f.tell())
+
+    layout = header['arrays']
+    if os.path.getsize(path) == start:
+        data = np.zeros(0, dtype=np.uint8)
+    else:
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays = {}
+    for name, column in layout.items():
+        dtype = np.dtype(column['dtype'])
+        shape = tuple(column['shape'])
+        begin = start + column['offset']
+        end = begin + dtype.itemsize * int(np.prod(shape))
+        arrays[name] = data[begin:end].view(dtype).reshape(shape)
+    return header['meta'], arrays
+
+
+def is_save_file(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
@@ -0,0 +1,117 @@
+import numpy as np
+
+from src.hitmask import polygon_segments
+
+
+# Upper bound on the number of (polygon segment, region segment) pairs that
+# are tested at once, to bound the memory used.
+MAX_PAIRS = 2 ** 22
+
+# Cosine and sine of 0, 1, 2 and 3 quarter turns
+COS = np.array([1, 0, -1, 0])
+SIN = np.array([0, 1, 0, -1])
+
+
+def world_segments(contours, pids, x, y, rotation):
+    """
+    :param pids: Array of pids whose polygons to get
+    :param x, y, rotation: Arrays with the position and rotation that each
+    polygon is drawn with, i.e. those of the piece it belongs to.
+    :return: (len(pids), max_length, 2, 2) array of the polygons as
+    segments, rotated and translated to where they are on the table.
+    """
+    segments = polygon_segments(contours, pids)
+    c = COS[rotation][:, None, None]
+    s = SIN[rotation][:, None, None]
+    px = segments[..., 0]
+    py = segments[..., 1]
+    return np.stack([
+        c * px - s * py + x[:, None, None],
+        s * px + c * py + y[:, None, None]
+    ], axis=-1)
+
+
+def polygons_in_region(segments, region, mode='overlap'):
+    """
+    Tests many polygons against one selection region at once.
+    :param segments: (n, num_segments, 2, 2) array of polygon segments, as
+    from world_segments
+    :param region: (m, 2) array with the vertices of the selection polygon,
+    like the corners of a rectangle or the points of a lasso.
+    :param mode: 'overlap' to keep the polygons that overlap the region at
+    all, 'inside' to keep only those that are entirely inside it.
+    :return: (n,) bool array, which polygons are selected
+    """
+    if mode not in ('overlap', 'inside'):
+        raise ValueError(f'Unknown selection mode {mode}')
+
+    region = np.asarray(region, dtype=float)
+    region_segments = np.stack([region, np.roll(region, -1, axis=0)], axis=1)
+    n, num_segments = segments.shape[:2]
+    chunk_size = max(1, MAX_PAIRS // (num_segments * len(region)))
+    is_selected = np.zeros(n, dtype=bool)
+    for start in range(0, n, chunk_size):
+        chunk = segments[start:start + chunk_size]
+        vertices = chunk[:, :, 0]
+        is_vertex_inside = points_in_polygons(
+            vertices, region_segments[None])
+        is_crossing = segments_cross(chunk, region_segments)
+        if mode == 'inside':
+            is_selected[start:start + chunk_size] = (
+                is_vertex_inside.all(axis=1) & ~is_crossing
+            )
+        else:
+            # If no outline crosses the other and no vertex of the polygon
+            # is in the region, they only overlap if the region is inside
+            # the polygon.
+            is_region_inside = points_in_polygons(
+                np.broadcast_to(region[None, :1], (len(chunk), 1, 2)),
+                chunk
+            )[:, 0]
+            is_selected[start:start + chunk_size] = (
+                is_vertex_inside.any(axis=1) | is_crossing | is_region_inside
+            )
+    return is_selected
+
+
+def points_in_polygons(points, segments):
+    """
+    Even-odd test of points against polygons, by counting the segments that
+    cross a horizontal ray to the right of each point.
+    :param points: (n, k, 2) array, k points to test for each polygon
+    :param segments: (n, num_segments, 2, 2) array of polygon segments, where
+    n can also be 1 to test all points against the same polygon.
+    :return: (n, k) bool array
+    """
+    px = points[:, :, None, 0]
+    py = points[:, :, None, 1]
+    x0 = segments[:, None, :, 0, 0]
+    y0 = segments[:, None, :, 0, 1]
+    x1 = segments[:, None, :, 1, 0]
+    y1 = segments[:, None, :, 1, 1]
+    crosses = (y0 <= py) != (y1 <= py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+    return np.count_nonzero(crosses & (px < x), axis=-1) % 2 == 1
+
+
+def segments_cross(segments, other):
+    """
+    :param segments: (n, num_segments, 2, 2) array of polygon segments
+    :param other: (m, 2, 2) array of segments
+    :return: (n,) bool array, whether any of the segments of each polygon
+    properly crosses any of the other segments.
+    """
+    a0 = segments[:, :, None, 0]
+    a1 = segments[:, :, None, 1]
+    b0 = other[None, None, :, 0]
+    b1 = other[None, None, :, 1]
+    d1 = _cross(b1 - b0, a0 - b0)
+    d2 = _cross(b1 - b0, a1 - b0)
+    d3 = _cross(a1 - a0, b0 - a0)
+    d4 = _cross(a1 - a0, b1 - a0)
+    return ((d1 * d2 < 0) & (d3 * d4 < 0)).any(axis=(1, 2))
+
+
+def _cross(u, v):
+    return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
@@ -1,6 +1,7 @@
 import math
 
 from dataclasses import dataclass
+from typing import Tuple
 
 
 @dataclass
@@ -28,6 +29,33 @@ class Gameplay:
     snap_distance_percent: float = 0.5
     big_piece_threshold: int = 50
     pan_speed: float = 0.8
+    # Number of processes used to triangulate the pieces when a puzzle is
+    # started. With 0 or 1 it is all done in the main process.
+    num_workers: int = 0
+    # When positive, the edges are sampled adaptively so that the piece
+    # outlines stay within this many pixels of the true curves, instead of
+    # using a fixed number of points per curve.
+    flatness_tolerance: float = 0
+    # Coarser flatness tolerances, in pixels, that the edges are also
+    # sampled with up front. The view draws the coarsest of them that is
+    # still smooth at the current zoom level. Empty to always draw the
+    # outlines given by flatness_tolerance.
+    lod_tolerances: Tuple[float, ...] = ()
+    # Maximum size in bytes of the on-disk cache of contours, triangles and
+    # normal maps. Set to 0 to disable the cache.
+    cut_cache_size: int = 500 * 2 ** 20
+    # Size in image pixels of the pixels of the masks used to find the piece
+    # under the mouse without testing the whole outline. Set to 0 to always
+    # test the outline.
+    hit_mask_resolution: float = 2
+    # Which pieces the selection box picks up: 'overlap' for those whose
+    # outlines overlap it, 'inside' for those entirely inside it and 'bbox'
+    # for those whose bounding boxes overlap it.
+    selection_mode: str = 'overlap'
+    # When the middle of the pieces on the table is further than this from
+    # the origin, all pieces are moved back around the origin, so that
+    # coordinates stay small enough to be precise on the GPU.
+    rebase_distance: float = 2 ** 16
 
     @property
     def num_pieces(self):
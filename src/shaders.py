@@ -1,6 +1,8 @@
 from pyglet import gl
 from pyglet.graphics.shader import Shader, ShaderProgram
 
+from src.model import MAX_TRAY_DEPTH
+
 
 piece_vs = """#version 330 core
     in vec4 position;
@@ -20,14 +22,32 @@ piece_vs = """#version 330 core
     } window;  
 
     uniform vec3 translate;
-    uniform float hidden;
     uniform mat4 rotation;
 
+    // Whether each tray is shown, and the tray it is nested in, by tray
+    uniform sampler2D tray_visibility;
+    uniform int tray;
+
+    const int MAX_TRAY_DEPTH = """ + str(MAX_TRAY_DEPTH) + """;
+
     mat4 m_translation = mat4(1.0);
 
+    bool is_hidden()
+    {
+        int t = tray;
+        for (int i = 0; i < MAX_TRAY_DEPTH && t >= 0; i++) {
+            vec2 entry = texelFetch(tray_visibility, ivec2(t, 0), 0).rg;
+            if (entry.r == 0.0) {
+                return true;
+            }
+            t = int(entry.g);
+        }
+        return false;
+    }
+
     void main()
     {
-        if (hidden > 0.0) {
+        if (is_hidden()) {
             gl_Position = vec4(0, 0, 0, 0);
         } else {
             if (orientation == 0.0) {
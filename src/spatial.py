@@ -0,0 +1,238 @@
+import math
+from bisect import bisect_left, insort
+
+import numpy as np
+
+
+class SpatialHash:
+    """
+    Uniform grid of cells, each holding the items whose bounding box overlaps
+    the cell. With cells about the size of one piece, inserting, removing and
+    finding a piece at a point only touches a handful of cells, no matter how
+    many pieces there are. The cells are kept in a dict, so the grid has no
+    bounds and only uses memory where there are pieces.
+
+    Every item also has a z level, and each cell keeps its items sorted by z,
+    so that the items at a point can be listed from the top down without
+    sorting them. Changing the z level of an item moves it within the lists
+    of its cells, which is cheap when it is moved to the top.
+
+    Each cell also has a version, which changes whenever anything in the
+    cell is added, removed, moved or changes z level, so that the result of a
+    query in a cell can be cached until the cell changes.
+
+    Has the same insert/remove/intersect interface as pyqtree.Index, but the
+    items must be hashable and orderable.
+    """
+    def __init__(self, cell_width, cell_height):
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        # Lists of (z, item) tuples in ascending order
+        self.cells = {}
+        self.boxes = {}
+        self.z = {}
+        self.versions = {}
+        self._version = 0
+
+    def insert(self, item, bbox, z=0):
+        """
+        :param bbox: (left, bottom, right, top) tuple
+        """
+        self.boxes[item] = bbox
+        self.z[item] = z
+        self._add_to_cells(item, self._cells(bbox))
+
+    def remove(self, item, bbox=None):
+        """
+        :param bbox: Ignored, the box that the item was inserted with is used.
+        Only there to be compatible with pyqtree.
+        """
+        self._remove_from_cells(item, self._cells(self.boxes[item]))
+        del self.boxes[item]
+        del self.z[item]
+
+    def set_z(self, items, z):
+        """
+        Changes the z level of the items, where items and z are sequences of
+        the same length.
+        """
+        for item, item_z in zip(items, z):
+            cells = self._cells(self.boxes[item])
+            self._remove_from_cells(item, cells)
+            self.z[item] = item_z
+            self._add_to_cells(item, cells)
+
+    def translate(self, items, dx, dy):
+        """
+        Moves the boxes of all items by (dx, dy) in one go. Only the items
+        that end up overlapping a different set of cells are moved between
+        cells, which for a short drag is usually very few of them.
+        """
+        items = list(items)
+        if len(items) == 0:
+            return
+        boxes = np.array([self.boxes[item] for item in items])
+        new_boxes = boxes + (dx, dy, dx, dy)
+        old_ranges = self._cell_ranges(boxes)
+        new_ranges = self._cell_ranges(new_boxes)
+
+        for item, box in zip(items, new_boxes.tolist()):
+            self.boxes[item] = tuple(box)
+
+        is_changed = (old_ranges != new_ranges).any(axis=1)
+        for cell_range in np.unique(old_ranges[~is_changed], axis=0).tolist():
+            self._touch(_cells_in_range(*cell_range))
+
+        changed = np.flatnonzero(is_changed)
+        for i in changed.tolist():
+            item = items[i]
+            self._remove_from_cells(
+                item, _cells_in_range(*old_ranges[i].tolist()))
+            self._add_to_cells(
+                item, _cells_in_range(*new_ranges[i].tolist()))
+
+    def intersect(self, bbox):
+        """
+        :return: Set of items whose bounding boxes overlap bbox
+        """
+        left, bottom, right, top = bbox
+        i0, j0, i1, j1 = self._cell_range(bbox)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self.cells):
+            # Cheaper to look at every occupied cell than every cell in bbox
+            cells = [
+                entries for (i, j), entries in self.cells.items()
+                if i0 <= i <= i1 and j0 <= j <= j1
+            ]
+        else:
+            cells = [
+                entries for cell in self._cells(bbox)
+                if (entries := self.cells.get(cell)) is not None
+            ]
+
+        boxes = self.boxes
+        return {
+            item for entries in cells for _, item in entries
+            if _overlaps(boxes[item], left, bottom, right, top)
+        }
+
+    def intersect_point(self, x, y):
+        """
+        :return: List of the items whose bounding boxes contain the point,
+        from the highest z level to the lowest.
+        """
+        boxes = self.boxes
+        entries = self.cells.get(self.cell_at(x, y), [])
+        return [
+            item for _, item in reversed(entries)
+            if _overlaps(boxes[item], x, y, x, y)
+        ]
+
+    def bounds(self):
+        """
+        :return: (left, bottom, right, top) of the occupied cells, or None if
+        there are no items.
+        """
+        if len(self.cells) == 0:
+            return None
+        cells = np.array(list(self.cells))
+        i0, j0 = cells.min(axis=0).tolist()
+        i1, j1 = (cells.max(axis=0) + 1).tolist()
+        return (
+            i0 * self.cell_width,
+            j0 * self.cell_height,
+            i1 * self.cell_width,
+            j1 * self.cell_height
+        )
+
+    def shift(self, di, dj):
+        """
+        Moves all items by (di * cell_width, dj * cell_height). Since that is
+        a whole number of cells, no item changes cell; the cells are only
+        renamed.
+        """
+        dx = di * self.cell_width
+        dy = dj * self.cell_height
+        self.cells = {
+            (i + di, j + dj): entries for (i, j), entries in self.cells.items()
+        }
+        self.boxes = {
+            item: (left + dx, bottom + dy, right + dx, top + dy)
+            for item, (left, bottom, right, top) in self.boxes.items()
+        }
+        old_cells = list(self.versions)
+        self.versions = {
+            (i + di, j + dj): version
+            for (i, j), version in self.versions.items()
+        }
+        self._touch(old_cells + list(self.versions))
+
+    def cell_at(self, x, y):
+        return (
+            math.floor(x / self.cell_width),
+            math.floor(y / self.cell_height)
+        )
+
+    def version(self, cell):
+        return self.versions.get(cell, 0)
+
+    def _touch(self, cells):
+        self._version += 1
+        for cell in cells:
+            self.versions[cell] = self._version
+
+    def _add_to_cells(self, item, cells):
+        self._touch(cells)
+        entry = (self.z[item], item)
+        for cell in cells:
+            if (entries := self.cells.get(cell)) is None:
+                self.cells[cell] = [entry]
+            else:
+                insort(entries, entry)
+
+    def _remove_from_cells(self, item, cells):
+        self._touch(cells)
+        entry = (self.z[item], item)
+        for cell in cells:
+            entries = self.cells[cell]
+            del entries[bisect_left(entries, entry)]
+            if len(entries) == 0:
+                del self.cells[cell]
+
+    def _cell_range(self, bbox):
+        left, bottom, right, top = bbox
+        return (
+            math.floor(left / self.cell_width),
+            math.floor(bottom / self.cell_height),
+            math.floor(right / self.cell_width),
+            math.floor(top / self.cell_height)
+        )
+
+    def _cell_ranges(self, boxes):
+        # Vectorized _cell_range for a (n, 4) array of boxes
+        cell_size = (
+            self.cell_width, self.cell_height,
+            self.cell_width, self.cell_height
+        )
+        return np.floor(boxes / cell_size).astype(np.int64)
+
+    def _cells(self, bbox):
+        return _cells_in_range(*self._cell_range(bbox))
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __eq__(self, other):
+        return self.boxes == other.boxes and self.z == other.z
+
+
+def _cells_in_range(i0, j0, i1, j1):
+    return [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+
+
+def _overlaps(box, left, bottom, right, top):
+    return (
+        box[0] <= right and
+        box[2] >= left and
+        box[1] <= top and
+        box[3] >= bottom
+    )
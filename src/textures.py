@@ -1,4 +1,5 @@
 import aggdraw
+import numpy as np
 from pyglet.image import ImageData
 from PIL import Image, ImageFilter, ImageMath
 
@@ -68,10 +69,7 @@ def make_height_map(polygons, width, height):
     context = aggdraw.Draw(texture)
     pen = aggdraw.Pen('gray', 1)
     for polygon in polygons:
-        point_list = []
-        for point in polygon:
-            point_list.append(point.x)
-            point_list.append(point.y)
+        point_list = polygon.ravel().tolist()
         point_list.append(point_list[0])
         point_list.append(point_list[1])
         context.line(point_list, pen)
@@ -87,6 +85,24 @@ def make_normal_map(
         image_height,
         piece_width,
         piece_height):
+    return normal_map_texture(make_normal_map_array(
+        polygons,
+        image_width,
+        image_height,
+        piece_width,
+        piece_height
+    ))
+
+
+def make_normal_map_array(
+        polygons,
+        image_width,
+        image_height,
+        piece_width,
+        piece_height):
+    """
+    :return: (image_height, image_width, 4) uint8 array of RGBA pixels
+    """
     height_map = make_height_map(
         polygons,
         image_width + piece_width,
@@ -103,11 +119,15 @@ def make_normal_map(
         )
     ).convert('RGBA')
 
-    # return normal_map
+    return np.asarray(normal_map)
+
+
+def normal_map_texture(pixels):
+    height, width, _ = pixels.shape
     return ImageData(
-        normal_map.width,
-        normal_map.height,
+        width,
+        height,
         'RGBA',
-        normal_map.tobytes(),
-        normal_map.width * 4
+        pixels.tobytes(),
+        width * 4
     ).get_texture()
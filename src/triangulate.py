@@ -0,0 +1,72 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from tqdm import tqdm
+
+from src import earcut
+
+
+# Splitting the pieces into a few more ranges than there are workers evens
+# out the load, since border pieces are quicker to triangulate.
+SHARDS_PER_WORKER = 4
+
+
+def triangulate(vertices, offsets, num_workers=0):
+    """
+    Triangulates a list of polygons packed into one array, where polygon i is
+    vertices[offsets[i]:offsets[i + 1]]. With more than one worker, the
+    polygons are split into contiguous ranges that are triangulated in
+    separate processes, and the results are stitched back together in order.
+
+    :param vertices: (num_vertices, 2) array
+    :param offsets: (num_polygons + 1) int array
+    :param num_workers: Number of worker processes. With 0 or 1 everything
+    runs in the calling process.
+    :return: (triangles, triangle_offsets) tuple, where the triangle indices
+    of polygon i are triangles[triangle_offsets[i]:triangle_offsets[i + 1]],
+    counted from the first vertex of that polygon.
+    """
+    num_polygons = len(offsets) - 1
+    if num_workers < 2 or num_polygons < 2:
+        return _triangulate_range(vertices, offsets)
+
+    bounds = np.linspace(
+        0,
+        num_polygons,
+        min(num_polygons, num_workers * SHARDS_PER_WORKER) + 1
+    ).astype(np.int64)
+
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        futures = [
+            pool.submit(
+                _triangulate_range,
+                vertices[offsets[start]:offsets[stop]],
+                offsets[start:stop + 1] - offsets[start]
+            )
+            for start, stop in zip(bounds[:-1], bounds[1:])
+        ]
+        results = [
+            future.result()
+            for future in tqdm(futures, desc="Triangulating pieces")
+        ]
+
+    triangles = np.concatenate([t for t, _ in results])
+    triangle_offsets = np.zeros(num_polygons + 1, dtype=np.int64)
+    np.cumsum(
+        np.concatenate([np.diff(o) for _, o in results]),
+        out=triangle_offsets[1:]
+    )
+    return triangles, triangle_offsets
+
+
+def _triangulate_range(vertices, offsets):
+    num_polygons = len(offsets) - 1
+    triangles = []
+    triangle_offsets = np.zeros(num_polygons + 1, dtype=np.int64)
+    for i in range(num_polygons):
+        polygon = vertices[offsets[i]:offsets[i + 1]]
+        indices = earcut.earcut(polygon.ravel().tolist())
+        triangles += indices
+        triangle_offsets[i + 1] = triangle_offsets[i] + len(indices)
+
+    return np.array(triangles, dtype=np.uint32), triangle_offsets
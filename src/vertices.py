@@ -0,0 +1,38 @@
+import numpy as np
+
+
+def place_polygons(polygons, polygon_piece, vertex_lists, x, y, z, r):
+    """
+    Writes the vertices of the polygons of many pieces into their vertex
+    lists, rotated by the rotation of their piece and moved to its position,
+    all in one go.
+    :param polygons: List of (n, 2) arrays of vertices, relative to the
+    position of their piece
+    :param polygon_piece: Array with the index of the piece of each polygon
+    :param vertex_lists: The vertex list of each polygon, with position and
+    orientation attributes
+    :param x, y, z, r: Arrays with the position and rotation, in quarter
+    turns, of each piece
+    """
+    lengths = np.array([len(polygon) for polygon in polygons])
+    vertex_piece = np.repeat(polygon_piece, lengths)
+
+    vertices = np.concatenate(polygons)
+    angle = r[vertex_piece] * np.pi / 2
+    c = np.cos(angle)
+    s = np.sin(angle)
+    new_vertices = np.empty((len(vertices), 3))
+    new_vertices[:, 0] = \
+        vertices[:, 0] * c - vertices[:, 1] * s + x[vertex_piece]
+    new_vertices[:, 1] = \
+        vertices[:, 0] * s + vertices[:, 1] * c + y[vertex_piece]
+    new_vertices[:, 2] = z[vertex_piece]
+
+    positions = new_vertices.ravel().tolist()
+    orientations = r[polygon_piece].tolist()
+    start = 0
+    for vertex_list, length, orientation in zip(
+            vertex_lists, lengths.tolist(), orientations):
+        vertex_list.position[:] = positions[3 * start:3 * (start + length)]
+        vertex_list.orientation[:] = (orientation,) * length
+        start += length
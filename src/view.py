@@ -1,8 +1,10 @@
 import time
 import math
+import ctypes
 import itertools
 import glob
 
+import numpy as np
 import pyglet
 import pyglet.gl as gl
 import pyglet.window.key as key
@@ -12,47 +14,131 @@ from pyglet.math import Mat4
 from humanfriendly import format_timespan
 
 import src.settings as settings
-from src import earcut
+from src.triangulate import triangulate
 from src.shaders import make_piece_shader, make_shape_shader, make_table_shader
-from src.textures import make_normal_map
+from src.textures import make_normal_map_array, normal_map_texture
+from src.cache import CutCache
 from src.file_picker import select_image
 from src.bezier import Point, rotate_points
+from src.vertices import place_polygons
 
 
 GROUP_COUNT = 2
 MAX_Z_DEPTH = 5000000
+# Side of the table quad, which grows when the pieces are spread further
+MIN_TABLE_SIZE = 131072
 
 PAN_KEYS = [key.W, key.A, key.S, key.D]
+# The number keys reach the trays of one page at a time
+TRAYS_PER_PAGE = 10
+# How far, in screen pixels, the drawn outlines of the pieces may be from the
+# true curves when a coarser level of detail is picked
+LOD_SCREEN_TOLERANCE = 0.5
+
+
+class TrayVisibility:
+    """
+    Whether each tray is shown, and the tray it is nested in, as a texture
+    with one RG texel per tray that the piece shader reads. Showing or hiding
+    a tray writes a single texel, no matter how many pieces or groups are in
+    it. The texture doubles in size when a tray beyond its end is used.
+    """
+    def __init__(self, is_shown, parents):
+        self.texture_id = gl.GLuint()
+        gl.glGenTextures(1, ctypes.byref(self.texture_id))
+        self.data = np.empty((0, 2), dtype=np.float32)
+        self._grow(max(16, len(parents)))
+        self.data[:len(parents), 0] = is_shown
+        self.data[:len(parents), 1] = parents
+        self._upload()
+
+    def set_shown(self, tray, is_shown):
+        self._set(tray, 0, 1.0 if is_shown else 0.0)
+
+    def set_parent(self, tray, parent):
+        self._set(tray, 1, parent)
+
+    def bind(self, unit):
+        gl.glActiveTexture(gl.GL_TEXTURE0 + unit)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture_id)
+
+    def unbind(self, unit):
+        gl.glActiveTexture(gl.GL_TEXTURE0 + unit)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+
+    def _set(self, tray, channel, value):
+        if tray >= len(self.data):
+            self._grow(2 * tray)
+            self.data[tray, channel] = value
+            self._upload()
+            return
+
+        self.data[tray, channel] = value
+        texel = self.data[tray]
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture_id)
+        gl.glTexSubImage2D(
+            gl.GL_TEXTURE_2D, 0, tray, 0, 1, 1, gl.GL_RG, gl.GL_FLOAT,
+            texel.ctypes.data
+        )
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+
+    def _grow(self, size):
+        # New trays are shown and not nested
+        new_data = np.empty((size, 2), dtype=np.float32)
+        new_data[:] = (1.0, -1.0)
+        new_data[:len(self.data)] = self.data
+        self.data = new_data
+
+    def _upload(self):
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture_id)
+        gl.glTexParameteri(
+            gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+        gl.glTexParameteri(
+            gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+        gl.glTexImage2D(
+            gl.GL_TEXTURE_2D, 0, gl.GL_RG32F, len(self.data), 1, 0,
+            gl.GL_RG, gl.GL_FLOAT, self.data.ctypes.data
+        )
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
 
 
 class PieceGroupFactory:
     default_groups = dict()
-    big_groups = {tray: set() for tray in range(10)}
+    big_groups = dict()
     hand_group = None
+    tray_visibility = None
     _hide_borders = False
 
     @staticmethod
-    def init_groups(texture, normal_map, visible_trays):
+    def init_groups(texture, normal_map, visible_trays, tray_parents):
+        PieceGroupFactory.tray_visibility = TrayVisibility(
+            [tray in visible_trays for tray in range(len(tray_parents))],
+            tray_parents
+        )
         PieceGroupFactory.default_groups = {
             tray: PieceGroup(texture, normal_map, tray=tray)
-            for tray in range(10)
+            for tray in range(len(tray_parents))
         }
-        PieceGroupFactory.big_groups = {tray: set() for tray in range(10)}
-        for tray in range(10):
-            is_visible = tray in visible_trays
-            PieceGroupFactory.toggle_visibility(tray, is_visible=is_visible)
-
-        PieceGroupFactory.hand_group = PieceGroup(texture, normal_map)
+        PieceGroupFactory.big_groups = dict()
+        # The hand is in no tray, so it is never hidden
+        PieceGroupFactory.hand_group = PieceGroup(texture, normal_map, tray=-1)
 
     @staticmethod
     def get_piece_group(tray):
-        return PieceGroupFactory.default_groups[tray]
+        groups = PieceGroupFactory.default_groups
+        if tray not in groups:
+            group = PieceGroupFactory.hand_group
+            groups[tray] = PieceGroup(group.texture, group.normal_map, tray)
+            groups[tray].set_border_visibility(PieceGroupFactory._hide_borders)
+        return groups[tray]
 
     @staticmethod
     def toggle_visibility(tray, is_visible):
-        PieceGroupFactory.default_groups[tray].set_visibility(is_visible)
-        for group in PieceGroupFactory.big_groups[tray]:
-            group.set_visibility(is_visible)
+        PieceGroupFactory.tray_visibility.set_shown(tray, is_visible)
+
+    @staticmethod
+    def add_tray(tray, parent):
+        PieceGroupFactory.tray_visibility.set_parent(tray, parent)
 
     @staticmethod
     def invert_border_visibility():
@@ -65,26 +151,26 @@ class PieceGroupFactory:
         for group in PieceGroupFactory.default_groups.values():
             group.set_border_visibility(hide_borders)
 
-        for tray in range(10):
-            for group in PieceGroupFactory.big_groups[tray]:
+        for groups in PieceGroupFactory.big_groups.values():
+            for group in groups:
                 group.set_border_visibility(hide_borders)
 
         PieceGroupFactory.hand_group.set_border_visibility(hide_borders)
 
     @staticmethod
     def move_to_group(group, tray):
-        old_group = group.tray
-        if group in PieceGroupFactory.big_groups[old_group]:
-            PieceGroupFactory.big_groups[old_group].remove(group)
+        old_groups = PieceGroupFactory.big_groups.get(group.tray, set())
+        old_groups.discard(group)
 
         group.tray = tray
-        PieceGroupFactory.big_groups[tray].add(group)
+        PieceGroupFactory.big_groups.setdefault(tray, set()).add(group)
 
     @staticmethod
     def new_big_group(tray):
-        dg = PieceGroupFactory.default_groups[tray]
+        dg = PieceGroupFactory.get_piece_group(tray)
         group = PieceGroup(dg.texture, dg.normal_map, tray=tray)
-        PieceGroupFactory.big_groups[tray].add(group)
+        group.set_border_visibility(PieceGroupFactory._hide_borders)
+        PieceGroupFactory.big_groups.setdefault(tray, set()).add(group)
         return group
 
 
@@ -94,7 +180,6 @@ class PieceGroup(pyglet.graphics.Group):
         super().__init__(*args, **kwargs)
         self.texture = texture
         self.normal_map = normal_map
-        self.tray = tray
         self.x = x
         self.y = y
         self.z = z
@@ -105,6 +190,7 @@ class PieceGroup(pyglet.graphics.Group):
         self.program['diffuse_map'] = 0
         self.program['normal_map'] = 1
         self.program['hide_borders'] = 0
+        self.program['tray_visibility'] = 2
         self.program['rotation'] = (
             1, 0, 0, 0,
             0, 1, 0, 0,
@@ -112,8 +198,20 @@ class PieceGroup(pyglet.graphics.Group):
             0, 0, 0, 1
         )
         self.program.stop()
+        self.tray = tray
         print(f"PieceGroup.__init__ - {self.program=}")
 
+    @property
+    def tray(self):
+        return self._tray
+
+    @tray.setter
+    def tray(self, tray):
+        self._tray = tray
+        self.program.use()
+        self.program['tray'] = tray
+        self.program.stop()
+
     def move(self, dx, dy, dz):
         self.set_position(self.x + dx, self.y + dy, self.z + dz)
 
@@ -137,14 +235,6 @@ class PieceGroup(pyglet.graphics.Group):
         )
         self.program.stop()
 
-    def set_visibility(self, is_visible):
-        self.program.use()
-        if is_visible:
-            self.program['hidden'] = 0.0
-        else:
-            self.program['hidden'] = 1.0
-        self.program.stop()
-
     def set_border_visibility(self, hide_border):
         self.program.use()
         self.program['hide_borders'] = 1 if hide_border else 0
@@ -156,13 +246,17 @@ class PieceGroup(pyglet.graphics.Group):
         gl.glBindTexture(self.texture.target, self.texture.id)
         gl.glActiveTexture(gl.GL_TEXTURE1)
         gl.glBindTexture(self.normal_map.target, self.normal_map.id)
+        PieceGroupFactory.tray_visibility.bind(2)
         gl.glEnable(gl.GL_DEPTH_TEST)
         gl.glDepthFunc(gl.GL_LESS)
 
     def unset_state(self):
         gl.glDisable(gl.GL_BLEND)
-        gl.glBindTexture(self.texture.target, 0)
+        PieceGroupFactory.tray_visibility.unbind(2)
+        gl.glActiveTexture(gl.GL_TEXTURE1)
         gl.glBindTexture(self.normal_map.target, 0)
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        gl.glBindTexture(self.texture.target, 0)
         self.program.stop()
 
     def __repr__(self):
@@ -286,13 +380,19 @@ class OrthographicProjection(pyglet.window.EventDispatcher):
         )
         self.update()
 
+    def translate(self, dx, dy):
+        # Moves the camera without panning, i.e. without moving the hand
+        self.clip_port.displace(dx, dy)
+        self.update()
+
     def pan(self, dx, dy):
+        # Panning happens many times per frame, so the handler of on_pan is
+        # expected to call update, once per frame.
         self.clip_port.displace(
             x := int(dx * self.clip_port.width),
             y := int(dy * self.clip_port.height)
         )
         self.dispatch_event('on_pan', x, y)
-        self.update()
 
     def update(self):
         width = max(1, self.view_port.width)
@@ -437,51 +537,117 @@ class View(pyglet.window.EventDispatcher):
         self.pieces = None
         self.hand = None
         self.number_keys = NumberKeys()
+        self.tray_page = 0
         self.texture = None
         self.normal_map = None
         self.is_paused = False
         self.table = None
+        self.hover_box = HoverBox(self.window.batch)
+        self.levels = []
+        self.level = 0
 
-    def reset(self, texture, piece_data, visible_trays):
+    def reset(self, texture, piece_data, visible_trays, contours, cut_key,
+              tray_parents, levels_of_detail=()):
+        """
+        :param contours: Contours of every piece in the cut, by pid
+        :param cut_key: Key of the cut in the CutCache, where the triangles
+        and the normal map are kept between games.
+        :param tray_parents: The tray that each tray is nested in, or -1
+        :param levels_of_detail: Coarser (tolerance, cut_key, contours) of
+        the same cut, from Model.levels_of_detail
+        """
         self.texture = texture
-        polygons = itertools.chain.from_iterable(
-            map(lambda pd: pd['polygons'].values(), piece_data)
-        )
-        print("Making normal map...")
-        self.normal_map = make_normal_map(
-            polygons,
-            texture.width,
-            texture.height,
-            piece_data[0]['width'],
-            piece_data[0]['height'],
-        )
-
-        PieceGroupFactory.init_groups(texture, self.normal_map, visible_trays)
+        cache = CutCache(max_bytes=settings.gameplay.cut_cache_size)
+        if (entry := cache.load(cut_key, 'normal_map')) is None:
+            print("Making normal map...")
+            polygons = itertools.chain.from_iterable(
+                map(lambda pd: pd['polygons'].values(), piece_data)
+            )
+            entry = {'normal_map': make_normal_map_array(
+                polygons,
+                texture.width,
+                texture.height,
+                piece_data[0]['width'],
+                piece_data[0]['height'],
+            )}
+            cache.store(cut_key, **entry)
+        self.normal_map = normal_map_texture(entry['normal_map'])
+
+        PieceGroupFactory.init_groups(
+            texture, self.normal_map, visible_trays, tray_parents)
 
         self.pieces = dict()
         self.hand = Hand()
         self.table = Table(self.window.batch)
-        self.projection.push_handlers(on_pan=self.hand.move)
-        self.projection.push_handlers(on_pan=self.selection_box.drag)
+        self.projection.push_handlers(on_pan=self.on_pan)
+
+        # All polygons of every level are triangulated up front, possibly in
+        # several processes, so that only the upload to the GPU is left to do
+        # here and when the level of detail changes.
+        self.levels = [
+            (tolerance, contours, *_load_or_triangulate(cache, key, contours))
+            for tolerance, key, contours in [
+                (settings.gameplay.flatness_tolerance, cut_key, contours),
+                *levels_of_detail
+            ]
+        ]
+        self.level = 0
+        _, _, triangles, triangle_offsets = self.levels[0]
 
         for data in tqdm(piece_data, desc='Creating pieces'):
-            self.create_piece(**data)
+            self.create_piece(
+                triangles=[
+                    triangles[triangle_offsets[pid]:triangle_offsets[pid + 1]]
+                    for pid in data['polygons']
+                ],
+                **data
+            )
+
+    def update_level_of_detail(self):
+        """
+        Draws the pieces with the coarsest level of detail that still looks
+        smooth at the current zoom level. Waits for the hand to be empty,
+        since the pieces in it are drawn relative to the hand.
+        """
+        level = _level_of_detail(
+            [tolerance for tolerance, *_ in self.levels],
+            self.projection.zoom_level
+        )
+        if level == self.level or not self.hand.is_empty:
+            return
+
+        self.level = level
+        _, contours, triangles, triangle_offsets = self.levels[level]
+        for piece in tqdm(self.pieces.values(), desc='Changing detail'):
+            piece.set_outlines(
+                contours,
+                [
+                    triangles[triangle_offsets[pid]:triangle_offsets[pid + 1]]
+                    for pid in piece.members
+                ]
+            )
 
     def destroy_pieces(self):
         for piece in self.pieces.values():
             for vl in piece.vertex_list:
                 vl.delete()
 
+        self.hover_box.hide()
         self.table.destroy_table()
 
     def new_jigsaw(self, s):
         self.hand.drop_everything()
         self.dispatch_event('on_new_game', s)
 
-    def create_piece(self, pid, polygons, position, rotation, width, height, tray):
+    def create_piece(self, pid, polygons, triangles, position, rotation, width,
+                     height, tray):
+        # The view keeps no polygons of its own, they are gathered from the
+        # contours of the current level of detail when needed
         self.pieces[pid] = Piece(
             pid,
-            polygons,
+            list(polygons),
+            self.levels[self.level][1],
+            triangles,
             tray,
             position,
             rotation,
@@ -497,6 +663,7 @@ class View(pyglet.window.EventDispatcher):
         self.window.toggle_pause(is_paused)
         self.is_paused = is_paused
         if is_paused:
+            self.hover_box.hide()
             if self.hand.is_mouse_down:
                 self.hand.mouse_up()
                 self.selection_box.deactivate()
@@ -520,9 +687,10 @@ class View(pyglet.window.EventDispatcher):
         if self.is_paused:
             return
 
+        x, y = self.projection.view_to_clip_coord(x_, y_)
+        self.dispatch_event('on_mouse_up', x, y)
         self.hand.is_mouse_down = False
         if self.selection_box.is_active:
-            x, y = self.projection.view_to_clip_coord(x_, y_)
             self.selection_box.drag_to(x, y)
             self.dispatch_event(
                 'on_selection_box',
@@ -542,7 +710,57 @@ class View(pyglet.window.EventDispatcher):
         elif not self.hand.is_empty:
             dx = dx_ / self.projection.zoom_level
             dy = dy_ / self.projection.zoom_level
-            self.hand.move(dx, dy)
+            self.dispatch_event('on_hand_drag', dx, dy)
+
+    def on_mouse_motion(self, x_, y_, dx_, dy_):
+        # The controller converts the view coordinates once per frame, with
+        # the projection of that frame
+        if self.is_paused:
+            return
+        self.dispatch_event('on_hover', x_, y_)
+
+    def on_pan(self, dx, dy):
+        self.dispatch_event('on_view_pan', dx, dy)
+
+    def pan(self, dx, dy):
+        """
+        Moves the hand and the selection box along with the camera, which
+        has already been panned by (dx, dy), and uploads the projection.
+        """
+        self.hand.move(dx, dy)
+        self.selection_box.drag(dx, dy)
+        self.projection.update()
+
+    def hover_piece(self, bbox):
+        """
+        Outlines the piece under the mouse pointer, except while pieces are
+        held, since the hand is drawn on top of it.
+        :param bbox: (left, bottom, right, top) of the piece under the mouse
+        pointer, or None
+        """
+        if bbox is None or not self.hand.is_empty:
+            self.hover_box.hide()
+        else:
+            self.hover_box.show(bbox)
+
+    def rebase(self, dx, dy):
+        """
+        Moves all pieces by (dx, dy), and the camera with them, so that
+        nothing seems to change on screen. The hand is expected to be empty.
+        """
+        pieces = list(self.pieces.values())
+        self.move_pieces(
+            np.array([piece.pid for piece in pieces], dtype=np.int64),
+            np.array([piece.x for piece in pieces]) + dx,
+            np.array([piece.y for piece in pieces]) + dy,
+            np.array([piece.z for piece in pieces]),
+            np.array([piece.r for piece in pieces], dtype=np.int64)
+        )
+        self.projection.translate(dx, dy)
+        if self.selection_box.is_active:
+            x, y = self.selection_box.origin
+            self.selection_box.origin = (x + dx, y + dy)
+            self.selection_box.drag(dx, dy)
 
     def on_mouse_scroll(self, x_, y_, scroll_x, scroll_y):
         allow_rotation = (
@@ -597,8 +815,12 @@ class View(pyglet.window.EventDispatcher):
             self.dispatch_event('on_info')
         if symbol == key.COMMA:
             PieceGroupFactory.invert_border_visibility()
+        if symbol == key.BRACKETRIGHT:
+            self._change_tray_page(self.tray_page + 1)
+        if symbol == key.BRACKETLEFT:
+            self._change_tray_page(max(0, self.tray_page - 1))
         if _is_digit_key(symbol):
-            tray = _digit_from_key(symbol)
+            tray = self._tray(_digit_from_key(symbol))
             if modifiers & key.MOD_CTRL:
                 self.dispatch_event('on_toggle_visibility', tray)
             else:
@@ -607,6 +829,17 @@ class View(pyglet.window.EventDispatcher):
     def on_key_release(self, symbol, modifiers):
         self.number_keys.release(symbol)
 
+    def _tray(self, digit):
+        return self.tray_page * TRAYS_PER_PAGE + digit
+
+    def _change_tray_page(self, page):
+        self.tray_page = page
+        print(
+            f"Trays {self._tray(0)}-{self._tray(TRAYS_PER_PAGE - 1)} on the "
+            f"number keys"
+        )
+        self.dispatch_event('on_tray_page', self._tray(TRAYS_PER_PAGE))
+
     def _move_pieces_to_tray(self, pids, tray, change_group=False):
         for pid in pids:
             piece = self.pieces[pid]
@@ -628,7 +861,7 @@ class View(pyglet.window.EventDispatcher):
         if self.number_keys.is_active:
             self._move_pieces_to_tray(
                 pids=[pid],
-                tray=self.number_keys.last_pressed,
+                tray=self._tray(self.number_keys.last_pressed),
                 change_group=True
             )
         else:
@@ -640,14 +873,70 @@ class View(pyglet.window.EventDispatcher):
     def move_piece(self, pid, x, y, z, r):
         self.hand.move_piece(self.pieces[pid], x, y, z, r)
 
+    def move_pieces(self, pids, x, y, z, rotation):
+        """
+        Like move_piece for arrays of pids, positions and rotations. The
+        vertices of the small pieces are computed at once, for the pieces in
+        the hand, which are drawn relative to it, and for the rest.
+        """
+        is_small = np.array(
+            [self.pieces[pid].is_small for pid in pids.tolist()], dtype=bool)
+        is_in_hand = np.array(
+            [pid in self.hand.pieces for pid in pids.tolist()], dtype=bool)
+        for i in np.flatnonzero(~is_small).tolist():
+            self.move_piece(
+                int(pids[i]), float(x[i]), float(y[i]), float(z[i]),
+                int(rotation[i])
+            )
+        group = self.hand.group
+        for is_bulk, origin in [
+            (is_small & is_in_hand, (group.x, group.y, group.z, group.r)),
+            (is_small & ~is_in_hand, (0, 0, 0, 0)),
+        ]:
+            if is_bulk.any():
+                Piece.set_positions(
+                    [self.pieces[pid] for pid in pids[is_bulk].tolist()],
+                    x[is_bulk],
+                    y[is_bulk],
+                    z[is_bulk],
+                    rotation[is_bulk],
+                    origin
+                )
+
     def merge_pieces(self, pid1, pid2):
         self.pieces[pid1].merge(self.pieces[pid2])
         self.pieces.pop(pid2)
 
+    def merge_pieces_bulk(self, merges):
+        # Each merge is a pid and the list of pids that were merged into it.
+        # The merged pieces take the position of the piece they merge into.
+        # Pieces can't be merged while they are in the hand.
+        pids = {pid for merge in merges for pid in [merge[0], *merge[1]]}
+        if not pids.isdisjoint(self.hand.pieces):
+            self.hand.drop_everything()
+        for pid, others in merges:
+            for other in others:
+                self.merge_pieces(pid, other)
+
     def remember_new_z_levels(self, msg):
+        # The controller applies z levels once per frame, so the pieces may
+        # already have left the hand
         self.hand.group.move(0, 0, len(msg))
         for z, pid in msg:
-            self.pieces[pid].remember_z_position(z)
+            piece = self.pieces[pid]
+            piece.remember_z_position(z)
+            if piece.is_small and pid not in self.hand.pieces:
+                piece.commit_position()
+
+    def compact_z_levels(self, msg, max_z_level):
+        # Pieces in the hand get their new z level when they are dropped
+        for z, pid in msg:
+            piece = self.pieces[pid]
+            piece.remember_z_position(z)
+            if piece.is_small and pid not in self.hand.pieces:
+                piece.commit_position()
+        group = self.hand.group
+        group.set_position(group.x, group.y, max_z_level)
 
     def drop_specific_pieces_from_hand(self, pids):
         self.hand.drop_pieces(pids)
@@ -658,6 +947,9 @@ class View(pyglet.window.EventDispatcher):
     def set_visibility(self, tray, is_visible):
         PieceGroupFactory.toggle_visibility(tray, is_visible)
 
+    def add_tray(self, tray, parent):
+        PieceGroupFactory.add_tray(tray, parent)
+
     def print_info(self, elapsed_seconds, percent_complete):
         print(
             f"Completed {percent_complete:.1f}% in "
@@ -677,12 +969,22 @@ class View(pyglet.window.EventDispatcher):
 
 
 class Piece:
-    def __init__(self, pid, polygons, tray, position, rotation, width, height,
-                 texture, normal_map, batch):
+    def __init__(self, pid, members, contours, triangles, tray, position,
+                 rotation, width, height, texture, normal_map, batch):
+        """
+        :param members: The pids of the pieces that this piece is made of
+        :param contours: Contours of the cut that the polygons of the
+        members are drawn from
+        :param triangles: The triangle indices of the polygon of each member
+        """
         self.pid = pid
         self.texture = texture
         self.normal_map = normal_map
-        self.size = len(polygons)
+        self.size = len(members)
+        self.members = members
+        self.contours = contours
+        self.width = width
+        self.height = height
         self.batch = batch
         self.default_group = PieceGroupFactory.get_piece_group(tray)
         self.groups = []
@@ -694,47 +996,62 @@ class Piece:
 
         self._x, self._y, self._z, self._r = 0, 0, 0, 0
 
-        self.polygons = []
         self.vertex_list = []
-        for polygon in polygons.values():
-            vl = self._create_vertices(polygon, width, height)
-            self.polygons.append(polygon)
+        self.vertex_list_groups = []
+        for polygon, indices in zip(self.polygons, triangles):
+            vl = self._create_vertices(polygon, indices, self.group)
             self.vertex_list.append(vl)
+            self.vertex_list_groups.append(self.group)
 
         self.set_position(*position, rotation)
 
-    def _create_vertices(self, polygon, width, height):
-        sx = self.texture.tex_coords[6] / self.texture.width
-        sy = self.texture.tex_coords[7] / self.texture.height
-        offset_x = width // 2
-        offset_y = height // 2
-
-        vertices = []
-        earcut_input = []
-        tex_coords = []
-        for p in polygon:
-            vertices.append(p.x)
-            vertices.append(p.y)
-            vertices.append(0)
+    @property
+    def polygons(self):
+        return [self.contours.polygon(pid) for pid in self.members]
 
-            earcut_input.append(p.x)
-            earcut_input.append(p.y)
+    def set_outlines(self, contours, triangles):
+        """
+        Draws the members with the polygons of other contours of the same
+        cut, e.g. another level of detail. Each vertex list is made again in
+        the group it was in.
+        :param triangles: The triangle indices of the polygon of each member,
+        in the order of self.members
+        """
+        for vertex_list in self.vertex_list:
+            vertex_list.delete()
+        self.contours = contours
+        polygons = self.polygons
+        self.vertex_list = [
+            self._create_vertices(polygon, indices, group)
+            for polygon, indices, group in zip(
+                polygons, triangles, self.vertex_list_groups)
+        ]
+        # Big pieces are placed by their groups, and the vertices of small
+        # pieces have to be placed again
+        if self.is_small:
+            self.commit_position()
 
-            tex_coords.append(sx * (p.x - offset_x))
-            tex_coords.append(sy * (p.y - offset_y))
-            tex_coords.append(0)
+    def _create_vertices(self, polygon, indices, group):
+        sx = self.texture.tex_coords[6] / self.texture.width
+        sy = self.texture.tex_coords[7] / self.texture.height
+        offset_x = self.width // 2
+        offset_y = self.height // 2
 
-        indices = earcut.earcut(earcut_input)
+        n = len(polygon)
+        vertices = np.zeros((n, 3))
+        vertices[:, :2] = polygon
+        tex_coords = np.zeros((n, 3))
+        tex_coords[:, 0] = sx * (polygon[:, 0] - offset_x)
+        tex_coords[:, 1] = sy * (polygon[:, 1] - offset_y)
 
-        n = len(vertices) // 3
         vertex_list = self.batch.add_indexed(
             n,
             pyglet.gl.GL_TRIANGLES,
-            self.group,
-            indices,
-            ('position3f/static', tuple(vertices)),
+            group,
+            indices.tolist(),
+            ('position3f/static', vertices.ravel().tolist()),
             ('colors4Bn/static', (255, 255, 255, 255) * n),
-            ('tex_coords3f/static', tuple(tex_coords)),
+            ('tex_coords3f/static', tex_coords.ravel().tolist()),
             ('orientation1f/dynamic', (0.0,) * n)
         )
         return vertex_list
@@ -757,15 +1074,43 @@ class Piece:
         else:
             self._update_groups(x, y, z)
 
+    @staticmethod
+    def set_positions(pieces, x, y, z, r, origin=(0, 0, 0, 0)):
+        """
+        set_position for many small pieces at once, with the vertices of all
+        their polygons rotated and moved in one go.
+        :param x, y, z, r: Arrays with the new position of each piece
+        :param origin: (x, y, z, r) of the group that the pieces are drawn
+        relative to, like the hand. The pieces remember their position
+        without it, like in Hand.move_piece.
+        """
+        ox, oy, oz, o_r = origin
+        place_polygons(
+            polygons=[
+                polygon for piece in pieces for polygon in piece.polygons
+            ],
+            polygon_piece=np.repeat(
+                np.arange(len(pieces)),
+                [len(piece.members) for piece in pieces]
+            ),
+            vertex_lists=[vl for piece in pieces for vl in piece.vertex_list],
+            x=x - ox,
+            y=y - oy,
+            z=z - oz,
+            r=r - o_r
+        )
+        for piece, position in zip(
+                pieces, zip(x.tolist(), y.tolist(), z.tolist(), r.tolist())):
+            piece._x, piece._y, piece._z, piece._r = position
+
     def _update_vertices(self, x, y, z):
         for polygon, vertex_list in zip(self.polygons, self.vertex_list):
-            new_vertex_list = []
-            for p in rotate_points(polygon, Point(0, 0), self.angle):
-                new_vertex_list.append(p.x + x)
-                new_vertex_list.append(p.y + y)
-                new_vertex_list.append(z)
+            new_vertices = np.empty((len(polygon), 3))
+            new_vertices[:, :2] = rotate_points(polygon, Point(0, 0), self.angle)
+            new_vertices[:, :2] += (x, y)
+            new_vertices[:, 2] = z
 
-            vertex_list.position[:] = tuple(new_vertex_list)
+            vertex_list.position[:] = new_vertices.ravel().tolist()
             vertex_list.orientation[:] = (self._r, ) * len(polygon)
 
     def _update_groups(self, x, y, z):
@@ -837,8 +1182,9 @@ class Piece:
                 other.set_position(self.x, self.y, self.z, self.r)
                 other.group = self.group
 
-        self.polygons += other.polygons
+        self.members += other.members
         self.vertex_list += other.vertex_list
+        self.vertex_list_groups += other.vertex_list_groups
         self.size += other.size
 
     @property
@@ -885,6 +1231,7 @@ class Piece:
                 self._group,
                 self.batch
             )
+        self.vertex_list_groups = [group] * len(self.vertex_list)
 
 
 class Table:
@@ -894,6 +1241,20 @@ class Table:
         self.index = 0
         self.group = TableGroup(None)
         self.vertex_list = None
+        self.size = MIN_TABLE_SIZE
+        self.create_table()
+
+    def fit(self, bounds):
+        """
+        Makes the table bigger if it doesn't cover the bounds, with some
+        room to spare.
+        """
+        extent = 2 * max(abs(coordinate) for coordinate in bounds)
+        if extent <= self.size:
+            return
+        while self.size < 2 * extent:
+            self.size *= 2
+        self.destroy_table()
         self.create_table()
 
     def cycle_texture(self):
@@ -910,8 +1271,8 @@ class Table:
         texture = pyglet.image.load(image_path).get_texture()
         self.group.texture = texture
 
-        table_width = 131072
-        table_height = 131072
+        table_width = self.size
+        table_height = self.size
         original_vertices = [
             -table_width/2, -table_height/2, -1,
             table_width/2, -table_height/2, -1,
@@ -989,6 +1350,37 @@ class SelectionBox:
         )
 
 
+class HoverBox:
+    def __init__(self, batch):
+        self.bbox = None
+        self.group = SelectionBoxGroup()
+        self.z = MAX_Z_DEPTH
+
+        self.vertex_list = batch.add(
+            4, gl.GL_LINE_LOOP, self.group,
+            ('position3f/dynamic', (0,) * 12),
+            ('colors3B/static', (255, 220, 0) * 4)
+        )
+
+    def show(self, bbox):
+        # Called every frame, so the vertices are only written on changes
+        if bbox == self.bbox:
+            return
+        self.bbox = bbox
+        left, bottom, right, top = bbox
+        self.vertex_list.position[:] = (
+            left, bottom, self.z,
+            right, bottom, self.z,
+            right, top, self.z,
+            left, top, self.z
+        )
+
+    def hide(self):
+        if self.bbox is not None:
+            self.bbox = None
+            self.vertex_list.position[:] = (0,) * 12
+
+
 class Hand(pyglet.window.EventDispatcher):
     def __init__(self):
         self.group = PieceGroupFactory.hand_group
@@ -1097,14 +1489,48 @@ def _digit_from_key(symbol):
     return symbol - key._0
 
 
+def _load_or_triangulate(cache, cut_key, contours):
+    """
+    :return: (triangles, triangle_offsets) of all polygons of the contours,
+    from the cache if they are there
+    """
+    names = ('triangles', 'triangle_offsets')
+    if (entry := cache.load(cut_key, *names)) is None:
+        entry = dict(zip(names, triangulate(
+            contours.points,
+            contours.offsets,
+            num_workers=settings.gameplay.num_workers
+        )))
+        cache.store(cut_key, **entry)
+    return entry['triangles'], entry['triangle_offsets']
+
+
+def _level_of_detail(tolerances, zoom_level):
+    """
+    :param tolerances: The flatness tolerance of each level, in image pixels
+    :return: The level with the largest tolerance that is still within
+    LOD_SCREEN_TOLERANCE on screen, or 0 if there is none
+    """
+    level = 0
+    for i, tolerance in enumerate(tolerances):
+        if (tolerance * zoom_level <= LOD_SCREEN_TOLERANCE
+                and tolerance > tolerances[level]):
+            level = i
+    return level
+
+
 View.register_event_type('on_mouse_down')
 View.register_event_type('on_mouse_up')
+View.register_event_type('on_hover')
+View.register_event_type('on_hand_drag')
+View.register_event_type('on_view_pan')
 View.register_event_type('on_scroll')
 View.register_event_type('on_selection_box')
 View.register_event_type('on_key_press')
 View.register_event_type('on_cheat')
 View.register_event_type('on_move_pieces_to_tray')
 View.register_event_type('on_toggle_visibility')
+View.register_event_type('on_tray_page')
 View.register_event_type('on_view_spread_out')
 View.register_event_type('on_new_game')
 View.register_event_type('on_quicksave')
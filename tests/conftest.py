@@ -0,0 +1,26 @@
+import pytest
+
+import src.settings as settings
+
+
+@pytest.fixture(autouse=True)
+def run_in_tmp_path(tmp_path, monkeypatch):
+    # Keeps the cut cache and other files written by the game out of the
+    # repository.
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.fixture
+def small_puzzle(request, monkeypatch):
+    """
+    Settings for a 6x4 puzzle of 100x100 pieces. The pieces are not rotated
+    unless the test asks for it with
+    @pytest.mark.parametrize('small_puzzle', [True], indirect=True).
+    :return: The gameplay settings, which the test may still change.
+    """
+    piece_rotation = getattr(request, 'param', False)
+    monkeypatch.setattr(settings, 'image', settings.Image(
+        width=600, height=400))
+    monkeypatch.setattr(settings, 'gameplay', settings.Gameplay(
+        nx=6, ny=4, piece_rotation=piece_rotation))
+    return settings.gameplay
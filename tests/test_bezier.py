@@ -0,0 +1,29 @@
+import math
+
+import numpy as np
+
+from src.bezier import Point, Rectangle, point_in_polygon, bounding_box, \
+    rotate_points, to_points
+
+
+SQUARE = np.array([(0, 0), (10, 0), (10, 10), (0, 10)], dtype=float)
+
+
+class TestPolygons:
+    def test_point_in_polygon(self):
+        assert point_in_polygon(Point(5, 5), SQUARE)
+        assert point_in_polygon(Point(0.1, 9.9), SQUARE)
+        assert not point_in_polygon(Point(-1, 5), SQUARE)
+        assert not point_in_polygon(Point(5, 10.5), SQUARE)
+
+    def test_lists_of_points_are_still_accepted(self):
+        points = to_points(SQUARE)
+
+        assert point_in_polygon(Point(5, 5), points)
+        assert bounding_box(points) == Rectangle(
+            left=0, right=10, top=10, bottom=0)
+
+    def test_rotate_points(self):
+        rotated = rotate_points(SQUARE, Point(5, 5), math.pi / 2)
+
+        assert np.allclose(rotated, [(10, 0), (10, 10), (0, 10), (0, 0)])
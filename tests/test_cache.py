@@ -0,0 +1,45 @@
+import os
+import time
+
+import numpy as np
+
+from src.cache import CutCache
+
+
+class TestCutCache:
+    def test_stored_arrays_are_loaded_memory_mapped(self, tmp_path):
+        cache = CutCache(path=str(tmp_path))
+        cache.store('key', a=np.arange(10), b=np.ones((3, 2)))
+
+        entry = cache.load('key', 'a', 'b')
+        assert isinstance(entry['a'], np.memmap)
+        assert np.array_equal(entry['a'], np.arange(10))
+        assert np.array_equal(entry['b'], np.ones((3, 2)))
+
+    def test_missing_arrays_give_nothing(self, tmp_path):
+        cache = CutCache(path=str(tmp_path))
+        cache.store('key', a=np.arange(10))
+
+        assert cache.load('key', 'a', 'b') is None
+        assert cache.load('other_key', 'a') is None
+
+    def test_least_recently_used_entry_is_evicted(self, tmp_path):
+        cache = CutCache(path=str(tmp_path), max_bytes=2500)
+        cache.store('first', a=np.zeros(100))
+        cache.store('second', a=np.zeros(100))
+        # Make sure that the file system sees distinct modification times
+        os.utime(tmp_path / 'first', (time.time() - 20,) * 2)
+        os.utime(tmp_path / 'second', (time.time() - 10,) * 2)
+        cache.load('first', 'a')
+        cache.store('third', a=np.zeros(100))
+
+        assert cache.load('first', 'a') is not None
+        assert cache.load('second', 'a') is None
+        assert cache.load('third', 'a') is not None
+
+    def test_disabled_cache_stores_nothing(self, tmp_path):
+        cache = CutCache(path=str(tmp_path / 'cache'), max_bytes=0)
+        cache.store('key', a=np.arange(10))
+
+        assert cache.load('key', 'a') is None
+        assert not os.path.exists(tmp_path / 'cache')
@@ -0,0 +1,51 @@
+import random
+
+from src.clusters import ClusterSet
+
+
+def make_grid(nx, ny):
+    clusters = ClusterSet(nx * ny)
+    for pid in range(nx * ny):
+        if pid % nx < nx - 1:
+            clusters.connect(pid, pid + 1)
+        if pid + nx < nx * ny:
+            clusters.connect(pid, pid + nx)
+    return clusters
+
+
+class TestClusterSet:
+    def test_union_keeps_the_label_of_the_first_cluster(self):
+        clusters = make_grid(3, 3)
+        clusters.union(1, 0)
+        clusters.union(2, 1)
+        clusters.union(4, 2)
+
+        assert {clusters.find(pid) for pid in [0, 1, 2, 4]} == {4}
+        assert sorted(clusters.members(0)) == [0, 1, 2, 4]
+        assert clusters.cluster_size(2) == 4
+        assert len(clusters) == 6
+
+    def test_neighbours_are_relabelled_on_union(self):
+        clusters = make_grid(3, 3)
+        clusters.union(4, 1)
+
+        assert clusters.neighbours(4) == {0, 2, 3, 5, 7}
+        assert clusters.neighbours(0) == {3, 4}
+        assert clusters.neighbour_counts(4) == {0: 1, 2: 1, 3: 1, 5: 1, 7: 1}
+
+        clusters.union(0, 3)
+        assert clusters.neighbour_counts(4) == {0: 2, 2: 1, 5: 1, 7: 1}
+        assert clusters.neighbour_counts(0) == {4: 2, 6: 1}
+
+    def test_merging_everything_leaves_one_cluster(self):
+        nx, ny = 20, 15
+        clusters = make_grid(nx, ny)
+        pids = list(range(nx * ny))
+        random.Random(1).shuffle(pids)
+        for pid in pids:
+            for neighbour in clusters.neighbours(pid):
+                clusters.union(neighbour, pid)
+
+        assert len(clusters) == 1
+        assert sorted(clusters.members(0)) == list(range(nx * ny))
+        assert clusters.neighbours(0) == set()
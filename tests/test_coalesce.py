@@ -0,0 +1,57 @@
+import numpy as np
+
+from src.coalesce import EventQueue
+
+
+def moves(pids, x):
+    pids = np.array(pids)
+    x = np.array(x, dtype=float)
+    return pids, x, -x, np.zeros_like(x), np.zeros(len(pids), dtype=int)
+
+
+class TestEventQueue:
+    def test_only_last_move_of_each_piece_is_kept(self):
+        queue = EventQueue()
+        queue.move(*moves([3, 1, 2], [1, 2, 3]))
+        queue.move(*moves([1], [4]))
+        queue.move(*moves([5, 3], [5, 6]))
+
+        pids, x, y, _, _ = queue.take()['moves']
+        assert dict(zip(pids.tolist(), x.tolist())) == {
+            1: 4, 2: 3, 3: 6, 5: 5
+        }
+        assert np.array_equal(y, -x)
+        assert queue.num_events['moves'] == 3
+        assert queue.num_updates['moves'] == 1
+
+    def test_offsets_are_summed_and_visibility_keeps_the_last_state(self):
+        queue = EventQueue()
+        for _ in range(4):
+            queue.drag(1.5, -1)
+        queue.pan(3, 0)
+        queue.pan(2, 5)
+        queue.change_visibility(2, False)
+        queue.change_visibility(3, False)
+        queue.change_visibility(2, True)
+        queue.change_z_levels([(10, 0)])
+        queue.change_z_levels([(11, 4), (12, 5)])
+
+        updates = queue.take()
+        assert updates['drag'] == (6, -4)
+        assert updates['pan'] == (5, 5)
+        assert updates['visibility'] == {2: True, 3: False}
+        assert updates['z_levels'] == [(10, 0), (11, 4), (12, 5)]
+        assert updates['moves'] is None
+        assert queue.events_per_update('drag') == 4
+        assert queue.events_per_update('moves') == 0
+
+    def test_take_empties_the_queue(self):
+        queue = EventQueue()
+        queue.drag(1, 1)
+        queue.move(*moves([0], [0]))
+        assert not queue.is_empty
+
+        queue.take()
+        assert queue.is_empty
+        assert all(update is None for update in queue.take().values())
+        assert queue.num_updates['drag'] == 1
@@ -0,0 +1,59 @@
+import numpy as np
+
+from src.bezier import Point, point_in_polygon
+from src.hitmask import HitMasks
+from src.model import make_cut_contours, make_jigsaw_cut
+
+
+class TestHitMasks:
+    def test_lookup_agrees_with_point_in_polygon(self):
+        nx, ny, width, height = 5, 4, 100, 80
+        contours = make_cut_contours(nx * width, ny * height, nx, ny, 3)
+        hit_masks = HitMasks.from_contours(
+            contours, nx, ny, width, height, 2)
+
+        rng = np.random.default_rng(0)
+        num_known = 0
+        for pid in range(nx * ny - nx):
+            x = width * (pid % nx) + rng.uniform(width / 2, 3 * width / 2, 50)
+            y = height * (pid // nx + 1) + rng.uniform(0, height, 50)
+            for point in map(Point, x, y):
+                is_inside = hit_masks.lookup(pid, pid + nx, point)
+                if is_inside is not None:
+                    num_known += 1
+                    assert is_inside == point_in_polygon(
+                        point, contours.polygon(pid))
+                    assert (not is_inside) == hit_masks.lookup(
+                        pid + nx, pid, point)
+
+        # Most points should be far enough from the outline
+        assert num_known > 0.7 * 50 * (nx * ny - nx)
+
+    def test_masks_do_not_change_what_pieces_contain(self):
+        nx, ny, width, height = 4, 3, 100, 100
+        contours = make_cut_contours(nx * width, ny * height, nx, ny, 5)
+        hit_masks = HitMasks.from_contours(
+            contours, nx, ny, width, height, 2)
+        with_masks = make_jigsaw_cut(
+            nx * width, ny * height, nx, ny, True, seed=5,
+            contours=contours, hit_masks=hit_masks)
+        without_masks = make_jigsaw_cut(
+            nx * width, ny * height, nx, ny, True, seed=5,
+            contours=contours)
+
+        rng = np.random.default_rng(1)
+        for pid, piece in with_masks.items():
+            left, bottom, right, top = piece.bbox
+            for point in map(Point, rng.uniform(left, right, 100),
+                             rng.uniform(bottom, top, 100)):
+                assert piece.contains(point, nx) == \
+                    without_masks[pid].contains(point, nx)
+
+    def test_masks_are_bit_packed(self):
+        nx, ny, width, height = 4, 3, 100, 100
+        contours = make_cut_contours(nx * width, ny * height, nx, ny, 5)
+        hit_masks = HitMasks.from_contours(
+            contours, nx, ny, width, height, 2)
+
+        assert hit_masks.inside.dtype == np.uint8
+        assert hit_masks.inside.shape == (nx * ny, 2, 50, 7)
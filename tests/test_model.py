@@ -1,4 +1,25 @@
-from src.model import Tray, Model
+import itertools
+import pickle
+import random
+
+import numpy as np
+import pytest
+
+import src.settings as settings
+from src.bezier import Point, Rectangle, make_random_edges, edge_control_points
+from src import savefile
+from src.model import Tray, Model, PieceStore, make_contours, edge_ids, \
+    MAX_TRAY_DEPTH
+
+
+def assert_spatial_hash_matches_rebuild(model):
+    boxes = dict(model.spatial_hash.boxes)
+    z = dict(model.spatial_hash.z)
+    model._build_spatial_hash()
+    assert boxes.keys() == model.spatial_hash.boxes.keys()
+    for pid, box in model.spatial_hash.boxes.items():
+        assert np.allclose(boxes[pid], box)
+    assert z == model.spatial_hash.z
 
 
 class TestTray:
@@ -107,6 +128,75 @@ class TestTray:
         tray.toggle_visibility(1)
         assert tray.hidden_pieces == {0, 1, 2, 6, 7, 8}
 
+    def test_hidden_pieces_are_kept_up_to_date(self):
+        rng = random.Random(5)
+        tray = Tray(num_pids=50, num_trays=4)
+        merged = set()
+        for _ in range(200):
+            action = rng.random()
+            if action < 0.4:
+                tray.toggle_visibility(rng.randrange(4))
+            elif action < 0.9:
+                pids = set(rng.sample(range(50), 5)) - merged
+                tray.move_pids_to_tray(pids, rng.randrange(4))
+            elif (pids := set(range(1, 50)) - merged):
+                pid = rng.choice(sorted(pids))
+                tray.merge_pids(0, pid)
+                merged.add(pid)
+
+            hidden = {
+                pid for pid in range(50)
+                if pid not in merged and not tray.is_visible(pid)
+            }
+            assert tray.hidden_pieces == hidden
+            assert tray.filter_visible(range(50)) == [
+                pid for pid in range(50)
+                if pid not in merged and pid not in hidden
+            ]
+
+    def test_nested_trays_are_hidden_with_their_parent(self):
+        tray = Tray(num_pids=6, num_trays=2)
+        colours = tray.add_tray()
+        red = tray.add_tray(parent=colours)
+        red_edges = tray.add_tray(parent=red)
+        tray.move_pids_to_tray([0, 1], red)
+        tray.move_pids_to_tray([2], red_edges)
+        tray.move_pids_to_tray([3], colours)
+
+        tray.toggle_visibility(colours)
+        assert tray.filter_visible(range(6)) == [4, 5]
+        assert tray.hidden_pieces == {0, 1, 2, 3}
+
+        tray.toggle_visibility(colours)
+        tray.toggle_visibility(red)
+        assert tray.filter_visible(range(6)) == [3, 4, 5]
+        assert not tray.is_visible(2)
+        assert tray.tray_is_shown(red_edges)
+        assert not tray.tray_is_visible(red_edges)
+
+    def test_any_number_of_trays(self):
+        tray = Tray(num_pids=100, num_trays=1)
+        for pid in range(100):
+            tray.move_pids_to_tray([pid], tray.add_tray())
+        for new_tray in range(1, 101, 2):
+            tray.toggle_visibility(new_tray)
+
+        assert tray.filter_visible(range(100)) == list(range(1, 100, 2))
+
+    def test_add_tray_checks_the_parent(self):
+        tray = Tray(num_pids=3, num_trays=2)
+        with pytest.raises(ValueError):
+            tray.add_tray(parent=2)
+        with pytest.raises(ValueError):
+            tray.add_tray(parent=-2)
+
+        parent = -1
+        for _ in range(MAX_TRAY_DEPTH):
+            parent = tray.add_tray(parent)
+        assert tray.depth(parent) == MAX_TRAY_DEPTH
+        with pytest.raises(ValueError):
+            tray.add_tray(parent)
+
     def test_equal_trays_are_equal(self):
         tray1 = Tray(num_pids=3)
         tray2 = Tray(num_pids=3)
@@ -114,6 +204,45 @@ class TestTray:
         assert tray1 is not tray2
 
 
+class TestPieceStore:
+    def test_pieces_read_and_write_the_store(self):
+        model = Model()
+        model.reset(seed=3)
+        piece = model.pieces[5]
+        piece.x = 17
+        piece.z = 4
+
+        assert model.store.x[5] == 17
+        assert model.store.z[5] == 4
+
+    def test_moving_many_pieces_updates_the_store(self):
+        model = Model()
+        model.reset(seed=3)
+        pids = [1, 2, 3]
+        x = model.store.x[pids].copy()
+        y = model.store.y[pids].copy()
+        model.move_pieces(pids, 10, -5)
+
+        assert np.array_equal(model.store.x[pids], x + 10)
+        assert np.array_equal(model.store.y[pids], y - 5)
+        assert [model.pieces[pid].x for pid in pids] == (x + 10).tolist()
+
+    def test_merged_members_belong_to_the_same_cluster(self):
+        model = Model()
+        model.reset(seed=3)
+        model.merge_random_pieces(5)
+
+        for pid, piece in model.pieces.items():
+            for member in piece.members:
+                assert model.store.clusters.find(member) == pid
+
+    def test_pids_in_rect(self):
+        store = PieceStore(4)
+        store.set_positions([0, 1, 2, 3], [0, 10, 20, 30], [0, 10, 20, 30])
+
+        assert store.pids_in_rect(range(4), 5, 5, 25, 25).tolist() == [1, 2]
+
+
 class TestSerialize:
     def test_can_serialize_model(self):
         model = Model()
@@ -122,3 +251,559 @@ class TestSerialize:
         new_model = Model.from_dict(model_dict)
         assert model == new_model
         assert model is not new_model
+
+    @pytest.mark.parametrize('small_puzzle', [True], indirect=True)
+    def test_geometry_is_regenerated_from_seed(self, small_puzzle):
+        model = Model()
+        model.reset(seed=1234)
+        model.merge_random_pieces(8)
+        model.move_pieces([next(iter(model.pieces))], 12.5, -3)
+
+        data = pickle.loads(pickle.dumps(model.to_dict()))
+        new_model = Model.from_dict(data)
+
+        assert new_model.pieces.keys() == model.pieces.keys()
+        for pid, piece in model.pieces.items():
+            new_piece = new_model.pieces[pid]
+            assert new_piece.polygon.keys() == piece.polygon.keys()
+            for member, polygon in piece.polygon.items():
+                assert np.array_equal(new_piece.polygon[member], polygon)
+            assert new_piece.bounding_box == piece.bounding_box
+            assert new_piece.neighbours == piece.neighbours
+            assert new_piece.members == piece.members
+            assert new_piece.state == piece.state
+
+    def test_saved_pieces_contain_no_geometry(self):
+        model = Model()
+        model.reset(seed=1)
+        data = model.to_dict()
+
+        assert data['seed'] == 1
+        assert set(data['pieces'][0]) == {
+            'pid', 'x', 'y', 'z', 'rotation', 'members'}
+
+    def test_old_pickled_trays_are_converted(self, small_puzzle):
+        model = Model()
+        model.reset(seed=2)
+        model.merge_random_pieces(3)
+        expected = Tray(num_pids=24)
+        for pid in range(24):
+            if pid not in model.pieces:
+                expected.merge_pids(0, pid)
+        expected.move_pids_to_tray([pid for pid in model.pieces][:4], 2)
+        expected.toggle_visibility(2)
+
+        # A dict of pids and a set of visible trays
+        old = Tray.__new__(Tray)
+        old.__setstate__({
+            'trays': expected.trays,
+            'visible_trays': expected.visible_trays,
+            'pid_to_tray': expected.pid_to_tray
+        })
+        data = model.to_dict()
+        data['trays'] = old
+        assert Model.from_dict(data).trays == expected
+
+        # Arrays with an extra entry for merged pids
+        old = Tray.__new__(Tray)
+        old.__setstate__({
+            'trays': expected.trays,
+            'tray': expected.tray,
+            'is_tray_visible': np.append(expected.is_tray_shown, False),
+            '_hidden_pieces': expected.hidden_pieces
+        })
+        data['trays'] = old
+        assert Model.from_dict(data).trays == expected
+
+    def test_saves_without_seed_are_rejected(self):
+        model = Model()
+        model.reset(seed=1)
+        data = model.to_dict()
+        del data['seed']
+
+        with pytest.raises(ValueError):
+            Model.from_dict(data)
+
+    @pytest.mark.parametrize('small_puzzle', [True], indirect=True)
+    def test_save_file_matches_dict(self, small_puzzle, monkeypatch, tmp_path):
+        monkeypatch.setattr('src.model.save_statistics', lambda **_: None)
+        model = Model()
+        model.reset(seed=99)
+        model.merge_random_pieces(10)
+        model.move_pieces([next(iter(model.pieces))], 7, 8)
+        tray = model.trays.add_tray(parent=1)
+        model.move_pieces_to_tray(tray, list(model.pieces)[:3])
+        model.toggle_visibility(1)
+
+        path = str(tmp_path / 'game.sav')
+        savefile.save(path, *model.to_arrays())
+        new_model = Model.from_arrays(*savefile.load(path))
+        expected = Model.from_dict(model.to_dict())
+
+        assert new_model.pieces.keys() == model.pieces.keys()
+        for pid, piece in expected.pieces.items():
+            assert new_model.pieces[pid].state == piece.state
+        assert new_model.trays == model.trays
+        assert new_model.spatial_hash == expected.spatial_hash
+        assert new_model.start_time == model.start_time
+        assert new_model.current_max_z_level == model.current_max_z_level
+
+
+class TestJigsawCut:
+    def test_contours_match_bezier_evaluation(self):
+        nx, ny, width, height = 5, 4, 120, 80
+        num_edges = 2 * nx * ny - nx - ny
+        edges = make_random_edges(num_edges)
+        contours = make_contours(
+            edge_control_points(edges, num_edges), nx, ny, width, height)
+
+        for pid, (north, east, south, west) in enumerate(edge_ids(nx, ny)):
+            offset = Point(
+                width * (pid % nx) + width / 2,
+                height * (pid // nx) + height / 2
+            )
+            contour = [
+                edges[north].stretch(width, height).translate(offset),
+                edges[east].stretch(height, width).rotate().translate(
+                    offset + Point(width, 0)),
+                edges[south].stretch(width, height).translate(
+                    offset + Point(0, height)).reverse(),
+                edges[west].stretch(height, width).rotate().translate(
+                    offset).reverse()
+            ]
+            expected = [
+                p.tuple() for p in itertools.chain.from_iterable(
+                    edge.evaluate(10) for edge in contour)
+            ]
+            assert np.allclose(contours.polygon(pid), expected)
+
+    def test_polygons_are_gathered_from_the_shared_contours(self):
+        model = Model()
+        model.reset(seed=6)
+        contours = model.contours
+
+        # Only the shared table is kept, no gathered copy of the outlines
+        assert set(vars(contours)) == {'vertices', 'indices', 'offsets'}
+        for pid, piece in model.pieces.items():
+            assert piece.polygons is contours
+            start, end = contours.offsets[pid:pid + 2]
+            assert np.array_equal(
+                piece.polygon[pid],
+                contours.vertices[contours.indices[start:end]])
+
+    def test_corner_pieces_have_two_flat_sides(self):
+        nx, ny = 3, 3
+        contours = make_contours(
+            edge_control_points(make_random_edges(12), 12), nx, ny, 200, 200)
+
+        lengths = np.diff(contours.offsets)
+        assert lengths[0] == lengths[2] == lengths[6] == lengths[8] == 82
+        assert lengths[4] == 160
+        assert contours.polygon(0)[0].tolist() == [100, 100]
+
+    def test_cached_contours_give_the_same_pieces(self, small_puzzle):
+        model = Model()
+        model.reset(seed=42)
+        cached_model = Model()
+        cached_model.reset(seed=42)
+
+        assert isinstance(cached_model.contours.vertices, np.memmap)
+        for pid, piece in model.pieces.items():
+            cached_piece = cached_model.pieces[pid]
+            assert np.array_equal(cached_piece.polygon[pid], piece.polygon[pid])
+            assert cached_piece.state == piece.state
+
+    def test_adaptive_sampling_stays_within_tolerance(self):
+        nx, ny, tolerance = 3, 3, 0.5
+        cp = edge_control_points(make_random_edges(12), 12)
+        fine = make_contours(cp, nx, ny, 150, 150, n=100)
+        coarse = make_contours(cp, nx, ny, 150, 150, tolerance=tolerance)
+
+        assert len(coarse.indices) < len(fine.indices) / 10
+        polygon = coarse.polygon(4)
+        a, b = polygon, np.roll(polygon, -1, axis=0)
+        for p in fine.polygon(4):
+            t = np.clip(
+                np.sum((p - a) * (b - a), axis=1) /
+                np.sum((b - a) ** 2, axis=1), 0, 1)
+            distance = np.linalg.norm(a + t[:, None] * (b - a) - p, axis=1)
+            assert distance.min() < tolerance
+
+    def test_levels_of_detail_are_coarser_and_cached(self, small_puzzle):
+        small_puzzle.lod_tolerances = (4, 1)
+        model = Model()
+        model.reset(seed=42)
+        levels = model.levels_of_detail()
+
+        assert [tolerance for tolerance, _, _ in levels] == [1, 4]
+        sizes = [len(model.contours.indices)] + [
+            len(contours.indices) for _, _, contours in levels]
+        assert sizes[0] > sizes[1] > sizes[2]
+        assert len({model.cut_key, *[key for _, key, _ in levels]}) == 3
+
+        for (_, _, contours), (_, _, cached) in zip(
+                levels, model.levels_of_detail()):
+            assert isinstance(cached.vertices, np.memmap)
+            assert np.array_equal(cached.indices, contours.indices)
+
+    def test_neighbours_share_edge_vertices(self):
+        nx, ny, n = 3, 2, 10
+        contours = make_contours(
+            edge_control_points(make_random_edges(7), 7), nx, ny, 200, 200)
+
+        # Piece 1 has a flat north side, so its east side starts at vertex 1
+        # and piece 2 walks the same edge backwards on its west side, starting
+        # from the end point of the edge.
+        east = contours.indices[contours.offsets[1] + 1:][:4 * n]
+        west = contours.indices[contours.offsets[2] + 2 + 4 * n:][:4 * n]
+        assert np.array_equal(west, east[::-1] + 1)
+        assert len(contours.vertices) == 7 * (4 * n + 1) + 12
+
+
+class TestMergeRandomPieces:
+    def test_merges_exactly_n_times(self):
+        model = Model()
+        model.reset(seed=5)
+        num_pieces = len(model.pieces)
+        model.merge_random_pieces(7)
+        model.merge_random_pieces(3)
+
+        assert len(model.pieces) == num_pieces - 10
+        assert model.cheated
+
+    def test_dispatches_a_single_event(self):
+        class Listener:
+            def __init__(self):
+                self.merges = []
+
+            def on_pieces_merged_bulk(self, merges):
+                self.merges.append(merges)
+
+        model = Model()
+        model.reset(seed=5)
+        listener = Listener()
+        model.push_handlers(listener)
+        model.merge_random_pieces(10)
+
+        assert len(listener.merges) == 1
+        merged = [
+            other for _, others in listener.merges[0] for other in others]
+        assert len(merged) == 10
+        assert not set(merged) & set(model.pieces)
+
+    def test_pieces_are_merged_into_pieces_that_stay_in_place(self):
+        model = Model()
+        model.reset(seed=5)
+        positions = {
+            pid: (piece.x, piece.y) for pid, piece in model.pieces.items()}
+        model.merge_random_pieces(10)
+
+        for pid, piece in model.pieces.items():
+            assert (piece.x, piece.y) == positions[pid]
+            assert piece.neighbours.isdisjoint(piece.members)
+
+    def test_only_merged_pieces_are_moved_in_the_spatial_hash(self):
+        model = Model()
+        model.reset(seed=5)
+        model.merge_random_pieces(6)
+        members = {pid: piece.members for pid, piece in model.pieces.items()}
+        boxes = dict(model.spatial_hash.boxes)
+        z = dict(model.spatial_hash.z)
+        model.merge_random_pieces(6)
+
+        # The pieces that are left are the ones that others merged into
+        for pid in model.pieces:
+            for member in members[pid]:
+                assert model.spatial_hash.boxes[member] == boxes[member]
+                assert model.spatial_hash.z[member] == z[member]
+        assert_spatial_hash_matches_rebuild(model)
+
+    def test_auto_solve_completes_the_puzzle(self, monkeypatch):
+        monkeypatch.setattr('src.model.save_statistics', lambda **_: None)
+        model = Model()
+        model.reset(seed=5)
+        model.auto_solve(1)
+
+        assert len(model.pieces) == 1
+        assert len(next(iter(model.pieces.values())).members) == \
+            settings.gameplay.num_pieces
+
+
+class TestPiecesMoved:
+    def test_spread_out_sends_one_event(self, small_puzzle):
+        model = Model()
+        model.reset(seed=4)
+        events = []
+        model.push_handlers(
+            on_piece_moved=lambda *args: events.append(('single', args)),
+            on_pieces_moved=lambda *args: events.append(('bulk', args))
+        )
+        model.spread_out(list(model.pieces))
+
+        [(kind, (pids, x, y, z, rotation))] = events
+        assert kind == 'bulk'
+        assert sorted(pids.tolist()) == list(range(24))
+        for i, pid in enumerate(pids.tolist()):
+            piece = model.pieces[pid]
+            assert (x[i], y[i], z[i], rotation[i]) == \
+                (piece.x, piece.y, piece.z, piece.rotation)
+            assert model.spatial_hash.boxes[pid] == pytest.approx(piece.bbox)
+
+    def test_moving_one_piece_keeps_the_spatial_hash_valid(
+            self, small_puzzle, monkeypatch):
+        monkeypatch.setattr('src.model.save_statistics', lambda **_: None)
+        model = Model()
+        model.reset(seed=4)
+        model.merge_random_pieces(8)
+        big = max(model.pieces.values(), key=lambda piece: piece.num_members)
+        model.move_pieces([big.pid], 13, -7)
+        assert_spatial_hash_matches_rebuild(model)
+
+        # Snapping moves the piece again and merges its neighbour into it
+        pid = next(
+            pid for pid in model.pieces
+            if pid != big.pid and model.pieces[pid].num_members == 1
+        )
+        neighbour = min(model.pieces[pid].neighbours)
+        model.set_piece_position(model.pieces[neighbour], 0, 0)
+        model.set_piece_position(model.pieces[pid], 3, 2)
+        model.move_pieces([pid], -1, -1)
+        assert neighbour not in model.pieces or pid not in model.pieces
+        assert_spatial_hash_matches_rebuild(model)
+
+    def test_single_piece_snaps_onto_the_larger_piece(
+            self, small_puzzle, monkeypatch):
+        monkeypatch.setattr('src.model.save_statistics', lambda **_: None)
+        model = Model()
+        model.reset(seed=4)
+        model.merge_random_pieces(8)
+        big = max(model.pieces.values(), key=lambda piece: piece.num_members)
+        pid = next(
+            pid for pid in big.neighbours
+            if model.pieces[pid].num_members == 1
+        )
+        members = big.members
+        x, y, z = big.x, big.y, big.z
+        boxes = {
+            member: model.spatial_hash.boxes[member] for member in members
+        }
+        model.set_piece_position(model.pieces[pid], x + 3, y + 2)
+        model.move_pieces_to_top([pid])
+        model.move_pieces([pid], -1, -1)
+
+        piece = model.pieces[pid]
+        assert piece.members == members | {pid}
+        assert (piece.x, piece.y, piece.z) == (x, y, z)
+        # The members of the larger piece weren't moved
+        assert all(
+            model.spatial_hash.boxes[member] == box
+            for member, box in boxes.items()
+        )
+        assert model.spatial_hash.z[pid] == z
+
+
+class TestSnapPieces:
+    def test_group_drop_snaps_each_piece(self, small_puzzle, monkeypatch):
+        monkeypatch.setattr('src.model.save_statistics', lambda **_: None)
+        model = Model()
+        model.reset(seed=4)
+        events = []
+        model.push_handlers(
+            on_pieces_merged_bulk=lambda merges: events.append(merges))
+        # Pieces 0 and 12 are moved together, so that each ends up a few
+        # pixels from its neighbour 1 and 13 respectively.
+        for pid in [1, 13]:
+            model.set_piece_position(model.pieces[pid], 0, 0)
+        model.set_piece_position(model.pieces[0], 500, 400)
+        model.set_piece_position(model.pieces[12], 503, 400)
+        model.move_pieces([0, 12], -498, -401)
+
+        assert model.pieces[0].members == {0, 1}
+        assert model.pieces[12].members == {12, 13}
+        assert (model.pieces[0].x, model.pieces[0].y) == (0, 0)
+        assert (model.pieces[12].x, model.pieces[12].y) == (0, 0)
+        assert len(events) == 1
+        assert sorted(events[0]) == [(0, [1]), (12, [13])]
+        assert_spatial_hash_matches_rebuild(model)
+
+    def test_pieces_too_far_away_are_not_snapped(self, small_puzzle):
+        model = Model()
+        model.reset(seed=4)
+        model.set_piece_position(model.pieces[1], 0, 0)
+        model.set_piece_position(model.pieces[0], 500, 400)
+        model.set_piece_position(model.pieces[12], 2000, 2000)
+        model.move_pieces([0, 12], -400, -400)
+
+        assert len(model.pieces) == small_puzzle.num_pieces
+
+
+class TestSpatialIndex:
+    @pytest.mark.parametrize('small_puzzle', [True], indirect=True)
+    def test_member_boxes_cover_the_bounding_box(self, small_puzzle):
+        model = Model()
+        model.reset(seed=2)
+        model.merge_random_pieces(10)
+
+        for pid, piece in model.pieces.items():
+            boxes = np.array([
+                model.spatial_hash.boxes[member] for member in piece.members
+            ])
+            assert np.allclose(
+                piece.bbox,
+                [*boxes[:, :2].min(axis=0), *boxes[:, 2:].max(axis=0)]
+            )
+
+    def test_empty_corner_of_merged_piece_is_not_hit(self, small_puzzle):
+        model = Model()
+        model.reset(seed=2)
+        # An L-shaped piece of the pids 0, 1 and 6
+        piece = model.pieces[0]
+        for pid in [1, 6]:
+            model._move_members_onto(piece, model.pieces[pid])
+            model._merge_pieces(piece, model.pieces[pid])
+
+        # The centre of pid 7 is inside the bounding box of the L, but not
+        # inside any of its members.
+        x = piece.x + 200
+        y = piece.y + 200
+        assert 0 not in model.piece_ids_in_rect(Rectangle(
+            left=x - 5, right=x + 5, top=y + 5, bottom=y - 5))
+        assert 0 in model.piece_ids_in_rect(Rectangle(
+            left=x - 105, right=x - 95, top=y + 5, bottom=y - 5))
+
+
+class TestSelection:
+    def make_l_shaped_piece(self):
+        model = Model()
+        model.reset(seed=2)
+        piece = model.pieces[0]
+        for pid in [1, 6]:
+            model._move_members_onto(piece, model.pieces[pid])
+            model._merge_pieces(piece, model.pieces[pid])
+        model.set_piece_position(piece, 5000, 5000)
+        return model, piece
+
+    def test_empty_corners_are_only_selected_by_bbox(self, small_puzzle):
+        model, _ = self.make_l_shaped_piece()
+        is_selected = []
+        for pid, piece in model.pieces.items():
+            if piece.num_members > 1:
+                continue
+            # A small box just inside the top right corner of the bounding
+            # box, which is only on the piece if it has no tabs there.
+            _, _, right, top = piece.bbox
+            rect = Rectangle(
+                left=right - 2, right=right - 1, top=top - 1, bottom=top - 2)
+            assert pid in model.piece_ids_in_rect(rect, mode='bbox')
+            is_selected.append(
+                pid in model.piece_ids_in_rect(rect, mode='overlap'))
+
+        assert not all(is_selected)
+
+    def test_inside_needs_every_member(self, small_puzzle):
+        model, piece = self.make_l_shaped_piece()
+        left, bottom, right, top = piece.bbox
+        around_all = Rectangle(
+            left=left - 1, right=right + 1, top=top + 1, bottom=bottom - 1)
+        around_pid_0 = Rectangle(
+            left=left - 1, right=piece.x + 170, top=piece.y + 170,
+            bottom=bottom - 1)
+
+        assert model.piece_ids_in_rect(around_all, mode='inside') == [0]
+        assert model.piece_ids_in_rect(around_pid_0, mode='inside') == []
+        assert model.piece_ids_in_rect(around_pid_0, mode='overlap') == [0]
+
+    def test_lasso_selects_the_same_as_rect(self, small_puzzle):
+        model, piece = self.make_l_shaped_piece()
+        rect = Rectangle(left=0, right=1200, top=800, bottom=0)
+        lasso = [(0, 0), (1200, 0), (1200, 800), (0, 800)]
+
+        assert sorted(model.piece_ids_in_rect(rect)) == \
+            sorted(model.piece_ids_in_polygon(lasso))
+
+
+class TestUpdateWorld:
+    def test_pieces_far_away_are_moved_back(self, small_puzzle):
+        small_puzzle.rebase_distance = 10000
+        model = Model()
+        model.reset(seed=4)
+        model.move_pieces(list(model.pieces), 1e6, -1e6)
+        events = []
+        model.push_handlers(
+            on_world_changed=lambda *args: events.append(args))
+
+        model.update_world()
+
+        [(dx, dy, (left, bottom, right, top))] = events
+        assert abs(dx + 1e6) < 1000 and abs(dy - 1e6) < 1000
+        assert max(map(abs, [left, bottom, right, top])) < 10000
+        # The index is the same as if it were built from the new positions
+        shifted = model.spatial_hash
+        model._build_spatial_hash()
+        assert shifted.cells.keys() == model.spatial_hash.cells.keys()
+        for pid, box in model.spatial_hash.boxes.items():
+            assert np.allclose(shifted.boxes[pid], box)
+
+
+class TestZCompaction:
+    def z_order(self, model):
+        return sorted(model.pieces, key=lambda pid: model.pieces[pid].z)
+
+    def test_compaction_keeps_the_order(self, small_puzzle):
+        model = Model()
+        model.reset(seed=4)
+        model.merge_random_pieces(5)
+        events = []
+        model.push_handlers(
+            on_z_levels_compacted=lambda *args: events.append(args))
+        rng = random.Random(1)
+        pids = list(model.pieces)
+        while not model.is_compacting_z_levels:
+            model.move_pieces_to_top(rng.sample(pids, 3))
+
+        order = self.z_order(model)
+        num_moved = 0
+        while model.is_compacting_z_levels:
+            model.compact_z_levels(4)
+            if not model.is_compacting_z_levels:
+                break
+            # Moving pieces to the top in the middle of it is fine
+            pid = rng.choice(pids)
+            model.move_pieces_to_top([pid])
+            num_moved += 1
+            order.remove(pid)
+            order.append(pid)
+            assert self.z_order(model) == order
+
+        assert self.z_order(model) == order
+        # Pieces that were renumbered and then moved to the top leave gaps
+        z_levels = [piece.z for piece in model.pieces.values()]
+        assert len(set(z_levels)) == len(z_levels)
+        assert max(z_levels) < len(model.pieces) + num_moved
+        assert model.current_max_z_level == max(z_levels) + 1
+        assert all(len(msg) <= 4 + len(pids) for msg, _ in events)
+        for pid, piece in model.pieces.items():
+            for member in piece.members:
+                assert model.spatial_hash.z[member] == piece.z
+
+
+class TestTopPiece:
+    def test_top_piece_is_the_one_with_highest_z(self, small_puzzle):
+        model = Model()
+        model.reset(seed=4)
+        # Stack three pieces on top of each other
+        for pid in [7, 8, 9]:
+            piece = model.pieces[pid]
+            model.set_piece_position(
+                piece, 1000 - piece.origin.x, 1000 - piece.origin.y)
+        x = 1000 + 100
+        y = 1000 + 100
+
+        model.move_pieces_to_top([8])
+        assert model.piece_at_coordinate(x, y).pid == 8
+        model.move_pieces_to_top([7])
+        assert model.piece_at_coordinate(x, y).pid == 7
+        # Moving several pieces to the top keeps their order, and 8 was
+        # above 9.
+        model.move_pieces_to_top([9, 8])
+        assert model.piece_at_coordinate(x, y).pid == 8
@@ -0,0 +1,84 @@
+from src.model import Model
+from src.picking import Picker
+
+
+def make_model():
+    model = Model()
+    model.reset(seed=4)
+    piece = model.pieces[0]
+    model.set_piece_position(
+        piece, 1000 - piece.origin.x, 1000 - piece.origin.y)
+    return model
+
+
+class TestPicker:
+    def test_one_query_per_frame(self, small_puzzle):
+        model = make_model()
+        picker = Picker(model, lambda x, y: (x, y))
+        for x in range(1090, 1110):
+            picker.move_to(x, 1100)
+
+        assert picker.update() == (0, True)
+        assert picker.num_queries == 1
+
+    def test_result_is_cached_until_the_cell_changes(self, small_puzzle):
+        model = make_model()
+        picker = Picker(model, lambda x, y: (x, y))
+        picker.move_to(1100, 1100)
+        picker.update()
+        for _ in range(10):
+            assert picker.update() == (0, False)
+        assert picker.num_queries == 1
+
+        # Moving a piece elsewhere leaves the cell alone
+        model.move_pieces([23], 5, 5)
+        picker.update()
+        assert picker.num_queries == 1
+
+        model.move_pieces([0], 1000, 0)
+        assert picker.update() == (None, True)
+        assert picker.num_queries == 2
+
+    def test_invalidate_forces_a_new_query(self, small_puzzle):
+        model = make_model()
+        picker = Picker(model, lambda x, y: (x, y))
+        picker.move_to(1100, 1100)
+        picker.update()
+        model.move_pieces_to_tray(1, [0])
+        model.toggle_visibility(1)
+        picker.invalidate()
+
+        assert picker.update() == (None, True)
+        assert picker.num_queries == 2
+
+    def test_pointer_follows_the_camera(self, small_puzzle):
+        model = make_model()
+        camera = [0, 0]
+        picker = Picker(
+            model, lambda x, y: (x + camera[0], y + camera[1]))
+        picker.move_to(100, 100)
+        assert picker.update() == (None, False)
+
+        # Panned so that piece 0 is under the pointer, without mouse motion
+        camera[:] = [1000, 1000]
+        assert picker.update() == (0, True)
+        assert picker.num_queries == 2
+
+    def test_merged_piece_is_picked_by_its_new_pid(
+            self, small_puzzle, monkeypatch):
+        monkeypatch.setattr('src.model.save_statistics', lambda **_: None)
+        model = make_model()
+        piece = model.pieces[0]
+        for pid in [1, 2]:
+            model._move_members_onto(piece, model.pieces[pid])
+            model._merge_pieces(piece, model.pieces[pid])
+        picker = Picker(model, lambda x, y: (x, y))
+        picker.move_to(1250, 1050)
+        assert picker.update() == (0, True)
+
+        # Piece 6 is smaller, so it is moved onto piece 0, far from the
+        # pointer, and the merged piece keeps pid 6
+        model.set_piece_position(model.pieces[6], piece.x + 3, piece.y + 2)
+        model.move_pieces([6], -1, -1)
+        assert picker.update() == (6, True)
+        assert picker.num_queries == 1
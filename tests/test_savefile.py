@@ -0,0 +1,56 @@
+import struct
+
+import numpy as np
+import pytest
+
+from src import savefile
+
+
+class TestSaveFile:
+    def test_arrays_and_meta_survive_a_round_trip(self, tmp_path):
+        path = str(tmp_path / 'game.sav')
+        arrays = {
+            'x': np.linspace(-1, 1, 7),
+            'rotation': np.array([0, 1, 2, 3], dtype=np.int8),
+            'boxes': np.arange(12, dtype=np.int64).reshape(3, 4),
+            'is_shown': np.array([True, False]),
+            'empty': np.zeros(0),
+        }
+        meta = {'seed': 12, 'settings': {'nx': 4, 'name': 'kitten'}}
+        savefile.save(path, meta, arrays)
+
+        loaded_meta, loaded = savefile.load(path)
+        assert loaded_meta == meta
+        assert loaded.keys() == arrays.keys()
+        for name, array in arrays.items():
+            assert loaded[name].dtype == array.dtype
+            assert np.array_equal(loaded[name], array)
+        assert not loaded['x'].flags.writeable
+
+    def test_arrays_are_aligned(self, tmp_path):
+        path = str(tmp_path / 'game.sav')
+        savefile.save(path, {}, {
+            'a': np.zeros(3, dtype=np.int8),
+            'b': np.zeros(5)
+        })
+
+        _, arrays = savefile.load(path)
+        for array in arrays.values():
+            address = array.__array_interface__['data'][0]
+            assert address % savefile.ALIGNMENT == 0
+
+    def test_other_files_and_versions_are_rejected(self, tmp_path):
+        path = str(tmp_path / 'game.sav')
+        with open(path, 'wb') as f:
+            f.write(b'BZh91AY&SY')
+        assert not savefile.is_save_file(path)
+        with pytest.raises(ValueError):
+            savefile.load(path)
+
+        with open(path, 'wb') as f:
+            f.write(savefile.MAGIC)
+            f.write(struct.pack('<II', savefile.FORMAT_VERSION + 1, 2))
+            f.write(b'{}')
+        assert savefile.is_save_file(path)
+        with pytest.raises(ValueError):
+            savefile.load(path)
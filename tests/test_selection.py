@@ -0,0 +1,57 @@
+import numpy as np
+
+from src.selection import polygons_in_region, points_in_polygons
+
+
+def square_segments(left, bottom, size, padding=0):
+    corners = np.array([
+        (left, bottom),
+        (left + size, bottom),
+        (left + size, bottom + size),
+        (left, bottom + size)
+    ], dtype=float)
+    segments = np.stack([corners, np.roll(corners, -1, axis=0)], axis=1)
+    padding = np.repeat(segments[:1, :1], padding, axis=0).repeat(2, axis=1)
+    return np.concatenate([segments, padding])
+
+
+class TestPolygonsInRegion:
+    def test_overlap_and_inside(self):
+        segments = np.stack([
+            square_segments(1, 1, 2),      # Inside
+            square_segments(9, 9, 2),      # Overlapping a corner
+            square_segments(20, 20, 2),    # Outside
+            square_segments(-5, -5, 20),   # Around the whole region
+        ])
+        region = [(0, 0), (10, 0), (10, 10), (0, 10)]
+
+        assert polygons_in_region(segments, region, 'overlap').tolist() == \
+            [True, True, False, True]
+        assert polygons_in_region(segments, region, 'inside').tolist() == \
+            [True, False, False, False]
+
+    def test_crossing_without_vertices_inside_is_overlap(self):
+        # A thin horizontal bar through a thin vertical bar
+        bar = np.array([(-10, 0), (10, 0), (10, 1), (-10, 1)], dtype=float)
+        segments = np.stack([bar, np.roll(bar, -1, axis=0)], axis=1)[None]
+        region = [(0, -10), (1, -10), (1, 10), (0, 10)]
+
+        assert polygons_in_region(segments, region).tolist() == [True]
+
+    def test_lasso_excludes_the_concave_part(self):
+        # An L-shaped lasso, with a square in the notch of the L
+        lasso = [(0, 0), (10, 0), (10, 3), (3, 3), (3, 10), (0, 10)]
+        segments = np.stack([
+            square_segments(5, 5, 2, padding=2),
+            square_segments(0.5, 0.5, 2, padding=2),
+        ])
+
+        assert polygons_in_region(segments, lasso, 'overlap').tolist() == \
+            [False, True]
+
+    def test_points_in_polygons(self):
+        segments = square_segments(0, 0, 1)[None]
+        points = np.array([[(0.5, 0.5), (1.5, 0.5), (-0.5, 0.5)]])
+
+        assert points_in_polygons(points, segments).tolist() == \
+            [[True, False, False]]
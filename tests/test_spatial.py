@@ -0,0 +1,129 @@
+import random
+
+from src.spatial import SpatialHash
+
+
+def brute_force(boxes, bbox):
+    left, bottom, right, top = bbox
+    return {
+        item for item, box in boxes.items()
+        if box[0] <= right and box[2] >= left and
+        box[1] <= top and box[3] >= bottom
+    }
+
+
+class TestSpatialHash:
+    def test_point_query_finds_overlapping_boxes(self):
+        index = SpatialHash(10, 10)
+        index.insert(0, (0, 0, 10, 10))
+        index.insert(1, (5, 5, 15, 15))
+        index.insert(2, (-30, -30, -20, -20))
+
+        assert index.intersect((7, 7, 7, 7)) == {0, 1}
+        assert index.intersect((12, 12, 12, 12)) == {1}
+        assert index.intersect((-25, -25, -25, -25)) == {2}
+        assert index.intersect((100, 100, 100, 100)) == set()
+
+    def test_removed_items_are_not_found(self):
+        index = SpatialHash(10, 10)
+        index.insert(0, (0, 0, 10, 10))
+        index.remove(0, (0, 0, 10, 10))
+
+        assert index.intersect((5, 5, 5, 5)) == set()
+        assert index.cells == {}
+        assert len(index) == 0
+
+    def test_matches_brute_force_after_random_moves(self):
+        rng = random.Random(0)
+        index = SpatialHash(20, 20)
+        boxes = {}
+        for item in range(200):
+            x, y = rng.uniform(-500, 500), rng.uniform(-500, 500)
+            boxes[item] = (x, y, x + 20, y + 20)
+            index.insert(item, boxes[item])
+
+        for _ in range(500):
+            item = rng.randrange(200)
+            x, y = rng.uniform(-5000, 5000), rng.uniform(-5000, 5000)
+            index.remove(item)
+            boxes[item] = (x, y, x + 20, y + 20)
+            index.insert(item, boxes[item])
+
+        for bbox in [(0, 0, 0, 0), (-100, -100, 100, 100),
+                     (-10000, -10000, 10000, 10000)]:
+            assert index.intersect(bbox) == brute_force(boxes, bbox)
+
+    def test_translate_matches_remove_and_insert(self):
+        rng = random.Random(1)
+        translated = SpatialHash(20, 20)
+        reinserted = SpatialHash(20, 20)
+        boxes = {}
+        for item in range(300):
+            x, y = rng.uniform(-200, 200), rng.uniform(-200, 200)
+            boxes[item] = (x, y, x + 20, y + 20)
+            translated.insert(item, boxes[item])
+            reinserted.insert(item, boxes[item])
+
+        for dx, dy in [(3, -2), (25, 0), (-150, 80)]:
+            items = rng.sample(range(300), 100)
+            translated.translate(items, dx, dy)
+            for item in items:
+                x0, y0, x1, y1 = boxes[item]
+                boxes[item] = (x0 + dx, y0 + dy, x1 + dx, y1 + dy)
+                reinserted.remove(item)
+                reinserted.insert(item, boxes[item])
+
+        assert translated.cells == reinserted.cells
+        for bbox in [(0, 0, 0, 0), (-100, -100, 100, 100)]:
+            assert translated.intersect(bbox) == brute_force(boxes, bbox)
+
+    def test_point_query_is_sorted_by_descending_z(self):
+        index = SpatialHash(10, 10)
+        for item, z in enumerate([3, 1, 4, 0, 2]):
+            index.insert(item, (0, 0, 10, 10), z)
+
+        assert index.intersect_point(5, 5) == [2, 0, 4, 1, 3]
+
+        index.set_z([3, 1], [5, 6])
+        assert index.intersect_point(5, 5) == [1, 3, 2, 0, 4]
+
+    def test_cell_version_changes_when_its_items_change(self):
+        index = SpatialHash(10, 10)
+        index.insert(0, (0, 0, 5, 5))
+        index.insert(1, (20, 20, 25, 25))
+        cell = index.cell_at(2, 2)
+        other_cell = index.cell_at(22, 22)
+
+        versions = index.version(cell), index.version(other_cell)
+        index.translate([0], 1, 1)
+        assert index.version(cell) != versions[0]
+        assert index.version(other_cell) == versions[1]
+
+        version = index.version(cell)
+        index.set_z([0], [3])
+        assert index.version(cell) != version
+
+        version = index.version(cell)
+        index.remove(0)
+        assert index.version(cell) != version
+
+    def test_shift_by_whole_cells_keeps_queries_consistent(self):
+        rng = random.Random(3)
+        index = SpatialHash(10, 10)
+        boxes = {}
+        for item in range(100):
+            x = rng.uniform(-100, 100)
+            y = rng.uniform(-100, 100)
+            boxes[item] = (x, y, x + rng.uniform(0, 20), y + 5)
+            index.insert(item, boxes[item])
+
+        index.shift(-3, 2)
+        boxes = {
+            item: (left - 30, bottom + 20, right - 30, top + 20)
+            for item, (left, bottom, right, top) in boxes.items()
+        }
+        for bbox in [(0, 0, 0, 0), (-130, -80, 70, 120), (-50, 0, -40, 30)]:
+            assert index.intersect(bbox) == brute_force(boxes, bbox)
+        left, bottom, right, top = index.bounds()
+        assert left <= min(box[0] for box in boxes.values())
+        assert right >= max(box[2] for box in boxes.values())
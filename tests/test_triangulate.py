@@ -0,0 +1,34 @@
+import numpy as np
+
+from src.bezier import make_random_edges, edge_control_points
+from src.model import make_contours
+from src.triangulate import triangulate
+
+
+def _packed_polygons(nx, ny):
+    num_edges = 2 * nx * ny - nx - ny
+    contours = make_contours(
+        edge_control_points(make_random_edges(num_edges), num_edges),
+        nx, ny, 200, 200)
+    return contours.vertices[contours.indices], contours.offsets
+
+
+class TestTriangulate:
+    def test_every_polygon_is_triangulated(self):
+        vertices, offsets = _packed_polygons(3, 3)
+        triangles, triangle_offsets = triangulate(vertices, offsets)
+
+        counts = np.diff(triangle_offsets)
+        # A simple polygon with n vertices has n - 2 triangles
+        assert np.array_equal(counts, 3 * (np.diff(offsets) - 2))
+        for i in range(9):
+            indices = triangles[triangle_offsets[i]:triangle_offsets[i + 1]]
+            assert indices.max() < offsets[i + 1] - offsets[i]
+
+    def test_worker_processes_give_the_same_result(self):
+        vertices, offsets = _packed_polygons(4, 3)
+        serial = triangulate(vertices, offsets, num_workers=0)
+        parallel = triangulate(vertices, offsets, num_workers=2)
+
+        assert np.array_equal(serial[0], parallel[0])
+        assert np.array_equal(serial[1], parallel[1])
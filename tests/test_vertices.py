@@ -0,0 +1,74 @@
+import math
+
+import numpy as np
+
+from src.bezier import Point, rotate_points
+from src.model import Model
+from src.vertices import place_polygons
+
+
+class CountingList(list):
+    def __init__(self, values):
+        super().__init__(values)
+        self.num_writes = 0
+
+    def __setitem__(self, key, value):
+        self.num_writes += 1
+        super().__setitem__(key, value)
+
+
+class FakeVertexList:
+    def __init__(self, length):
+        self.position = CountingList([0.0] * 3 * length)
+        self.orientation = [0] * length
+
+    @property
+    def vertices(self):
+        return np.array(self.position).reshape(-1, 3)
+
+
+class TestPlacePolygons:
+    def test_matches_rotating_each_polygon(self):
+        rng = np.random.default_rng(0)
+        polygons = [rng.uniform(-10, 10, (n, 2)) for n in [3, 5, 4, 6]]
+        polygon_piece = np.array([0, 0, 1, 2])
+        vertex_lists = [FakeVertexList(len(p)) for p in polygons]
+        x = np.array([1.0, -20, 300])
+        y = np.array([2.0, 40, -5])
+        z = np.array([7.0, 8, 9])
+        r = np.array([0, 1, 3])
+
+        place_polygons(polygons, polygon_piece, vertex_lists, x, y, z, r)
+
+        for polygon, piece, vertex_list in zip(
+                polygons, polygon_piece, vertex_lists):
+            expected = rotate_points(
+                polygon, Point(0, 0), r[piece] * math.pi / 2)
+            expected += (x[piece], y[piece])
+            vertices = vertex_list.vertices
+            assert np.allclose(vertices[:, :2], expected)
+            assert np.all(vertices[:, 2] == z[piece])
+            assert vertex_list.orientation == [r[piece]] * len(polygon)
+
+    def test_spread_out_pieces_get_one_vertex_update(self, small_puzzle):
+        model = Model()
+        model.reset(seed=4)
+        events = []
+        model.push_handlers(on_pieces_moved=lambda *args: events.append(args))
+        model.spread_out(list(model.pieces))
+
+        [(pids, x, y, z, rotation)] = events
+        pieces = [model.pieces[pid] for pid in pids.tolist()]
+        polygons = [
+            polygon for piece in pieces for polygon in piece.polygon.values()
+        ]
+        polygon_piece = np.repeat(
+            np.arange(len(pieces)), [len(piece.polygon) for piece in pieces])
+        vertex_lists = [FakeVertexList(len(polygon)) for polygon in polygons]
+        place_polygons(
+            polygons, polygon_piece, vertex_lists, x, y, z, rotation)
+
+        assert all(
+            vertex_list.position.num_writes == 1
+            for vertex_list in vertex_lists
+        )